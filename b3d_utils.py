@@ -325,6 +325,38 @@ def new_mesh(
     return mesh
 
 
+# -----------------------------------------------------------------------------
+def new_mesh_from_arrays(_verts:np.ndarray, _edges:np.ndarray, _name:str) -> Mesh:
+    """
+    Bulk version of `new_mesh` for large meshes without faces, e.g. polylines. 
+    The arrays are copied with `foreach_set`, without creating a Python object per element.
+
+    `_verts`: (N, 3) float array, `_edges`: (E, 2) int array
+    """
+    mesh = bpy.data.meshes.new(_name)
+
+    # foreach_set only takes the fast path for buffers that match the internal type
+    mesh.vertices.add(len(_verts))
+    mesh.vertices.foreach_set('co', np.ascontiguousarray(_verts, dtype=np.float32).ravel())
+
+    mesh.edges.add(len(_edges))
+    mesh.edges.foreach_set('vertices', np.ascontiguousarray(_edges, dtype=np.int32).ravel())
+
+    mesh.update()
+
+    return mesh
+
+
+# -----------------------------------------------------------------------------
+def polyline_edges(_num_verts:int) -> np.ndarray:
+    """Returns the (N - 1, 2) edges connecting each vertex to the next one"""
+    edges = np.empty((max(_num_verts - 1, 0), 2), dtype=np.int32)
+    edges[:, 0] = np.arange(len(edges), dtype=np.int32)
+    edges[:, 1] = edges[:, 0] + 1
+
+    return edges
+
+
 # -----------------------------------------------------------------------------
 # https://blender.stackexchange.com/questions/50160/scripting-low-level-join-meshes-elements-hopefully-with-bmesh
 def join_meshes(_meshes:list[Mesh]):
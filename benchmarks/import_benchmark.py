@@ -0,0 +1,111 @@
+"""
+Measures peak RSS and throughput of `core.log_reader.read_log` for synthetic medge-state-logging files.
+
+Runs with plain CPython, Blender is not required:
+
+    python benchmarks/import_benchmark.py --sizes 100000 1000000 10000000
+
+Every measurement runs in a fresh process, because peak RSS can only grow within a process.
+"""
+import argparse, os, subprocess, sys, tempfile, time
+from   pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+# -----------------------------------------------------------------------------
+def write_log(_filepath:Path, _samples:int, _seed=0):
+    import numpy as np
+
+    rng = np.random.default_rng(_seed)
+    batch = 100_000
+
+    with open(_filepath, 'w') as f:
+        f.write('[')
+
+        for start in range(0, _samples, batch):
+            n = min(batch, _samples - start)
+            states = rng.integers(1, 94, n)
+            locs = rng.normal(0, 1000, (n, 3))
+            secs = (np.arange(start, start + n) * 0.016)
+
+            items = (
+                f'{{"state": {s}, "timestamp": "{int(t // 3600)}:{int(t // 60 % 60)}:{t % 60:.3f}", '
+                f'"location": {{"x": {x:.3f}, "y": {y:.3f}, "z": {z:.3f}}}}}'
+                for s, t, (x, y, z) in zip(states, secs, locs)
+            )
+
+            if start > 0: f.write(',\n')
+            f.write(',\n'.join(items))
+
+        f.write(']')
+
+
+# -----------------------------------------------------------------------------
+def peak_rss_mb() -> float:
+    try:
+        import resource
+    except ImportError:
+        return float('nan')
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports KiB, macOS reports bytes
+    if sys.platform == 'darwin':
+        return peak / (1 << 20)
+
+    return peak / (1 << 10)
+
+
+# -----------------------------------------------------------------------------
+def measure(_filepath:str, _mode:str):
+    sys.path.insert(0, str(ROOT))
+    from src.core.log_reader import read_log
+
+    baseline = peak_rss_mb()
+
+    start = time.perf_counter()
+    states, _, _ = read_log(_filepath, _mode == 'stream')
+    elapsed = time.perf_counter() - start
+
+    print(len(states), elapsed, baseline, peak_rss_mb())
+
+
+# -----------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100_000, 1_000_000, 10_000_000])
+    parser.add_argument('--modes', nargs='+', default=['load', 'stream'], choices=['load', 'stream'])
+    parser.add_argument('--directory', help='Where to write the synthetic logs, defaults to a temporary directory')
+    parser.add_argument('--measure', nargs=2, metavar=('FILE', 'MODE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(*args.measure)
+        return
+
+    directory = Path(args.directory or tempfile.mkdtemp(prefix='medge_bench_'))
+    directory.mkdir(parents=True, exist_ok=True)
+
+    print(f'{"samples":>10} {"mode":>7} {"file MB":>9} {"seconds":>9} {"rows/s":>12} {"peak RSS MB":>12} {"delta MB":>9}')
+
+    for size in args.sizes:
+        filepath = directory / f'log_{size}.json'
+
+        if not filepath.exists():
+            write_log(filepath, size)
+
+        file_mb = os.path.getsize(filepath) / (1 << 20)
+
+        for mode in args.modes:
+            out = subprocess.run([sys.executable, __file__, '--measure', str(filepath), mode],
+                                 check=True, capture_output=True, text=True).stdout
+
+            n, elapsed, baseline, peak = (float(v) for v in out.split())
+
+            print(f'{int(n):>10} {mode:>7} {file_mb:>9.1f} {elapsed:>9.2f} {n / elapsed:>12.0f} {peak:>12.1f} {peak - baseline:>9.1f}')
+
+
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,6 @@
 import bpy
 from bpy.types    import AddonPreferences, Context
-from bpy.props    import BoolProperty
+from bpy.props    import BoolProperty, StringProperty, IntProperty
 
 
 # -----------------------------------------------------------------------------
@@ -15,10 +15,38 @@ class MET_map_gen_preferences(AddonPreferences):
         default=False,
     )
 
+    use_dataset_cache : BoolProperty(
+        name='Use Dataset Cache',
+        description='Store imported logs in a binary cache, so that importing them again skips parsing',
+        default=True,
+    )
+
+    dataset_cache_directory : StringProperty(
+        name='Dataset Cache Directory',
+        description='Leave empty to write the cache next to each log',
+        subtype='DIR_PATH',
+    )
+
+    dataset_cache_size_limit : IntProperty(
+        name='Dataset Cache Size Limit (MB)',
+        description='Least recently used logs are removed from the cache directory when it grows beyond this size',
+        default=4096,
+        min=0,
+    )
+
     def draw(self, _context:Context):
         layout = self.layout
         layout.prop(self, 'enable_evaluation')
 
+        col = layout.column()
+        col.prop(self, 'use_dataset_cache')
+
+        if self.use_dataset_cache:
+            col.prop(self, 'dataset_cache_directory')
+
+            if self.dataset_cache_directory:
+                col.prop(self, 'dataset_cache_size_limit')
+
 
 # -----------------------------------------------------------------------------
 def get_prefs() -> MET_map_gen_preferences:
@@ -0,0 +1,353 @@
+"""
+Runs the whole pipeline without the UI: logs -> transition matrix -> chains -> maps -> layouts, exports and a timing report.
+
+With Blender, the module library is the opened .blend, maps are built from its curve modules and can be exported to T3D:
+
+    blender --background library.blend --python scripts/generate_maps.py -- logs/ --seeds 0 100 --lengths 96 --export
+
+With plain CPython only the core is used. The module library is a JSON file, written once from the .blend with `--write-library`:
+
+    blender --background library.blend --python scripts/generate_maps.py -- --write-library modules.json
+    python scripts/generate_maps.py logs/ --library modules.json --seeds 0 10000 --lengths 96 200
+
+For every ( length, seed ) a layout is written to `<output>/layouts`, the timings are written to `<output>/report.csv` and
+`<output>/report.json`.
+"""
+import argparse, csv, importlib, json, sys
+from   pathlib  import Path
+from   time     import perf_counter
+
+ROOT = Path(__file__).resolve().parent.parent
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+
+# -----------------------------------------------------------------------------
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('logs', nargs='*', help='Log files or directories with .json logs')
+    parser.add_argument('--collection', help='Blender only: train on the datasets in this collection instead of logs')
+    parser.add_argument('--library', help='Core only: module library written with --write-library')
+    parser.add_argument('--write-library', metavar='FILE', help='Blender only: write the module library of the .blend and exit')
+    # Same range as MarkovChain.MAX_ORDER, the core is only imported after the arguments are parsed
+    parser.add_argument('--order', type=int, default=1, choices=range(1, 5), help='Order of the Markov model, 1 to 4')
+
+    parser.add_argument('--seeds', type=int, nargs=2, metavar=('START', 'STOP'), default=(0, 1), help='Range of chain seeds')
+    parser.add_argument('--lengths', type=int, nargs='+', default=[96], help='Chain lengths')
+    parser.add_argument('--align-orientation', action='store_true')
+    parser.add_argument('--no-resolve', action='store_true', help='Do not resolve intersections')
+    parser.add_argument('--max-resolve-attempts', type=int, default=50)
+
+    parser.add_argument('--output', default='generated_maps')
+    parser.add_argument('--export', action='store_true', help='Blender only: export every map to T3D')
+    parser.add_argument('--save-blend', action='store_true', help='Blender only: keep the maps and save them to <output>/maps.blend')
+    parser.add_argument('--workers', type=int, default=0, help='Processes used to parse logs, 0 uses all cores')
+    parser.add_argument('--cache-directory', help='Cache decoded logs, an empty string stores the cache next to each log')
+    parser.add_argument('--quiet', action='store_true')
+
+    # Blender passes its own arguments, ours come after '--'
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else sys.argv[1:]
+
+    return parser.parse_args(argv)
+
+
+# -----------------------------------------------------------------------------
+def collect_logs(_paths:list[str]) -> list[str]:
+    filepaths = []
+
+    for path in map(Path, _paths):
+        if path.is_dir():
+            filepaths.extend(str(p) for p in sorted(path.glob('*.json')))
+        else:
+            filepaths.append(str(path))
+
+    return filepaths
+
+
+# -----------------------------------------------------------------------------
+class Report:
+    COLUMNS = ('length', 'seed', 'states', 'chain_time', 'build_time', 'place_time', 'resolve_time', 'hits', 'export_time')
+
+    def __init__(self, _output:Path):
+        self.output = _output
+        self.summary = {}
+        self.rows:list[tuple] = []
+
+
+    def add(self, **_row):
+        self.rows.append(tuple(_row.get(c, 0) for c in self.COLUMNS))
+
+
+    def write(self):
+        with open(self.output / 'report.csv', 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.COLUMNS)
+            writer.writerows(self.rows)
+
+        with open(self.output / 'report.json', 'w') as f:
+            json.dump({'summary': self.summary, 'maps': [dict(zip(self.COLUMNS, r)) for r in self.rows]}, f, indent=1)
+
+
+# -----------------------------------------------------------------------------
+def write_layout(_filepath:Path, _seed:int, _length:int, _states:list[int], _modules:list[tuple[int, str, list]]):
+    layout = {
+        'seed'    : _seed,
+        'length'  : _length,
+        'states'  : [int(s) for s in _states],
+        'modules' : [{'state': int(s), 'module': name, 'matrix': matrix} for s, name, matrix in _modules],
+    }
+
+    with open(_filepath, 'w') as f:
+        json.dump(layout, f)
+
+
+# -----------------------------------------------------------------------------
+def train(_args:argparse.Namespace, _report:Report, _core) -> 'MarkovChain':
+    """Parses the logs and trains the transition matrix with the core, which gives the same runs as the dataset meshes"""
+    log_reader = importlib.import_module(f'{_core}.log_reader')
+    dataset    = importlib.import_module(f'{_core}.dataset')
+    markov     = importlib.import_module(f'{_core}.markov')
+
+    filepaths = collect_logs(_args.logs)
+
+    if not filepaths:
+        raise SystemExit('No logs found')
+
+    cache = None
+
+    if _args.cache_directory is not None:
+        cache = log_reader.LogCache(_args.cache_directory or None)
+
+    start = perf_counter()
+    sequences = []
+    samples = 0
+
+    for log in log_reader.load_logs(filepaths, True, _args.workers or None, cache):
+        sequences.append(dataset.SequenceRuns(log.states, log.sequence_starts, log.locations).states)
+        samples += len(log.states)
+
+    import_time = perf_counter() - start
+
+    start = perf_counter()
+    mc = markov.MarkovChain()
+    mc.create_transition_matrix(sequences, 'cli', _args.order)
+    train_time = perf_counter() - start
+
+    _report.summary.update(logs=len(filepaths), samples=samples, import_time=import_time, train_time=train_time)
+
+    return mc
+
+
+# -----------------------------------------------------------------------------
+def expected_statistics(_mc:'MarkovChain', _length:int, _core_map) -> dict:
+    """What the chains of `_length` states contain on average, computed from the transition matrix"""
+    visits, runs = _mc.expected_counts(_length)
+    candidates = [int(s) for s in _core_map.RESOLVE_CANDIDATE_STATES if s < _mc.nstates]
+
+    return {
+        'resolve_candidate_density' : float(visits[candidates].sum() / max(_length, 1)),
+        'runs'                      : {_core_map.State(k).name: float(r) for k, r in enumerate(runs) if r > 1e-6},
+    }
+
+
+# -----------------------------------------------------------------------------
+def run_core(_args:argparse.Namespace, _output:Path, _report:Report):
+    sys.path.insert(0, str(ROOT))
+
+    from src.core         import map as core_map
+    from src.core.map     import PrototypeMap, MapSettings
+    from src.core.modules import load_prototypes
+
+    if not _args.library:
+        raise SystemExit('--library is required without Blender')
+
+    if _args.export or _args.save_blend or _args.collection:
+        raise SystemExit('--export, --save-blend and --collection require Blender')
+
+    prototypes = load_prototypes(_args.library)
+    mc = train(_args, _report, 'src.core')
+
+    for length in _args.lengths:
+        _report.summary.setdefault('expected', {})[length] = expected_statistics(mc, length, core_map)
+
+        seeds = range(*_args.seeds)
+
+        start = perf_counter()
+        chains = mc.generate_chains(length, seeds, _constrained=True)
+        chain_time = (perf_counter() - start) / max(len(seeds), 1)
+
+        for seed, chain in zip(seeds, chains):
+            states = chain.tolist()
+
+            settings = MapSettings(seed, -1, _args.align_orientation, not _args.no_resolve, _args.max_resolve_attempts)
+
+            map = PrototypeMap(prototypes, None, settings)
+            map.debug = False
+            map.prepare(states)
+            build_time, place_times, resolve_times, hits = map.build()
+
+            placed = [(cm.state, cm.module_name, cm.matrix.tolist()) for cm in map]
+            write_layout(_output / 'layouts' / f'{length}_{seed}.json', seed, length, states, placed)
+
+            _report.add(length=length, seed=seed, states=len(states), chain_time=chain_time,
+                        build_time=build_time, place_time=sum(place_times), resolve_time=sum(resolve_times), hits=sum(hits))
+
+            if not _args.quiet:
+                print(f'{length} {seed}: {len(states)} states, {build_time:.2f}s, {sum(hits)} hits')
+
+
+# -----------------------------------------------------------------------------
+def load_addon():
+    """Returns the name of the add-on package, it is enabled if it is installed and imported from this repository otherwise"""
+    import addon_utils
+
+    for name in (ROOT.name, ROOT.name.replace('-', '_')):
+        if name in sys.modules or addon_utils.enable(name, default_set=False):
+            return name
+
+    sys.path.insert(0, str(ROOT.parent))
+    importlib.import_module(ROOT.name).register()
+
+    return ROOT.name
+
+
+# -----------------------------------------------------------------------------
+def write_library(_filepath:str):
+    addon = load_addon()
+
+    modules      = importlib.import_module(f'{addon}.src.modules')
+    core_modules = importlib.import_module(f'{addon}.src.core.modules')
+
+    module_groups = modules.get_curve_module_groups_prop(bpy.context).items
+    core_modules.save_prototypes(_filepath, modules.module_prototypes(module_groups))
+
+    print(f'Module library saved to: {_filepath}')
+
+
+# -----------------------------------------------------------------------------
+def run_blender(_args:argparse.Namespace, _output:Path, _report:Report):
+    addon = load_addon()
+
+    b3d_utils = importlib.import_module(f'{addon}.b3d_utils')
+    map_      = importlib.import_module(f'{addon}.src.map')
+    markov    = importlib.import_module(f'{addon}.src.markov')
+    modules   = importlib.import_module(f'{addon}.src.modules')
+    export    = importlib.import_module(f'{addon}.src.export')
+    core_map  = importlib.import_module(f'{addon}.src.core.map')
+
+    context = bpy.context
+    module_groups = modules.get_curve_module_groups_prop(context).items
+
+    # Train
+    if _args.collection:
+        start = perf_counter()
+        item = markov.get_markov_chains_prop(context).add()
+        item.collection = bpy.data.collections[_args.collection]
+        item.order = _args.order
+        item.create_transition_matrix()
+
+        if not (mc := item.data()):
+            raise SystemExit(f'No datasets in collection: {_args.collection}')
+
+        _report.summary.update(collection=_args.collection, train_time=perf_counter() - start)
+
+    else:
+        mc = train(_args, _report, f'{addon}.src.core')
+
+    settings = map_.get_medge_map_gen_settings(context)
+    settings.length = -1
+    settings.align_orientation = _args.align_orientation
+    settings.resolve_intersection = not _args.no_resolve
+    settings.max_resolve_attempts = _args.max_resolve_attempts
+
+    main_collection = b3d_utils.new_collection('BATCH')
+
+    for length in _args.lengths:
+        _report.summary.setdefault('expected', {})[length] = expected_statistics(mc, length, core_map)
+
+        seeds = range(*_args.seeds)
+
+        start = perf_counter()
+        chains = mc.generate_chains(length, seeds, _constrained=True)
+        chain_time = (perf_counter() - start) / max(len(seeds), 1)
+
+        for seed, chain in zip(seeds, chains):
+            states = map_.filter_states(chain.tolist(), settings, True)
+
+            settings.seed = seed
+            collection = b3d_utils.new_collection(f'GENERATED_{length}_{seed}', main_collection)
+
+            map = map_.Map(None, settings)
+            map.debug = False
+            map.prepare(states, module_groups)
+            build_time, place_times, resolve_times, hits = map.build(collection)
+
+            placed = [(cm.state, cm.module_name, cm.matrix.tolist()) for cm in map]
+            write_layout(_output / 'layouts' / f'{length}_{seed}.json', seed, length, states, placed)
+
+            export_time = 0
+
+            if _args.export:
+                start = perf_counter()
+                export.prepare_for_export(settings, collection)
+                export.export_t3d(collection, str(_output / 't3d' / f'{length}_{seed}.t3d'))
+                export_time = perf_counter() - start
+
+            # Removing the collections leaves the objects and their copied data behind
+            if not _args.save_blend:
+                for obj in list(collection.all_objects):
+                    bpy.data.objects.remove(obj, do_unlink=True)
+
+                b3d_utils.delete_hierarchy(collection)
+                bpy.data.orphans_purge(do_recursive=True)
+
+            _report.add(length=length, seed=seed, states=len(states), chain_time=chain_time,
+                        build_time=build_time, place_time=sum(place_times), resolve_time=sum(resolve_times), hits=sum(hits),
+                        export_time=export_time)
+
+            if not _args.quiet:
+                print(f'{length} {seed}: {len(states)} states, {build_time:.2f}s, {sum(hits)} hits')
+
+    if _args.save_blend:
+        bpy.ops.wm.save_as_mainfile(filepath=str(_output / 'maps.blend'), copy=True)
+
+
+# -----------------------------------------------------------------------------
+def main():
+    args = parse_args()
+
+    if args.write_library:
+        if not bpy:
+            raise SystemExit('--write-library requires Blender')
+
+        write_library(args.write_library)
+        return
+
+    output = Path(args.output).resolve()
+
+    for directory in ('layouts', 't3d') if args.export else ('layouts',):
+        (output / directory).mkdir(parents=True, exist_ok=True)
+
+    report = Report(output)
+    report.summary.update(mode='blender' if bpy else 'core', seeds=list(args.seeds), lengths=args.lengths)
+
+    start = perf_counter()
+
+    if bpy:
+        run_blender(args, output, report)
+    else:
+        run_core(args, output, report)
+
+    report.summary['total_time'] = perf_counter() - start
+
+    report.write()
+
+    print(f'Generated {len(report.rows)} maps in {report.summary["total_time"]:.2f}s, see {output}')
+
+
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
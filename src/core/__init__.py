@@ -0,0 +1,4 @@
+"""
+Parts of the map generator that do not depend on Blender: reading logs, datasets, the Markov model and the map solver.
+Everything in here runs with plain CPython and numpy.
+"""
@@ -0,0 +1,105 @@
+"""
+Broadphase for intersection checks: finds the modules whose bounds overlap, only those need an exact test.
+"""
+import numpy       as np
+from   collections import defaultdict
+from   itertools   import product
+from   typing      import Hashable
+
+
+# -----------------------------------------------------------------------------
+class SpatialHashGrid:
+    """
+    Uniform grid of axis aligned bounding boxes, only the cells that contain a box are stored.
+    A box is registered in every cell it overlaps, so a query only visits the cells of the queried box.
+
+    Without `_cell_size` the cells get the size of the largest side of the first box, `PrototypeMap` sizes them 
+    from the module library. Boxes that would cover more than `_max_cells` cells are kept in a list that every query 
+    checks, so a box that is much larger than the cells never registers in a cubic number of them.
+    """
+    def __init__(self, _cell_size:float=None, _max_cells=512):
+        self.cell_size = _cell_size
+        self.max_cells = _max_cells
+
+        self.cells:dict[tuple[int, int, int], set[Hashable]] = defaultdict(set)
+        self.boxes:dict[Hashable, tuple[list[float], list[float], list[tuple[int, int, int]]]] = {}
+        # Keys of the boxes that are too large for the cells
+        self.large:set[Hashable] = set()
+
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __contains__(self, _key:Hashable):
+        return _key in self.boxes
+
+
+    def __cells(self, _min:np.ndarray, _max:np.ndarray) -> list[tuple[int, int, int]] | None:
+        """Returns the cells of the box, or None if there are more than `max_cells`"""
+        lo = np.floor(np.asarray(_min, dtype=float) / self.cell_size).astype(int).tolist()
+        hi = np.floor(np.asarray(_max, dtype=float) / self.cell_size).astype(int).tolist()
+
+        if np.prod([b - a + 1 for a, b in zip(lo, hi)], dtype=float) > self.max_cells:
+            return None
+
+        return list(product(*(range(a, b + 1) for a, b in zip(lo, hi))))
+
+
+    def update(self, _key:Hashable, _min:np.ndarray, _max:np.ndarray):
+        """Inserts the box of `_key` or moves it"""
+        if self.cell_size is None:
+            self.cell_size = max(float(np.max(np.subtract(_max, _min))), 1e-3)
+
+        if _key in self.boxes:
+            self.remove(_key)
+
+        if (cells := self.__cells(_min, _max)) is None:
+            self.large.add(_key)
+            cells = []
+
+        for cell in cells:
+            self.cells[cell].add(_key)
+
+        self.boxes[_key] = (np.asarray(_min, dtype=float).tolist(), np.asarray(_max, dtype=float).tolist(), cells)
+
+
+    def remove(self, _key:Hashable):
+        if (box := self.boxes.pop(_key, None)) is None:
+            return
+
+        self.large.discard(_key)
+
+        for cell in box[2]:
+            keys = self.cells[cell]
+            keys.discard(_key)
+
+            if not keys:
+                del self.cells[cell]
+
+
+    def query(self, _min:np.ndarray, _max:np.ndarray) -> set[Hashable]:
+        """Returns the keys of the boxes that overlap or touch the box"""
+        if self.cell_size is None:
+            return set()
+
+        if (cells := self.__cells(_min, _max)) is None:
+            # Checking every box is cheaper than visiting the cells
+            found = self.boxes.keys()
+
+        else:
+            found = set(self.large)
+
+            for cell in cells:
+                if (keys := self.cells.get(cell)):
+                    found |= keys
+
+        # Boxes that share a cell do not necessarily overlap
+        lo = np.asarray(_min, dtype=float).tolist()
+        hi = np.asarray(_max, dtype=float).tolist()
+
+        return {k for k in found if overlap(lo, hi, *self.boxes[k][:2])}
+
+
+# -----------------------------------------------------------------------------
+def overlap(_min1:list[float], _max1:list[float], _min2:list[float], _max2:list[float]) -> bool:
+    return all(a <= d and c <= b for a, b, c, d in zip(_min1, _max1, _min2, _max2))
@@ -0,0 +1,69 @@
+"""
+Rules that remove and replace states that result in non-solvable level segments.
+
+The rules only look at the previous state and at most `LOOKAHEAD` next states, so they can be applied to a chain while it
+is sampled: a state is decided as soon as the `LOOKAHEAD` states after it are known.
+"""
+import numpy as np
+
+from .states import State
+
+
+# -----------------------------------------------------------------------------
+LOOKAHEAD = 3
+
+# Sentinel for states before the start and after the end of a chain
+NO_STATE = -1
+
+
+# -----------------------------------------------------------------------------
+def apply_constraints(_states:np.ndarray, _closed=True) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns ( keep, states ): which states remain and what they are replaced with, along the first axis of `_states`.
+    A closed chain ends with its last state, all states are decided.
+    An open chain continues, only the first `len(_states) - LOOKAHEAD` states are decided and returned.
+    """
+    s = np.asarray(_states, dtype=np.int16)
+
+    if _closed:
+        s = np.concatenate((s, np.full((LOOKAHEAD,) + s.shape[1:], NO_STATE, dtype=s.dtype)))
+
+    m = max(len(s) - LOOKAHEAD, 0)
+
+    state = s[:m]
+    nxt   = s[1:m + 1]
+    prev  = np.concatenate((np.full((1,) + s.shape[1:], NO_STATE, dtype=s.dtype), s[:max(m - 1, 0)]))[:m]
+
+    # Case 1: Jump -> WallClimbing
+    # To go into WallClimbing the jump distance should be short, but the some jump modules can be to long. To solve this we just ignore the jump.
+    # Case 2: Jump -> WallRunningLeft or WallRunningRight
+    # Similar to Case 1, where the jump distance should be short.
+    drop = (state == State.Jump) & ((nxt == State.WallClimbing) | (nxt == State.WallRunningLeft) | (nxt == State.WallRunningRight))
+
+    # Case 3: WallClimbing -> WallClimb180TurnJump
+    # To do a WallClimb180TurnJump the height of the wall can be longer than the player can climb. WallClimbing can be followed by GrabPullUp. Therefore, we ignore WallClimbing and WallClimb180TurnJump should have its own wall.
+    drop |= (state == State.WallClimbing) & (nxt == State.WallClimb180TurnJump)
+
+    # Case 4: WallClimb180TurnJump -> Falling
+    # A falling curve can go quite low and could end up back where the player came from. In this case, Falling will be ignored.
+    drop |= (state == State.Falling) & (prev == State.WallClimb180TurnJump)
+
+    # Case 5: WallRunning[Left, Right] > WallRunJump > WallClimbing > WallClimbing180Jump
+    # If you want to perform a WallClimbing180Jump after a WallRun, then you cannot be wall running for long and you are always jumping perpendicular after a wall run. These properties are not implicitly adhered to when choosing modules from each state and can result in a non-solvable level segment. To solve this, extra states have been made, namely: `WallRunningLeftWallClimb180TurnJump` and `WallRunningRightWallClimb180TurnJump`.
+    left  = state == State.WallRunningLeft
+    right = state == State.WallRunningRight
+
+    merge = ((left | right) &
+             (s[1:m + 1] == State.WallRunJump) &
+             (s[2:m + 2] == State.WallClimbing) &
+             (s[3:m + 3] == State.WallClimb180TurnJump))
+
+    # The 3 merged states are skipped, none of them starts another merge
+    for k in range(1, LOOKAHEAD + 1):
+        drop[k:] |= merge[:max(m - k, 0)]
+
+    states = state.copy()
+    states[merge & left]  = State.WallRunningLeftWallClimb180TurnJump
+    states[merge & right] = State.WallRunningRightWallClimb180TurnJump
+
+    return ~drop, states
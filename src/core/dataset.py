@@ -0,0 +1,295 @@
+"""
+Columnar storage of datasets and the state runs within them.
+"""
+import numpy       as np
+from   enum        import Enum
+from   collections import UserList
+from   typing      import Generator
+
+from .log_reader import find_sequence_starts
+
+
+# -----------------------------------------------------------------------------
+class LayerType(str, Enum):
+    NONE         = 'NONE'
+    INT          = 'INT'
+    FLOAT_VECTOR = 'FLOAT_VECTOR'
+
+
+# -----------------------------------------------------------------------------
+# https://stackoverflow.com/questions/43862184/associating-string-representations-with-an-enum-that-uses-integer-values
+class Attribute(int, Enum):
+    def __new__(cls, _value: int, _label: str, _type: str):
+        obj = int.__new__(cls, _value)
+        obj._value_ = _value
+        obj.index = _value
+        obj.label = _label
+        obj.type = _type
+        
+        return obj
+    
+    def __int__(self):
+        return self.value
+    
+    @classmethod
+    def from_string(cls, _s):
+        for att in cls:
+            if att.label == _s:
+                return att
+            
+        raise ValueError(cls.__name__ + ' has no value matching "' + _s + '"')
+
+    # From .json file
+    STATE           = 0, 'state'          , LayerType.INT
+    LOCATION        = 1, 'location'       , LayerType.NONE
+    TIMESTAMP       = 2, 'timestamp'      , LayerType.FLOAT_VECTOR
+    
+    # These will be updated after import
+    # A vertex is a sequence start when it has a different state than the previous vertex or it is disconnected from the previous vertex
+    SEQUENCE_START  = 3, 'sequence_start' , LayerType.INT
+
+
+# -----------------------------------------------------------------------------
+class DatabaseEntry(UserList):
+    def __init__(self) -> None:
+        data = []
+
+        for att in Attribute:
+            match(att.type):
+                case LayerType.NONE:
+                    data.append(None)
+                case LayerType.INT:
+                    data.append(0)
+                case LayerType.FLOAT_VECTOR:
+                    data.append(np.zeros(3, dtype=np.float32))
+
+        self.data = np.array(data, dtype=object)
+
+
+    def __getitem__(self, _key:int|str):
+        if isinstance(_key, int):
+            return self.data[_key]
+        
+        if isinstance(_key, str):
+            return self.data[Attribute.from_string(_key).index]
+    
+
+    def __setitem__(self, _key:int|str, _value):
+        if isinstance(_key, int):        
+            self.data[_key] = _value
+
+        if isinstance(_key, str):
+            self.data[Attribute.from_string(_key).index] = _value
+
+
+# -----------------------------------------------------------------------------
+class Dataset:
+    """
+    Columnar storage for the logged samples. Every attribute lives in its own typed array:
+    
+    `states` int16 (N,), `locations` float32 (N, 3), `timestamps` float32 (N, 3), `sequence_starts` bool (N,)
+
+    Rows are only materialized as a `DatabaseEntry` when a single sample is indexed.
+    """
+    def __init__(self, _capacity=0):
+        self._states          = np.zeros(_capacity, dtype=np.int16)
+        self._locations       = np.zeros((_capacity, 3), dtype=np.float32)
+        self._timestamps      = np.zeros((_capacity, 3), dtype=np.float32)
+        self._sequence_starts = np.zeros(_capacity, dtype=bool)
+        self._size = 0
+
+
+    @classmethod
+    def from_arrays(cls, 
+                    _states:np.ndarray, 
+                    _locations:np.ndarray, 
+                    _timestamps:np.ndarray, 
+                    _sequence_starts:np.ndarray=None) -> 'Dataset':
+        """Wraps the arrays without copying them if they already have the right dtype"""
+        dataset = cls()
+        dataset._states     = np.asarray(_states, dtype=np.int16)
+        dataset._locations  = np.asarray(_locations, dtype=np.float32).reshape(-1, 3)
+        dataset._timestamps = np.asarray(_timestamps, dtype=np.float32).reshape(-1, 3)
+
+        if _sequence_starts is None:
+            _sequence_starts = find_sequence_starts(dataset._states)
+
+        dataset._sequence_starts = np.asarray(_sequence_starts, dtype=bool)
+        dataset._size = len(dataset._states)
+
+        return dataset
+    
+
+    @classmethod
+    def concatenate(cls, _datasets:list['Dataset']) -> 'Dataset':
+        return cls.from_arrays(
+            np.concatenate([d.states          for d in _datasets]),
+            np.concatenate([d.locations       for d in _datasets]),
+            np.concatenate([d.timestamps      for d in _datasets]),
+            np.concatenate([d.sequence_starts for d in _datasets]),
+        )
+
+
+    @property
+    def states(self) -> np.ndarray:
+        return self._states[:self._size]
+
+    @property
+    def locations(self) -> np.ndarray:
+        return self._locations[:self._size]
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self._timestamps[:self._size]
+
+    @property
+    def sequence_starts(self) -> np.ndarray:
+        return self._sequence_starts[:self._size]
+
+
+    def column(self, _att:Attribute|int) -> np.ndarray:
+        match(Attribute(_att)):
+            case Attribute.STATE:
+                return self.states
+            case Attribute.LOCATION:
+                return self.locations
+            case Attribute.TIMESTAMP:
+                return self.timestamps
+            case Attribute.SEQUENCE_START:
+                return self.sequence_starts
+
+
+    def __len__(self):
+        return self._size
+
+
+    def __getitem__(self, _key):
+        # Attribute indexed access, e.g. `dataset[:, Attribute.STATE.index]`
+        if isinstance(_key, tuple):
+            rows, att = _key
+            return self.column(att)[rows]
+        
+        if isinstance(_key, (int, np.integer)):
+            return self.entry(int(_key))
+
+        # Slices return views, index arrays return copies (same as numpy)
+        return Dataset.from_arrays(self.states[_key], 
+                                   self.locations[_key], 
+                                   self.timestamps[_key], 
+                                   self.sequence_starts[_key])
+    
+
+    def __setitem__(self, _key, _value):
+        if isinstance(_key, tuple):
+            rows, att = _key
+            self.column(att)[rows] = _value
+            return
+
+        self.states[_key]          = _value[Attribute.STATE.index]
+        self.locations[_key]       = _value[Attribute.LOCATION.index]
+        self.timestamps[_key]      = _value[Attribute.TIMESTAMP.index]
+        self.sequence_starts[_key] = _value[Attribute.SEQUENCE_START.index]
+
+
+    def entry(self, _index:int) -> DatabaseEntry:
+        entry = DatabaseEntry()
+        entry[Attribute.STATE.index]          = int(self.states[_index])
+        entry[Attribute.LOCATION.index]       = self.locations[_index].copy()
+        entry[Attribute.TIMESTAMP.index]      = self.timestamps[_index].copy()
+        entry[Attribute.SEQUENCE_START.index] = bool(self.sequence_starts[_index])
+
+        return entry
+
+
+    def reserve(self, _capacity:int):
+        if _capacity <= len(self._states): return
+
+        # Grow geometrically, so that repeated appends are amortized O(1)
+        capacity = max(_capacity, 2 * len(self._states))
+
+        def grow(_array:np.ndarray) -> np.ndarray:
+            new = np.zeros((capacity,) + _array.shape[1:], dtype=_array.dtype)
+            new[:self._size] = _array[:self._size]
+            return new
+
+        self._states          = grow(self._states)
+        self._locations       = grow(self._locations)
+        self._timestamps      = grow(self._timestamps)
+        self._sequence_starts = grow(self._sequence_starts)
+
+
+    def append(self, _entry:DatabaseEntry):
+        self.reserve(self._size + 1)
+        self._size += 1
+        self[self._size - 1] = _entry
+
+
+    def append_arrays(self, 
+                      _states:np.ndarray, 
+                      _locations:np.ndarray, 
+                      _timestamps:np.ndarray, 
+                      _sequence_starts:np.ndarray):
+        n = len(_states)
+        start, stop = self._size, self._size + n
+
+        self.reserve(stop)
+
+        self._states[start:stop]          = _states
+        self._locations[start:stop]       = np.reshape(_locations, (n, 3))
+        self._timestamps[start:stop]      = np.reshape(_timestamps, (n, 3))
+        self._sequence_starts[start:stop] = _sequence_starts
+        self._size = stop
+
+
+    def extend(self, _other:'Dataset'):
+        self.append_arrays(_other.states, _other.locations, _other.timestamps, _other.sequence_starts)
+
+
+# -----------------------------------------------------------------------------
+class SequenceRuns:
+    """
+    Runs of consecutive samples with the same state, split at sequence starts. 
+    Run k covers the samples `starts[k]:stops[k]` and has state `states[k]`.
+    """
+    def __init__(self, _states:np.ndarray, _sequence_starts:np.ndarray, _locations:np.ndarray):
+        self.starts, self.stops = find_runs(_states, _sequence_starts)
+        self.states = _states[self.starts]
+        self.locations = _locations
+
+
+    def __len__(self):
+        return len(self.starts)
+
+
+    def __iter__(self) -> Generator[tuple[int, np.ndarray], None, None]:
+        """Yields ( state, locations ), the locations are views into the dataset"""
+        for state, start, stop in zip(self.states, self.starts, self.stops):
+            yield int(state), self.locations[start:stop]
+
+
+# -----------------------------------------------------------------------------
+def find_runs(_states:np.ndarray, _sequence_starts:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Returns ( starts, stops ) of the runs of equal states, a sequence start always begins a new run"""
+    n = len(_states)
+
+    if n == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    
+    boundaries = np.flatnonzero((np.diff(_states) != 0) | (_sequence_starts[1:] != 0)) + 1
+
+    starts = np.concatenate(([0], boundaries))
+    stops  = np.concatenate((boundaries, [n]))
+
+    return starts, stops
+
+
+# -----------------------------------------------------------------------------
+def consecutive_connected(_edges:np.ndarray, _num_verts:int) -> np.ndarray:
+    """Returns (N - 1,) bool, where k is True when vertex k and k + 1 share an edge"""
+    lo = _edges.min(axis=1)
+    hi = _edges.max(axis=1)
+
+    connected = np.zeros(max(_num_verts - 1, 0), dtype=bool)
+    connected[lo[hi - lo == 1]] = True
+
+    return connected
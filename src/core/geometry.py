@@ -0,0 +1,183 @@
+"""
+Transform and intersection math on numpy arrays.
+"""
+import numpy as np
+from   math  import radians, cos, sin
+
+
+# -----------------------------------------------------------------------------
+def rotation_matrix(_v1:np.ndarray, _v2:np.ndarray) -> np.ndarray:
+    """
+    Same as `b3d_utils.rotation_matrix`, returns the 3x3 rotation matrix that aligns `_v1` to `_v2`.
+    Parallel and opposite vectors return the identity.
+    """
+    a = np.asarray(_v1, dtype=float).reshape(3)
+    b = np.asarray(_v2, dtype=float).reshape(3)
+
+    a, b = a / np.linalg.norm(a), b / np.linalg.norm(b)
+    v = np.cross(a, b)
+
+    if not any(v):
+        return np.eye(3)
+
+    d = np.dot(a, b)
+    s = np.linalg.norm(v)
+    kmat = np.array([[0, -v[2], v[1]], [v[2], 0, -v[0]], [-v[1], v[0], 0]])
+
+    return np.eye(3) + kmat + kmat.dot(kmat) * ((1 - d) / (s ** 2))
+
+
+# -----------------------------------------------------------------------------
+def rotation_z(_degrees:float) -> np.ndarray:
+    c, s = cos(radians(_degrees)), sin(radians(_degrees))
+
+    return np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+
+
+# -----------------------------------------------------------------------------
+def to_4x4(_m:np.ndarray) -> np.ndarray:
+    m = np.eye(4)
+    m[:3, :3] = _m
+
+    return m
+
+
+# -----------------------------------------------------------------------------
+def transform_points(_matrix:np.ndarray, _points:np.ndarray) -> np.ndarray:
+    """Applies a 4x4 matrix to (N, 3) points"""
+    return _points @ _matrix[:3, :3].T + _matrix[:3, 3]
+
+
+# -----------------------------------------------------------------------------
+def obb_overlap(_a:np.ndarray, _b:np.ndarray, _epsilon=1e-4) -> bool:
+    """
+    Separating axis test between two oriented boxes.
+    A box is given as the 4x4 matrix that maps the unit cube [-0.5, 0.5]^3 to world space.
+    Boxes that only touch within `_epsilon` do not overlap, the same as triangles in `triangles_intersect`.
+    """
+    return bool(obb_overlaps(_a[None], _b[None], _epsilon)[0])
+
+
+# -----------------------------------------------------------------------------
+def box_frames(_boxes:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the ( N, 3, 3 ) unit axes as rows and the ( N, 3 ) half extents of ( N, 4, 4 ) boxes"""
+    columns = _boxes[:, :3, :3].transpose(0, 2, 1)
+    lengths = np.sqrt((columns * columns).sum(axis=2))
+
+    axes = columns / np.maximum(lengths, 1e-300)[:, :, None]
+
+    # A box without extent along an axis still needs a unit axis there
+    if (flat := lengths <= 1e-9 * lengths.max(axis=1, keepdims=True)).any():
+        axes[flat] = cross(axes[:, (1, 2, 0)], axes[:, (2, 0, 1)])[flat]
+
+    return axes, lengths * .5
+
+
+# -----------------------------------------------------------------------------
+def obb_overlaps(_a:np.ndarray, _b:np.ndarray, _epsilon=1e-4, _parallel_epsilon=1e-6) -> np.ndarray:
+    """
+    `obb_overlap` for ( N, 4, 4 ) pairs of boxes at once, returns ( N, ) bools.
+    The 15 axes are tested in the frame of `_a`, with `|R|` padded by `_parallel_epsilon` like in Real-Time Collision Detection 4.4.1.
+    Edges that are almost parallel give cross products without a meaningful direction, the padding keeps them from separating the boxes.
+    """
+    # The frames of both boxes at once, every numpy call costs more than the test for small batches
+    axes, extents = box_frames(np.concatenate((_a, _b)))
+
+    ua, ub = axes[:len(_a)], axes[len(_a):]
+    ea, eb = extents[:len(_a)], extents[len(_a):]
+
+    # r[i, j] is axis j of b in the frame of a, t is the offset of b in the frame of a
+    r = ua @ ub.transpose(0, 2, 1)
+    abs_r = np.abs(r) + _parallel_epsilon
+    t = (ua @ (_b[:, :3, 3] - _a[:, :3, 3])[:, :, None])[:, :, 0]
+
+    # Face axes of a and b
+    separated = (np.abs(t) > ea + (abs_r * eb[:, None, :]).sum(axis=2) - _epsilon).any(axis=1)
+    separated |= (np.abs((t[:, :, None] * r).sum(axis=1)) > (abs_r * ea[:, :, None]).sum(axis=1) + eb - _epsilon).any(axis=1)
+
+    # Cross products of axis i of a and axis j of b, their length is the sine of the angle between the axes
+    i1, i2 = (1, 2, 0), (2, 0, 1)
+
+    ra = ea[:, i1, None] * abs_r[:, i2, :] + ea[:, i2, None] * abs_r[:, i1, :]
+    rb = eb[:, None, i1] * abs_r[:, :, i2] + eb[:, None, i2] * abs_r[:, :, i1]
+    d  = np.abs(t[:, i2, None] * r[:, i1, :] - t[:, i1, None] * r[:, i2, :])
+
+    lengths = np.sqrt(r[:, i1, :] ** 2 + r[:, i2, :] ** 2)
+    separated |= (d > ra + rb - _epsilon * lengths).any(axis=(1, 2))
+
+    return ~separated
+
+
+# -----------------------------------------------------------------------------
+def cross(_a:np.ndarray, _b:np.ndarray) -> np.ndarray:
+    """Cross product of the last axis, `np.cross` is slow for small arrays"""
+    return np.stack((
+        _a[..., 1] * _b[..., 2] - _a[..., 2] * _b[..., 1],
+        _a[..., 2] * _b[..., 0] - _a[..., 0] * _b[..., 2],
+        _a[..., 0] * _b[..., 1] - _a[..., 1] * _b[..., 0],
+    ), axis=-1)
+
+
+# -----------------------------------------------------------------------------
+def triangles_intersect(_a:np.ndarray, _b:np.ndarray, _epsilon=1e-4) -> np.ndarray:
+    """
+    Separating axis test between ( N, 3, 3 ) pairs of triangles, returns ( N, ) bools.
+    Triangles that only touch within `_epsilon` do not intersect, the same as boxes in `obb_overlaps`.
+    """
+    ea = _a[:, (1, 2, 0)] - _a
+    eb = _b[:, (1, 2, 0)] - _b
+
+    na = cross(ea[:, 0], ea[:, 1])[:, None]
+    nb = cross(eb[:, 0], eb[:, 1])[:, None]
+
+    # Both normals, the 9 edge cross products and the edge normals in the plane of each triangle for coplanar pairs.
+    # The axes are not normalized, an axis of parallel edges has no length and never separates.
+    axes = np.concatenate((na, nb, cross(ea[:, :, None], eb[:, None]).reshape(-1, 9, 3), cross(na, ea), cross(nb, eb)), axis=1)
+
+    pa = axes @ _a.transpose(0, 2, 1)
+    pb = axes @ _b.transpose(0, 2, 1)
+
+    # Reductions over 3 elements are slow, the corners are compared one by one
+    lo_a = np.minimum(np.minimum(pa[..., 0], pa[..., 1]), pa[..., 2])
+    hi_a = np.maximum(np.maximum(pa[..., 0], pa[..., 1]), pa[..., 2])
+    lo_b = np.minimum(np.minimum(pb[..., 0], pb[..., 1]), pb[..., 2])
+    hi_b = np.maximum(np.maximum(pb[..., 0], pb[..., 1]), pb[..., 2])
+
+    depth = np.minimum(hi_a - lo_b, hi_b - lo_a)
+    lengths = np.sqrt(np.einsum('nkd,nkd->nk', axes, axes))
+
+    return ~np.any(depth < _epsilon * lengths, axis=1)
+
+
+# -----------------------------------------------------------------------------
+def mesh_intersections(_a:np.ndarray, _b:np.ndarray, _epsilon=1e-4, _block_size=1 << 20) -> np.ndarray:
+    """
+    Returns the ( K, 2 ) indices of the intersecting triangles of two meshes, given as ( N, 3, 3 ) and ( M, 3, 3 ) triangles.
+    Only triangles with overlapping bounds are tested, the ( N, M ) table of bounds is built for `_block_size` pairs at a time.
+    """
+    pairs = [np.empty((0, 2), dtype=int)]
+
+    if not len(_a) or not len(_b):
+        return pairs[0]
+
+    lo_a, hi_a = np.minimum(np.minimum(_a[:, 0], _a[:, 1]), _a[:, 2]), np.maximum(np.maximum(_a[:, 0], _a[:, 1]), _a[:, 2])
+    lo_b, hi_b = np.minimum(np.minimum(_b[:, 0], _b[:, 1]), _b[:, 2]), np.maximum(np.maximum(_b[:, 0], _b[:, 1]), _b[:, 2])
+
+    # Most pairs of modules that the broadphase reports do not touch at all
+    if (lo_a.min(axis=0) > hi_b.max(axis=0)).any() or (lo_b.min(axis=0) > hi_a.max(axis=0)).any():
+        return pairs[0]
+
+    step = max(1, _block_size // len(_b))
+
+    for s in range(0, len(_a), step):
+        candidates = ((lo_a[s:s + step, None] <= hi_b[None]) & (lo_b[None] <= hi_a[s:s + step, None])).all(axis=2)
+        i, j = np.nonzero(candidates)
+
+        if not len(i):
+            continue
+
+        i += s
+        hit = triangles_intersect(_a[i], _b[j], _epsilon)
+        pairs.append(np.stack((i[hit], j[hit]), axis=1))
+
+    return np.concatenate(pairs)
@@ -0,0 +1,418 @@
+"""
+Reads logs created by medge-state-logging into columnar numpy arrays.
+
+This module does not depend on Blender, so it can also be used by benchmarks and worker processes.
+"""
+import json, re, os, sys, site, importlib.util, hashlib, shutil
+import numpy              as np
+from   concurrent.futures import ProcessPoolExecutor, as_completed
+from   itertools          import repeat
+from   time               import perf_counter
+from   operator           import itemgetter
+from   typing             import Generator, Sequence, NamedTuple
+
+
+# -----------------------------------------------------------------------------
+# Keys as they appear in the .json file, see `Attribute` in dataset.py
+STATE_KEY     = 'state'
+LOCATION_KEY  = 'location'
+TIMESTAMP_KEY = 'timestamp'
+
+# Value of `State.NONE`
+STATE_NONE = 0
+
+DEFAULT_BLOCK_SIZE = 1 << 20
+DEFAULT_CHUNK_SIZE = 1 << 14
+
+_SEPARATORS = re.compile(r'[\s,]*')
+
+
+# -----------------------------------------------------------------------------
+def decode_items(_items:Sequence[dict]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns ( states int16 (N,), locations float32 (N, 3), timestamps float32 (N, 3) )
+
+    Every column is decoded in one pass by numpy, instead of creating Python objects per sample.
+    """
+    n = len(_items)
+
+    states = np.array([item[STATE_KEY] for item in _items]).astype(np.int16).reshape(n)
+
+    # Timestamps are formatted as 'hours:minutes:seconds'
+    # Every item is checked on its own, a missing field of one item must not be made up for by an extra field of another.
+    texts = [str(item[TIMESTAMP_KEY]) for item in _items]
+
+    if set(map(str.count, texts, repeat(':'))) - {2}:
+        raise ValueError('Timestamps should be formatted as hours:minutes:seconds')
+
+    # The fields of all items are converted at once, numpy raises a ValueError for a field that is not a number
+    fields = ':'.join(texts).split(':') if n else []
+    timestamps = np.array(fields, dtype=np.float64).astype(np.float32).reshape(n, 3)
+
+    xyz = itemgetter('x', 'y', 'z')
+    locations = np.array([xyz(item[LOCATION_KEY]) for item in _items], dtype=np.float32).reshape(n, 3)
+
+    # The game uses a different handedness, swap x and y
+    locations[:, (0, 1)] = locations[:, (1, 0)]
+
+    return states, locations, timestamps
+
+
+# -----------------------------------------------------------------------------
+def iter_log_items(_filepath:str, _block_size=DEFAULT_BLOCK_SIZE) -> Generator[dict, None, None]:
+    """
+    Incrementally parses the top level array of the log.
+    Only one block of text and the item that is being decoded are kept in memory.
+    """
+    decoder = json.JSONDecoder()
+
+    with open(_filepath, 'r') as f:
+        buffer = ''
+        pos = 0
+
+
+        def fill() -> bool:
+            nonlocal buffer, pos
+            block = f.read(_block_size)
+            buffer = buffer[pos:] + block
+            pos = 0
+            return len(block) > 0
+
+
+        # Find the start of the array
+        while not (buffer := buffer.lstrip()):
+            if not fill(): return
+
+        if buffer[0] != '[':
+            raise ValueError(f'Expected a list of items in: {_filepath}')
+
+        pos = 1
+
+        while True:
+            pos = _SEPARATORS.match(buffer, pos).end()
+
+            if pos >= len(buffer):
+                if not fill():
+                    raise ValueError(f'Unexpected end of file: {_filepath}')
+                continue
+
+            if buffer[pos] == ']':
+                return
+
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+
+            except json.JSONDecodeError as e:
+                # An item that is cut off by the end of the block fails in its last token, then the next block completes it.
+                # With a whole block after the error the item is malformed, decoding the growing tail again would never succeed.
+                if len(buffer) - e.pos > max(_block_size, 64) or not fill(): raise
+                continue
+
+            yield item
+
+
+# -----------------------------------------------------------------------------
+def read_log_chunks(_filepath:str,
+                    _chunk_size=DEFAULT_CHUNK_SIZE,
+                    _block_size=DEFAULT_BLOCK_SIZE) -> Generator[tuple[np.ndarray, np.ndarray, np.ndarray], None, None]:
+    """Yields the log in chunks of at most `_chunk_size` samples, see `decode_items`"""
+    items = []
+
+    for item in iter_log_items(_filepath, _block_size):
+        items.append(item)
+
+        if len(items) == _chunk_size:
+            yield decode_items(items)
+            items.clear()
+
+    if items:
+        yield decode_items(items)
+
+
+# -----------------------------------------------------------------------------
+def read_log(_filepath:str, _stream=True, _chunk_size=DEFAULT_CHUNK_SIZE) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns ( states int16 (N,), locations float32 (N, 3), timestamps float32 (N, 3) )
+
+    When `_stream` is set, the file is never loaded as a whole, peak memory is bounded by the chunk size and the output arrays.
+    """
+    if not _stream:
+        with open(_filepath, 'r') as f:
+            return decode_items(json.load(f))
+
+    columns:list[np.ndarray] = None
+    size = 0
+
+    # The chunks are copied into growing arrays, so the decoded log is not held twice
+    for chunk in read_log_chunks(_filepath, _chunk_size):
+        n = len(chunk[0])
+
+        if columns is None:
+            columns = [np.empty((max(_chunk_size, n),) + c.shape[1:], dtype=c.dtype) for c in chunk]
+
+        elif size + n > len(columns[0]):
+            # Grow geometrically, `resize` reallocates in place when it can
+            capacity = max(size + n, 2 * len(columns[0]))
+
+            for column in columns:
+                column.resize((capacity,) + column.shape[1:], refcheck=False)
+
+        for column, values in zip(columns, chunk):
+            column[size:size + n] = values
+
+        size += n
+
+    if columns is None:
+        return decode_items([])
+
+    for column in columns:
+        column.resize((size,) + column.shape[1:], refcheck=False)
+
+    return tuple(columns)
+
+
+# -----------------------------------------------------------------------------
+def find_sequence_starts(_states:np.ndarray) -> np.ndarray:
+    """A sample is a sequence start when it is the first sample or its state differs from the previous one"""
+    starts = np.ones(len(_states), dtype=bool)
+    # A NONE state never continues a sequence, this matches the original `not prev_state` test
+    starts[1:] = (_states[1:] != _states[:-1]) | (_states[:-1] == STATE_NONE)
+
+    return starts
+
+
+# -----------------------------------------------------------------------------
+class LogData(NamedTuple):
+    filepath:        str
+    states:          np.ndarray
+    locations:       np.ndarray
+    timestamps:      np.ndarray
+    sequence_starts: np.ndarray
+    seconds:         float
+
+
+# -----------------------------------------------------------------------------
+# Cache
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+class LogCache:
+    """
+    Binary cache of decoded logs. An entry is a directory with one .npy file per column, which is memory-mapped on load.
+
+    Without a cache directory, the entry is written next to the log as `<log>.cache`. 
+    With a cache directory, the least recently used entries are evicted when the directory grows beyond `_max_bytes`.
+
+    An entry is valid when the size and modification time of the log match. 
+    If only the modification time differs, the content hash decides, e.g. when the file was copied or touched.
+    """
+    VERSION = 1
+    COLUMNS = ('states', 'locations', 'timestamps', 'sequence_starts')
+    META    = 'meta.json'
+
+    def __init__(self, _directory:str=None, _max_bytes=0):
+        self.directory = _directory
+        self.max_bytes = _max_bytes
+
+
+    def entry_path(self, _filepath:str) -> str:
+        if not self.directory:
+            return _filepath + '.cache'
+
+        # Logs with the same name can live in different folders
+        path = os.path.abspath(_filepath)
+        key = hashlib.blake2b(path.encode(), digest_size=8).hexdigest()
+
+        return os.path.join(self.directory, f'{os.path.basename(path)}.{key}')
+
+
+    def load(self, _filepath:str) -> LogData | None:
+        entry = self.entry_path(_filepath)
+        meta_path = os.path.join(entry, self.META)
+
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+
+            stat = os.stat(_filepath)
+
+            if meta['version'] != self.VERSION or meta['size'] != stat.st_size:
+                return None
+
+            if meta['mtime_ns'] != stat.st_mtime_ns:
+                if meta['hash'] != file_hash(_filepath):
+                    return None
+                
+                meta['mtime_ns'] = stat.st_mtime_ns
+
+                with open(meta_path, 'w') as f:
+                    json.dump(meta, f)
+
+            start = perf_counter()
+            columns = [np.load(os.path.join(entry, f'{c}.npy'), mmap_mode='r') for c in self.COLUMNS]
+
+        except (OSError, ValueError, KeyError):
+            return None
+
+        # Used for LRU eviction
+        os.utime(meta_path)
+
+        return LogData(_filepath, *columns, perf_counter() - start)
+
+
+    def store(self, _log:LogData):
+        entry = self.entry_path(_log.filepath)
+        meta_path = os.path.join(entry, self.META)
+
+        stat = os.stat(_log.filepath)
+        meta = {
+            'version'  : self.VERSION,
+            'size'     : stat.st_size,
+            'mtime_ns' : stat.st_mtime_ns,
+            'hash'     : file_hash(_log.filepath),
+        }
+
+        try:
+            os.makedirs(entry, exist_ok=True)
+
+            # Invalidate the entry while it is being written
+            if os.path.exists(meta_path):
+                os.remove(meta_path)
+
+            for c in self.COLUMNS:
+                np.save(os.path.join(entry, f'{c}.npy'), getattr(_log, c))
+
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f)
+
+        # The cache is optional, a read-only folder should not fail the import
+        except OSError:
+            pass
+
+
+    def evict(self):
+        if not self.directory or self.max_bytes <= 0: return
+        if not os.path.isdir(self.directory): return
+
+        entries = []
+        total = 0
+
+        for name in os.listdir(self.directory):
+            entry = os.path.join(self.directory, name)
+            meta_path = os.path.join(entry, self.META)
+
+            if not os.path.isfile(meta_path): continue
+
+            size = sum(f.stat().st_size for f in os.scandir(entry) if f.is_file())
+            entries.append((os.path.getmtime(meta_path), size, entry))
+            total += size
+
+        # Least recently used first
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes: break
+
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+
+# -----------------------------------------------------------------------------
+def file_hash(_filepath:str, _block_size=DEFAULT_BLOCK_SIZE) -> str:
+    h = hashlib.blake2b(digest_size=16)
+
+    with open(_filepath, 'rb') as f:
+        while block := f.read(_block_size):
+            h.update(block)
+
+    return h.hexdigest()
+
+
+# -----------------------------------------------------------------------------
+# Import
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+def load_log(_filepath:str, _stream=True, _cache:LogCache=None, _chunk_size=DEFAULT_CHUNK_SIZE) -> LogData:
+    """Everything that is needed to create a dataset, except the mesh itself"""
+    if _cache and (log := _cache.load(_filepath)):
+        return log
+
+    start = perf_counter()
+
+    states, locations, timestamps = read_log(_filepath, _stream, _chunk_size)
+    sequence_starts = find_sequence_starts(states)
+
+    log = LogData(_filepath, states, locations, timestamps, sequence_starts, perf_counter() - start)
+
+    if _cache:
+        _cache.store(log)
+
+    return log
+
+
+# -----------------------------------------------------------------------------
+STANDALONE_NAME = 'log_reader'
+
+
+def standalone_module():
+    """
+    Worker processes are plain Python interpreters that can't import the add-on package, because it imports bpy.
+    Returns this module imported under its own name, so that its functions are pickled by a reference the workers can import.
+    The module is loaded from its file, `sys.path` of this process is not changed.
+    """
+    if (module := sys.modules.get(STANDALONE_NAME)) is not None:
+        return module
+
+    spec = importlib.util.spec_from_file_location(STANDALONE_NAME, os.path.abspath(__file__))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[STANDALONE_NAME] = module
+
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[STANDALONE_NAME]
+        raise
+
+    return module
+
+
+# -----------------------------------------------------------------------------
+def load_logs(_filepaths:list[str], _stream=True, _workers:int=None, _cache:LogCache=None) -> Generator[LogData, None, None]:
+    """
+    Loads the logs in a process pool and yields them in order of completion.
+    The cache is evicted when the generator finishes, also if it is closed early.
+    """
+    try:
+        # Cached logs are memory-mapped directly, sending them through a worker would copy them
+        misses = []
+
+        for path in _filepaths:
+            if _cache and (log := _cache.load(path)):
+                yield log
+            else:
+                misses.append(path)
+
+        if not misses:
+            return
+
+        standalone = standalone_module()
+
+        cache = None
+        if _cache:
+            cache = standalone.LogCache(_cache.directory, _cache.max_bytes)
+
+        # Only the workers import the module by its directory
+        directory = os.path.dirname(os.path.abspath(__file__))
+
+        with ProcessPoolExecutor(max_workers=_workers or None, initializer=site.addsitedir, initargs=(directory,)) as executor:
+            futures = [executor.submit(standalone.load_log, path, _stream, cache) for path in misses]
+
+            try:
+                for future in as_completed(futures):
+                    yield future.result()
+
+            finally:
+                # Logs that are not loaded yet are not needed anymore
+                for future in futures:
+                    future.cancel()
+
+    finally:
+        if _cache:
+            _cache.evict()
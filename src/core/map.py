@@ -0,0 +1,354 @@
+"""
+Generic map solver: places a module for every state in a chain and resolves intersections.
+"""
+import numpy       as np
+from   abc         import ABC, abstractmethod
+from   itertools   import product
+from   collections import UserList
+from   dataclasses import dataclass
+from   time        import perf_counter
+from   typing      import Sequence
+
+from .states      import State
+from .modules     import Module, ModulePrototype, PrototypeModule
+from .broadphase  import SpatialHashGrid
+from .geometry    import obb_overlaps
+from .constraints import apply_constraints
+
+
+# -----------------------------------------------------------------------------
+# Modules of these states are swapped out to resolve intersections
+RESOLVE_CANDIDATE_STATES = {State.Walking, State.WallRunningLeft, State.WallRunningRight}
+
+
+# -----------------------------------------------------------------------------
+@dataclass
+class MapSettings:
+    """Same settings as `MET_SCENE_PG_map_gen_settings`"""
+    seed:                 int  = 2024
+    length:               int  = 0
+    align_orientation:    bool = False
+    resolve_intersection: bool = True
+    max_resolve_attempts: int  = 50
+
+    def __str__(self):
+        return f"\
+{self.seed}_\
+{str(self.align_orientation)[0]}_\
+{str(self.resolve_intersection)[0]}_\
+{self.max_resolve_attempts}\
+"
+
+
+# -----------------------------------------------------------------------------
+# Map
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+class Map(UserList, ABC):
+    """
+    ` list[Module] `
+
+    Subclasses decide which `Module` represents a state by overriding `create_module`.
+    """
+
+    def __init__(self, _data=None, _settings:'MapSettings'=None):
+        super().__init__(_data)
+
+        self.obj = None
+        self.settings = _settings
+        self.debug = True
+
+        np.random.seed(self.settings.seed)
+
+        # Only contains indices that point to candidates to resolve intersection
+        self.resolve_candidates:list[int] = []
+        # If the Module is a resolve candidate, store the index to resolve_candidates, otherwise it is 0
+        self.is_candidate:list[int] = []
+
+        # Bounds of the placed collision volumes by index, only modules with overlapping bounds are checked for intersections
+        self.grid = SpatialHashGrid()
+
+        # Hits of the intersecting pairs of modules, `hits[k][j]` with j < k, and the reverse: k in `hit_by[j]`
+        self.hits:dict[int, dict[int, int]] = {}
+        self.hit_by:dict[int, set[int]] = {}
+        # Modules that moved since their pairs were tested
+        self.moved:set[int] = set()
+
+
+    def append(self, _item:Module):
+        super().append(_item)
+        
+        if _item.state in RESOLVE_CANDIDATE_STATES:
+            self.resolve_candidates.append(len(self.data) - 1)
+            self.is_candidate.append(len(self.resolve_candidates) - 1)
+
+        else:
+            self.is_candidate.append(0)
+
+
+    @abstractmethod
+    def create_module(self, _state:int, _module_names:list[str]) -> Module:
+        """Returns the module that represents `_state` with one of `_module_names`"""
+
+
+    def prepare(self, 
+                _states:list[int],
+                _module_names:Sequence[list[str] | None]):
+        """`_module_names[state]` contains the names of the modules that are available for that state"""
+        for state in _states:
+            if not (mn := _module_names[state]): 
+                    continue
+
+            cm = self.create_module(state, mn)
+            self.append(cm)
+
+
+    def build(self):
+        # Build modules
+        if self.debug: print('Building map...')
+
+        start_time = perf_counter()
+
+        place_times = []
+        resolve_times = []
+        hits = []
+
+        cm:Module
+        for k, cm in enumerate(self.data):
+            if self.debug: print(f'Iteration: {k} / {len(self.data) - 1}')
+            st = perf_counter()
+            cm.next_module()
+
+            # Align
+            self.align_module(k)
+            et = perf_counter()
+
+            place_times.append(et - st)
+            hits.append(0)
+            resolve_times.append(0)
+
+            # Check intersections
+            if self.check_intersection(k) == 0: 
+                continue
+
+            # Resolve intersections
+            if not self.settings.resolve_intersection: 
+                continue
+
+            st = perf_counter()
+            hits[-1] = self.resolve_intersections(k)
+            et = perf_counter()
+
+            resolve_times[-1] = et - st
+
+        end_time = perf_counter()
+
+        total_time = end_time - start_time
+
+        return total_time, place_times, resolve_times, hits
+
+
+    def check_intersection(self, _index:int) -> int:
+        """Returns the number of hits of module `_index` with all modules before it"""
+        self.update_hits()
+
+        return sum(self.hits.get(_index, {}).values())
+
+
+    def check_intersections_range(self, _start:int) -> int:
+        """Returns the number of hits between the modules up to `_start`"""
+        self.update_hits()
+
+        return sum(sum(row.values()) for k, row in self.hits.items() if k <= _start)
+
+
+    def update_hits(self):
+        """Tests the pairs of modules that moved since they were last tested, the hits of all other pairs are still valid"""
+        if not self.moved: 
+            return
+
+        moved, self.moved = self.moved, set()
+
+        for k in moved:
+            for j in self.hits.pop(k, {}):
+                self.hit_by[j].discard(k)
+
+            for m in self.hit_by.pop(k, set()):
+                del self.hits[m][k]
+
+                if not self.hits[m]:
+                    del self.hits[m]
+
+        # Pairs of two moved modules are tested once
+        pairs = []
+
+        for k in sorted(moved):
+            if (bounds := self.data[k].bounds()) is None: 
+                continue
+
+            pairs.extend((max(j, k), min(j, k)) for j in sorted(self.grid.query(*bounds), reverse=True) if j != k and (j < k or j not in moved))
+
+        for (k, j), hits in self.test_pairs(pairs).items():
+            self.hits.setdefault(k, {})[j] = hits
+            self.hit_by.setdefault(j, set()).add(k)
+
+
+    def test_pairs(self, _pairs:list[tuple[int, int]]) -> dict[tuple[int, int], int]:
+        """
+        Returns the number of hits of the pairs of modules ( k, j ), j < k, that intersect.
+        A pair of boxes is a single hit, a pair of meshes has a hit for every pair of intersecting faces.
+        """
+        hits = {}
+
+        # Boxes are tested at once
+        boxes = {k: self.data[k].box() for k in {k for pair in _pairs for k in pair}}
+        box_pairs = [(k, j) for k, j in _pairs if boxes[k] is not None and boxes[j] is not None]
+
+        if box_pairs:
+            a = np.array([boxes[k] for k, _ in box_pairs])
+            b = np.array([boxes[j] for _, j in box_pairs])
+
+            hits.update((pair, 1) for pair, overlap in zip(box_pairs, obb_overlaps(a, b)) if overlap)
+
+        for k, j in _pairs:
+            if boxes[k] is not None and boxes[j] is not None: 
+                continue
+
+            # The later module tests against the earlier one
+            if (h := self.data[k].intersect(self.data[j])):
+                hits[k, j] = len(h)
+
+        return hits
+
+
+    def resolve_intersections(self, _start:int) -> int:
+        if self.debug: print(f'Resolving intersections...')
+        
+        module_names_indices:list[list[int]] = []
+        current_candidates:list[int] = []
+
+        # Find resolve candidate
+        for k in range(_start, -1, -1):
+            if (start_candidate := self.is_candidate[k]) != 0:
+                break
+
+        end_resolving = False
+        lowest_hits = float('inf')
+        best_candidates = None
+        best_permutation = None
+
+        # Try different candidates
+        curr_iteration = 0
+
+        for k in range(start_candidate, -1, -1):
+
+            i = self.resolve_candidates[k]
+            cm:Module = self.data[i]
+
+            module_names_indices.append(range(len(cm.module_names)))
+            current_candidates.append(i)
+        
+            for permutation in product(*module_names_indices):
+                self.apply_configuration(current_candidates, permutation)
+
+                hits = self.check_intersections_range(_start)
+                if self.debug:  print(f'Hits: {hits}')
+
+                curr_iteration += 1
+
+                if hits < lowest_hits:
+                    lowest_hits = hits
+                    best_candidates = current_candidates
+                    best_permutation = permutation
+
+                if hits == 0 or curr_iteration >= self.settings.max_resolve_attempts:
+                    end_resolving = True
+                    break
+        
+            if end_resolving:
+                break
+
+        if lowest_hits != 0:
+            print('Applying best permutation')
+            self.apply_configuration(best_candidates, best_permutation)
+
+        return lowest_hits
+
+
+    def apply_configuration(self, _indices:list[int], _permutation:tuple[int, ...]) -> int:
+        lowest_idx = len(self.data) - 1
+        names = []
+
+        # Apply permutation
+        for i, p in zip(_indices, _permutation):
+            cm:Module = self.data[i]
+            cm.next_module(p)
+            names.append(cm.name)
+
+            if i < lowest_idx: 
+                lowest_idx = i
+
+        if self.debug: print(f'Applied permutation: {_permutation}, Objects: {names}')
+
+        # Align modules
+        for k in range(lowest_idx, len(self.data), 1):
+            self.align_module(k)
+
+
+    def align_module(self, _index:int):
+        cm:Module = self.data[_index]
+        if not cm.is_placed: return
+
+        if _index == 0:
+            cm.align(None)
+        else:
+            cm.align(self.data[_index - 1], self.settings.align_orientation)
+
+        if (bounds := cm.bounds()) is None:
+            self.grid.remove(_index)
+        else:
+            self.grid.update(_index, *bounds)
+
+        self.moved.add(_index)
+
+
+# -----------------------------------------------------------------------------
+class PrototypeMap(Map):
+    """` list[PrototypeModule] `, lays out a map from `ModulePrototype`s"""
+
+    def __init__(self, _prototypes:dict[int, list[ModulePrototype]], _data=None, _settings:MapSettings=None):
+        super().__init__(_data, _settings)
+        self.prototypes = _prototypes
+
+
+    def create_module(self, _state:int, _module_names:list[str]) -> PrototypeModule:
+        return PrototypeModule(_state, [p for p in self.prototypes[_state] if p.name in _module_names])
+
+
+    def prepare(self, _states:list[int]):
+        module_names = [None] * (max(State) + 1)
+
+        for state, prototypes in self.prototypes.items():
+            module_names[state] = [p.name for p in prototypes]
+
+        # Cells of the size of a typical collision volume, instead of the size of the first placed one
+        extents = [np.abs(p.volume[:3, :3]).sum(axis=1).max() for prototypes in self.prototypes.values() for p in prototypes if p.volume is not None]
+
+        if extents and len(self.grid) == 0:
+            self.grid.cell_size = max(float(np.median(extents)), 1e-3)
+
+        super().prepare(_states, module_names)
+
+
+# -----------------------------------------------------------------------------
+def filter_states(_states:list[int], _length=-1) -> list[int]:
+    """Removes and replaces states that result in non-solvable level segments, `_length` limits the number of input states"""
+    if len(_states) == 0:
+        return []
+
+    keep, states = apply_constraints(np.asarray(_states), True)
+
+    if _length != -1:
+        keep, states = keep[:_length], states[:_length]
+
+    return states[keep].tolist()
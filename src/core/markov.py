@@ -0,0 +1,493 @@
+"""
+Markov model over player states.
+"""
+import numpy       as np
+import io, os
+from   collections import OrderedDict
+from   typing      import Sequence, Iterable, NamedTuple
+
+from .states      import State
+from .sampling    import AliasSampler, ContextSampler
+from .constraints import LOOKAHEAD, apply_constraints
+
+
+# -----------------------------------------------------------------------------
+class MarkovChain:
+    # Version of `to_bytes`
+    VERSION = 1
+
+    # Contexts of `ContextSampler` are int64 codes of `nstates ** order`, they overflow for high orders
+    MAX_ORDER = 4
+
+    def __init__(self) -> None:
+        self.reset()
+
+
+    def reset(self):
+        self.name = ''
+        self.transition_matrix = None
+        self.transition_counts = None
+        self.sampler:AliasSampler | ContextSampler = None
+        self.nstates = 0
+        self.order = 1
+
+        # Results of the statistics, they only depend on `transition_matrix`
+        self.__statistics = {}
+
+
+    # https://stackoverflow.com/questions/46657221/generating-markov-transition-matrix-in-python
+    def create_transition_matrix(self, _sequences:list[np.ndarray], _name='', _order=1, _counts:np.ndarray=None) -> bool:
+        """
+        `_sequences` contains the state of each run per dataset, see `SequenceRuns`.
+        With `_order > 1` the chains are sampled from the last `_order` states, `transition_matrix` stays first order.
+        `_counts` are the first order transition counts of `_sequences`, if they are already known.
+        Raises ValueError if `_order` is not between 1 and `MAX_ORDER`.
+        """
+        if not 1 <= _order <= self.MAX_ORDER:
+            raise ValueError(f'The order should be between 1 and {self.MAX_ORDER}, not {_order}')
+
+        self.name = _name
+        self.order = _order
+        self.__statistics = {}
+
+        self.nstates = 0
+        transitions:list[np.ndarray] = []
+
+        # Collect all states
+        for states in _sequences:
+            if len(states) == 0: continue
+
+            self.nstates = max(self.nstates, int(np.max(states)))
+            transitions.append(states)
+            
+        if len(transitions) == 0: return False
+
+        self.nstates += 1
+
+        # Populate transition matrix
+        if _counts is None:
+            _counts = transition_counts(transitions, self.nstates)
+
+        self.transition_counts = _counts[:self.nstates, :self.nstates].astype(np.int64)
+        self.transition_matrix = self.transition_counts.astype(float)
+
+        # Normalize, rows without transitions stay zero
+        totals = self.transition_matrix.sum(axis=1, keepdims=True)
+        np.divide(self.transition_matrix, totals, out=self.transition_matrix, where=totals > 0)
+
+        if _order == 1:
+            self.sampler = AliasSampler(self.transition_matrix, State.Walking.value)
+        else:
+            self.sampler = ContextSampler(transitions, _order, self.nstates, State.Walking.value)
+
+        return True
+
+
+    def generate_chain(self, _length:int, _seed:int, _constrained=False) -> list[int]:
+        """
+        Starts in `State.Walking`, a state without outgoing transitions continues with `State.Walking`.
+        A constrained chain already has the rules of `filter_states` applied, see `generate_chains`.
+        """
+        if _constrained:
+            return self.generate_chains(_length, [_seed], _constrained=True)[0].tolist()
+
+        rng = np.random.default_rng(_seed)
+
+        return self.sampler.sample_chain(State.Walking.value, rng.random(max(_length - 1, 0)))
+
+
+    def generate_chains(self, _length:int, _seeds:Sequence[int], _block_size=256, _constrained=False) -> np.ndarray:
+        """
+        Generates a chain for every seed at once, row k is equal to `generate_chain(_length, _seeds[k])`.
+        Every chain has its own generator, so the chains do not depend on each other or on the global numpy state.
+
+        Constrained chains have exactly `_length` states after the rules of `filter_states` are applied.
+        The rules are applied while sampling: every round only the new states are decided, with the states before them 
+        as context, until each chain has `_length` states. Sampled states after the last needed one are discarded.
+        """
+        rngs = [np.random.default_rng(seed) for seed in _seeds]
+
+        if not _constrained:
+            chains = np.empty((max(_length, 1), len(rngs)), dtype=np.int16)
+            chains[0] = State.Walking.value
+
+            self.__sample_chains(chains, 1, rngs, _block_size)
+
+            return np.ascontiguousarray(chains.T)
+
+        length = max(_length, 1)
+
+        constrained = np.empty((len(rngs), length), dtype=np.int16)
+        columns = np.arange(len(rngs))
+        counts  = np.zeros(len(rngs), dtype=np.intp)
+
+        # Sampled states that are still needed: the sampler history, the undecided states and the context of the rules
+        tail = max(self.order, 2 * LOOKAHEAD)
+
+        chains = np.empty((length + LOOKAHEAD, len(rngs)), dtype=np.int16)
+        chains[0] = State.Walking.value
+        undecided = 0
+
+        self.__sample_chains(chains, 1, rngs, _block_size)
+
+        while True:
+            # The decided states before `undecided` are only context, e.g. for a merge that skips the next states
+            context = min(undecided, LOOKAHEAD)
+            keep, states = apply_constraints(chains[undecided - context:], False)
+            keep, states = keep[context:], states[context:]
+
+            # Appends the kept states, like the random numbers this is done per chain
+            for k, column in enumerate(columns):
+                kept = states[:, k][keep[:, k]][:length - counts[k]]
+                constrained[column, counts[k]:counts[k] + len(kept)] = kept
+                counts[k] += len(kept)
+
+            # Only the unfinished chains continue
+            if (done := counts >= length).all():
+                return constrained
+
+            if done.any():
+                columns, counts = columns[~done], counts[~done]
+                chains = chains[:, ~done]
+                rngs = [rng for rng, d in zip(rngs, done) if not d]
+
+            chains = chains[-tail:]
+            undecided = len(chains) - LOOKAHEAD
+
+            start = len(chains)
+            chains = np.concatenate((chains, np.empty((length - counts.min(), len(rngs)), dtype=np.int16)))
+
+            self.__sample_chains(chains, start, rngs, _block_size)
+
+
+    def __sample_chains(self, _chains:np.ndarray, _start:int, _rngs:list[np.random.Generator], _block_size:int):
+        """Samples the rows of `_chains` from `_start` on, a column is a chain"""
+        # Random numbers are drawn per block of steps to bound the memory
+        u = np.empty((len(_rngs), min(_block_size, max(len(_chains) - _start, 0))), dtype=float)
+
+        for start in range(_start, len(_chains), _block_size):
+            stop = min(start + _block_size, len(_chains))
+            block = u[:, :stop - start]
+
+            for k, rng in enumerate(_rngs):
+                rng.random(out=block[k])
+
+            history = _chains[max(start - self.order, 0):start]
+            _chains[start:stop] = self.sampler.sample_chains(history, np.ascontiguousarray(block.T))
+
+
+    # -------------------------------------------------------------------------
+    # Statistics
+    # -------------------------------------------------------------------------
+    # They describe the chains of `generate_chain` without sampling: first order, starting in `State.Walking`, 
+    # states without outgoing transitions continue with `State.Walking`. Models of a higher order are approximated 
+    # by their first order `transition_matrix`, constraints are not taken into account.
+    def __cached(self, _key, _compute):
+        if _key not in self.__statistics:
+            self.__statistics[_key] = _compute()
+
+        return self.__statistics[_key]
+
+
+    def generator_matrix(self) -> np.ndarray:
+        """`transition_matrix` with the restart of states without outgoing transitions"""
+        def compute():
+            P = self.transition_matrix.copy()
+            P[P.sum(axis=1) == 0, State.Walking] = 1.0
+            return P
+
+        return self.__cached('generator', compute)
+
+
+    def reachable_states(self) -> np.ndarray:
+        """Mask of the states that occur in chains"""
+        def compute():
+            P = self.generator_matrix()
+
+            reached = np.zeros(self.nstates, dtype=bool)
+            reached[State.Walking] = True
+
+            while True:
+                new = reached | (P[reached].sum(axis=0) > 0)
+
+                if (new == reached).all():
+                    return reached
+
+                reached = new
+
+        return self.__cached('reachable', compute)
+
+
+    def stationary_distribution(self) -> np.ndarray:
+        """Long-run fraction of each state, solves `pi P = pi` with `sum(pi) = 1` over the reachable states"""
+        def compute():
+            reached = self.reachable_states()
+            P = self.generator_matrix()[np.ix_(reached, reached)]
+            n = len(P)
+
+            A = np.vstack((P.T - np.eye(n), np.ones((1, n))))
+            b = np.zeros(n + 1)
+            b[-1] = 1
+
+            pi = np.zeros(self.nstates)
+            pi[reached] = np.clip(np.linalg.lstsq(A, b, rcond=None)[0], 0, None)
+            pi /= pi.sum()
+
+            return pi
+
+        return self.__cached('stationary', compute)
+
+
+    def expected_counts(self, _length:int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns ( visits, runs ): the expected number of times each state occurs in a chain of `_length` states and 
+        the expected number of runs, a run is a sequence of the same state.
+        """
+        def compute():
+            P = self.generator_matrix()
+            changes = P * (1 - np.eye(self.nstates))
+
+            p = np.zeros(self.nstates)
+            p[State.Walking] = 1.0
+
+            visits = np.zeros(self.nstates)
+            runs = p.copy() if _length > 0 else np.zeros(self.nstates)
+
+            # `p` is the distribution of the state at step t, a run starts at every change of state
+            for t in range(_length):
+                visits += p
+
+                if t + 1 < _length:
+                    runs += p @ changes
+                    p = p @ P
+
+            return visits, runs
+
+        return self.__cached(('counts', _length), compute)
+
+
+    def hitting_times(self, _state:int) -> np.ndarray:
+        """
+        Expected number of steps from each state until `_state` occurs for the first time, 0 for `_state` itself.
+        States from which `_state` is not reached with certainty have an infinite hitting time.
+        """
+        def compute():
+            P = self.generator_matrix()
+
+            # States that can reach `_state`
+            hits = np.zeros(self.nstates, dtype=bool)
+            hits[_state] = True
+
+            while True:
+                new = hits | (P[:, hits].sum(axis=1) > 0)
+
+                if (new == hits).all():
+                    break
+
+                hits = new
+
+            # Without the states that can move to a state that never reaches `_state`
+            target = np.arange(self.nstates) == _state
+
+            while True:
+                new = hits & ((P[:, ~hits].sum(axis=1) == 0) | target)
+
+                if (new == hits).all():
+                    break
+
+                hits = new
+
+            times = np.full(self.nstates, np.inf)
+            times[_state] = 0
+
+            # h = 1 + Q h over the other states that reach `_state`
+            others = hits.copy()
+            others[_state] = False
+
+            Q = P[np.ix_(others, others)]
+            times[others] = np.linalg.solve(np.eye(len(Q)) - Q, np.ones(len(Q)))
+
+            return times
+
+        return self.__cached(('hitting', int(_state)), compute)
+
+
+    def to_bytes(self) -> bytes:
+        """Compressed npz with the counts, the matrix and the sampling tables"""
+        arrays = {
+            'version' : np.array(self.VERSION),
+            'order'   : np.array(self.order),
+            'counts'  : self.transition_counts.astype(np.int32),
+            'matrix'  : self.transition_matrix,
+        }
+
+        arrays.update({f'sampler_{k}': v for k, v in self.sampler.arrays().items()})
+
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, **arrays)
+
+        return buffer.getvalue()
+
+
+    @classmethod
+    def from_bytes(cls, _data:bytes, _name='') -> 'MarkovChain':
+        """Restores a model written by `to_bytes`, raises ValueError for a model of another version"""
+        with np.load(io.BytesIO(_data)) as npz:
+            arrays = {k: npz[k] for k in npz.files}
+
+        if int(arrays['version']) != cls.VERSION:
+            raise ValueError(f'Unsupported model version: {int(arrays["version"])}')
+
+        mc = cls()
+        mc.name = _name
+        mc.order = int(arrays['order'])
+        mc.transition_counts = arrays['counts'].astype(np.int64)
+        mc.transition_matrix = arrays['matrix']
+        mc.nstates = len(mc.transition_matrix)
+
+        sampler = {k[len('sampler_'):]: v for k, v in arrays.items() if k.startswith('sampler_')}
+        mc.sampler = AliasSampler.from_arrays(sampler) if mc.order == 1 else ContextSampler.from_arrays(sampler)
+
+        return mc
+
+
+    def to_csv(self, path, filter_zeros=True) -> str:
+        file = path + f'{self.name}_transition_matrix.csv'
+        write_csv(file, self.transition_matrix, filter_zeros)
+
+        return file
+
+
+    def export(self, _directory:str, _formats:Iterable[str]=('csv',), _counts=False, _filter_zeros=True) -> list[str]:
+        """
+        Writes the transition matrix and optionally the counts to `_directory` as `csv`, `npy` and/or `npz`.
+        Returns the written files.
+        """
+        arrays = {'transition_matrix': self.transition_matrix}
+
+        if _counts:
+            arrays['transition_counts'] = self.transition_counts
+
+        files = []
+
+        for fmt in _formats:
+            if fmt == 'npz':
+                files.append(os.path.join(_directory, f'{self.name}.npz'))
+                np.savez(files[-1], states=state_names(self.nstates), **arrays)
+                continue
+
+            for key, array in arrays.items():
+                files.append(os.path.join(_directory, f'{self.name}_{key}.{fmt}'))
+
+                if fmt == 'npy':
+                    np.save(files[-1], array)
+                elif fmt == 'csv':
+                    write_csv(files[-1], array, _filter_zeros)
+                else:
+                    raise ValueError(f'Unknown format: {fmt}')
+
+        return files
+
+
+# -----------------------------------------------------------------------------
+def state_names(_nstates:int) -> np.ndarray:
+    return np.array([State(k).name for k in range(_nstates)])
+
+
+# -----------------------------------------------------------------------------
+def write_csv(_filepath:str, _matrix:np.ndarray, _filter_zeros=True):
+    """Writes a ( nstates, nstates ) matrix with the state names as header and first column, rows of zeros can be left out"""
+    names = state_names(len(_matrix))
+    rows = _matrix.any(axis=1) if _filter_zeros else np.ones(len(_matrix), dtype=bool)
+
+    with open(_filepath, 'w', newline='') as f:
+        f.write(',' + ','.join(names) + '\r\n')
+
+        if not rows.any():
+            return
+
+        # Python floats format the same as `csv.writer`
+        table = np.empty((rows.sum(), len(_matrix) + 1), dtype=object)
+        table[:, 0] = names[rows]
+        table[:, 1:] = _matrix[rows].tolist()
+
+        value = '%d' if np.issubdtype(_matrix.dtype, np.integer) else '%r'
+        row = '%s' + f',{value}' * len(_matrix) + '\r\n'
+
+        f.write(row * len(table) % tuple(table.ravel()))
+
+
+# -----------------------------------------------------------------------------
+def export_models(_models:Iterable[MarkovChain], _directory:str, _formats:Iterable[str]=('csv',), _counts=False, _filter_zeros=True) -> list[str]:
+    """
+    Exports every model with `MarkovChain.export`, all models are also stacked in `models.npz`:
+    `names`, `states`, `transition_matrices` and `transition_counts` of shape ( models, len(State), len(State) ).
+    """
+    models = list(_models)
+    files = []
+
+    for mc in models:
+        files.extend(mc.export(_directory, _formats, _counts, _filter_zeros))
+
+    n = len(State)
+    matrices = np.zeros((len(models), n, n))
+    counts = np.zeros((len(models), n, n), dtype=np.int64)
+
+    for k, mc in enumerate(models):
+        matrices[k, :mc.nstates, :mc.nstates] = mc.transition_matrix
+        counts[k, :mc.nstates, :mc.nstates] = mc.transition_counts
+
+    files.append(os.path.join(_directory, 'models.npz'))
+    np.savez(files[-1], names=np.array([mc.name for mc in models]), states=state_names(n), transition_matrices=matrices, transition_counts=counts)
+
+    return files
+
+
+# -----------------------------------------------------------------------------
+def transition_counts(_sequences:list[np.ndarray], _nstates:int) -> np.ndarray:
+    """Returns the ( nstates, nstates ) counts of consecutive states"""
+    # Each pair of consecutive states is encoded as `s1 * nstates + s2`, so all pairs are counted at once
+    pairs = [s[:-1].astype(np.int64) * _nstates + s[1:] for s in _sequences]
+    pairs = np.concatenate(pairs) if pairs else np.empty(0, dtype=np.int64)
+
+    return np.bincount(pairs, minlength=_nstates * _nstates).reshape(_nstates, _nstates)
+
+
+# -----------------------------------------------------------------------------
+class DatasetTransitions(NamedTuple):
+    states: np.ndarray # State of each run
+    counts: np.ndarray # ( len(State), len(State) ) first order transition counts
+
+
+# -----------------------------------------------------------------------------
+class TransitionCache:
+    """
+    Transitions per dataset, keyed by a fingerprint of the data they were computed from.
+    Retraining after editing a single dataset then only recomputes the transitions of that dataset.
+    The least recently used entries are removed when there are more than `_max_entries`.
+    """
+    def __init__(self, _max_entries=1024):
+        self.max_entries = _max_entries
+        self.entries:OrderedDict[str, DatasetTransitions] = OrderedDict()
+
+
+    def get(self, _fingerprint:str) -> DatasetTransitions | None:
+        if (entry := self.entries.get(_fingerprint)) is not None:
+            self.entries.move_to_end(_fingerprint)
+
+        return entry
+
+
+    def add(self, _fingerprints:Iterable[str], _states:np.ndarray) -> DatasetTransitions:
+        """Stores the transitions of the run states `_states` under all `_fingerprints`"""
+        states = np.asarray(_states, dtype=np.int16)
+        entry = DatasetTransitions(states, transition_counts([states], len(State)).astype(np.int32))
+
+        for fp in _fingerprints:
+            self.entries[fp] = entry
+            self.entries.move_to_end(fp)
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+        return entry
@@ -0,0 +1,223 @@
+"""
+Modules are the level segments that are placed by `Map`.
+
+`Module` only holds the choice of level segment, subclasses decide how a segment is instantiated, aligned and
+checked for intersections. `PrototypeModule` does this with numpy, so maps can be laid out without Blender.
+"""
+import numpy as np
+import json
+from   abc import ABC, abstractmethod
+
+from .geometry import rotation_matrix, rotation_z, to_4x4, transform_points, obb_overlap
+
+
+# -----------------------------------------------------------------------------
+class Module(ABC):
+    """
+    Placeholder for the level segment of a state.
+    It is represented by one of the modules that are available for that state.
+    """
+    def __init__(self,
+                 _state:int,
+                 _module_names:list[str]):
+
+        self.state = _state
+        self.module_names = _module_names.copy()
+        np.random.shuffle(self.module_names)
+
+        self.current_name_index = np.random.randint(len(self.module_names))
+        self.module_name:str = None
+        self.index = 0
+
+
+    @property
+    @abstractmethod
+    def name(self) -> str:
+        """Unique name of the placed module"""
+
+    @property
+    @abstractmethod
+    def is_placed(self) -> bool:
+        """Whether a level segment is chosen"""
+
+
+    def next_name(self, _index=-1) -> str:
+        """Returns the name at `_index` or, if `_index` is out of range, cycles through the names. The name is kept in `module_name`"""
+        if 0 <= _index < len(self.module_names):
+            self.module_name = self.module_names[_index]
+            return self.module_name
+
+        self.module_name = self.module_names[self.current_name_index]
+        self.current_name_index += 1
+        self.current_name_index %= len(self.module_names)
+
+        return self.module_name
+
+
+    @abstractmethod
+    def next_module(self, _index=-1):
+        """Chooses the level segment of `next_name(_index)`"""
+
+
+    @abstractmethod
+    def align(self, _other:'Module', _align_direction=False, _rotation_offset=0):
+        """Moves the start of this module to the end of `_other`, the first module is placed at the origin"""
+
+
+    @abstractmethod
+    def intersect(self, _other:'Module') -> list[tuple[int, int]] | None:
+        """Returns the intersecting pairs of collision volume faces, or None if one of the modules has no volume"""
+
+
+    @abstractmethod
+    def bounds(self) -> tuple[np.ndarray, np.ndarray] | None:
+        """Returns the ( min, max ) world space corners of the axis aligned box around the collision volume, or None without a volume"""
+
+
+    def box(self) -> np.ndarray | None:
+        """
+        Returns the 4x4 matrix that maps the unit cube [-0.5, 0.5]^3 to the collision volume if it is a box.
+        Pairs of boxes are tested at once with `obb_overlaps` instead of `intersect`, an overlap counts as a single hit.
+        """
+        return None
+
+
+# -----------------------------------------------------------------------------
+class ModulePrototype:
+    """
+    Geometry of a level segment that is needed for placement:
+    - `points`: (N, 3) control points of the curve in curve space
+    - `matrix`: 4x4 world matrix of the curve
+    - `volume`: 4x4 matrix that maps the unit cube [-0.5, 0.5]^3 to curve space, or None without a collision volume
+    """
+    def __init__(self,
+                 _name:str,
+                 _points:np.ndarray,
+                 _matrix:np.ndarray=None,
+                 _volume:np.ndarray=None):
+
+        self.name   = _name
+        self.points = np.asarray(_points, dtype=float).reshape(-1, 3)
+        self.matrix = np.eye(4) if _matrix is None else np.asarray(_matrix, dtype=float)
+        self.volume = None if _volume is None else np.asarray(_volume, dtype=float)
+
+
+# -----------------------------------------------------------------------------
+def save_prototypes(_filepath:str, _prototypes:dict[int, list[ModulePrototype]]):
+    """Writes a module library as JSON, so that maps can be laid out without the .blend"""
+    library = {}
+
+    for state, prototypes in _prototypes.items():
+        library[str(int(state))] = [{
+            'name'   : p.name,
+            'points' : p.points.tolist(),
+            'matrix' : p.matrix.tolist(),
+            'volume' : None if p.volume is None else p.volume.tolist(),
+        } for p in prototypes]
+
+    with open(_filepath, 'w') as f:
+        json.dump(library, f)
+
+
+# -----------------------------------------------------------------------------
+def load_prototypes(_filepath:str) -> dict[int, list[ModulePrototype]]:
+    with open(_filepath) as f:
+        library = json.load(f)
+
+    return {int(state): [ModulePrototype(p['name'], p['points'], p['matrix'], p['volume']) for p in prototypes]
+            for state, prototypes in library.items()}
+
+
+# -----------------------------------------------------------------------------
+class PrototypeModule(Module):
+    """A module that is only a transform and a reference to a `ModulePrototype`"""
+    def __init__(self,
+                 _state:int,
+                 _prototypes:list[ModulePrototype]):
+
+        self.prototypes = {p.name: p for p in _prototypes}
+        super().__init__(_state, list(self.prototypes))
+
+        self.prototype:ModulePrototype = None
+        self.matrix:np.ndarray = None
+
+
+    @property
+    def name(self) -> str:
+        return f'{self.index}_{self.prototype.name}'
+
+    @property
+    def is_placed(self) -> bool:
+        return self.prototype is not None
+
+
+    def next_module(self, _index=-1):
+        self.prototype = self.prototypes[self.next_name(_index)]
+        self.matrix = self.prototype.matrix.copy()
+
+
+    def world_points(self, _indices:list[int]) -> np.ndarray:
+        return transform_points(self.matrix, self.prototype.points[_indices])
+
+
+    def align(self, _other:'PrototypeModule', _align_direction=False, _rotation_offset=0):
+        if not _other:
+            self.matrix[:3, 3] = 0
+            return
+
+        # My direction
+        start, second = self.world_points([0, 1])
+        my_dir = second - start
+        my_dir /= np.linalg.norm(my_dir)
+
+        # Other direction
+        before_end, end = _other.world_points([-2, -1])
+        other_dir = end - before_end
+        other_dir /= np.linalg.norm(other_dir)
+
+        # Add rotation offset
+        R = rotation_z(_rotation_offset)
+
+        if _align_direction:
+            # Get rotation matrix around z-axis from direction vectors
+            a = my_dir    * (1, 1, 0)
+            b = other_dir * (1, 1, 0)
+
+            if not a.any() or not b.any():
+                raise Exception(f'Direction vector has 0 length. Perhaps overlapping control points for curve: {self.name}')
+
+            R = R @ rotation_matrix(a, b)
+
+        self.matrix = self.matrix @ to_4x4(R)
+
+        # Move chain to the end of the other chain
+        self.matrix[:3, 3] = end
+
+
+    def volume_matrix(self) -> np.ndarray | None:
+        if self.prototype.volume is None:
+            return None
+
+        return self.matrix @ self.prototype.volume
+
+
+    def box(self) -> np.ndarray | None:
+        return self.volume_matrix()
+
+
+    def bounds(self) -> tuple[np.ndarray, np.ndarray] | None:
+        if (volume := self.volume_matrix()) is None:
+            return None
+
+        # Half size of the box along the world axes
+        half = np.abs(volume[:3, :3]).sum(axis=1) * .5
+        
+        return volume[:3, 3] - half, volume[:3, 3] + half
+
+
+    def intersect(self, _other:'PrototypeModule') -> list[tuple[int, int]] | None:
+        if (vol1 := self.volume_matrix()) is None or (vol2 := _other.volume_matrix()) is None:
+            return None
+
+        # Boxes have no meaningful face pairs, an overlap counts as a single hit
+        return [(0, 0)] if obb_overlap(vol1, vol2) else []
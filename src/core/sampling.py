@@ -0,0 +1,358 @@
+"""
+Constant time sampling from the rows of a transition matrix.
+"""
+import numpy as np
+
+
+# -----------------------------------------------------------------------------
+def alias_table(_p:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Vose's alias method, returns ( prob, alias ) for a probability vector that sums to 1"""
+    n = len(_p)
+    q = np.asarray(_p, dtype=float) * n
+
+    prob  = np.zeros(n, dtype=float)
+    alias = np.arange(n, dtype=np.int32)
+
+    small = [k for k in range(n) if q[k] < 1.0]
+    large = [k for k in range(n) if q[k] >= 1.0]
+
+    while small and large:
+        s = small.pop()
+        l = large.pop()
+
+        prob[s]  = q[s]
+        alias[s] = l
+
+        q[l] += q[s] - 1.0
+
+        if q[l] < 1.0: small.append(l)
+        else:          large.append(l)
+
+    # Leftovers are 1 up to rounding errors
+    prob[small + large] = 1.0
+
+    return prob, alias
+
+
+# -----------------------------------------------------------------------------
+class AliasSampler:
+    """
+    Alias tables for the rows of a transition matrix.
+
+    Only states that occur in the matrix get a row, the tables are indexed by row instead of by state. 
+    States without outgoing transitions continue with `_restart_state`.
+
+    A step needs one uniform number `u`: `x = u * nrows` selects the column `int(x)` and `x - int(x)` is
+    compared against the probability of that column.
+    """
+    def __init__(self, _matrix:np.ndarray, _restart_state:int):
+        nstates = len(_matrix)
+
+        occurs = (_matrix.sum(axis=0) > 0) | (_matrix.sum(axis=1) > 0)
+        occurs[_restart_state] = True
+
+        self.states = np.flatnonzero(occurs).astype(np.int16)
+        self.nrows = n = len(self.states)
+
+        self.row_of = np.full(nstates, -1, dtype=np.int32)
+        self.row_of[self.states] = np.arange(n, dtype=np.int32)
+
+        self.prob  = np.zeros((n, n), dtype=float)
+        self.alias = np.full((n, n), self.row_of[_restart_state], dtype=np.int32)
+
+        rows = _matrix[np.ix_(self.states, self.states)]
+
+        for r, row in enumerate(rows):
+            if (total := row.sum()) > 0:
+                self.prob[r], self.alias[r] = alias_table(row / total)
+
+        self.__prepare()
+
+
+    def __prepare(self):
+        n = self.nrows
+
+        # A column is taken when `x < col + prob`, so the fraction of `x` is never computed
+        self.thresholds = self.prob + np.arange(n)
+
+        # Vectorized steps work on row offsets `row << shift`: 
+        # the next offset is `offsets[2 * (offset + col) + (x < threshold)]`
+        self.shift = max(n - 1, 1).bit_length()
+
+        offsets = np.zeros((n, 1 << self.shift, 2), dtype=np.intp)
+        offsets[:, :n, 0] = self.alias << self.shift
+        offsets[:, :n, 1] = np.arange(n) << self.shift
+        self.offsets = offsets.ravel()
+
+        padded = np.zeros((n, 1 << self.shift), dtype=float)
+        padded[:, :n] = self.thresholds
+        self.padded_thresholds = padded.ravel()
+
+        # Python lists are faster than numpy scalars in the sequential loop of `sample_chain`
+        self.__lists = None
+
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        """The tables that `from_arrays` needs, everything else is derived from them"""
+        return {'states': self.states, 'row_of': self.row_of, 'prob': self.prob, 'alias': self.alias}
+
+
+    @classmethod
+    def from_arrays(cls, _arrays:dict[str, np.ndarray]) -> 'AliasSampler':
+        sampler = cls.__new__(cls)
+
+        sampler.states = _arrays['states']
+        sampler.row_of = _arrays['row_of']
+        sampler.prob   = _arrays['prob']
+        sampler.alias  = _arrays['alias']
+        sampler.nrows  = len(sampler.states)
+
+        sampler.__prepare()
+
+        return sampler
+
+
+    def scale(self, _u:np.ndarray) -> np.ndarray:
+        # Scaling by the float just below `nrows` keeps `int(x) < nrows` for all `u < 1`
+        return _u * np.nextafter(self.nrows, 0)
+
+
+    def sample_chain(self, _start_state:int, _u:np.ndarray) -> list[int]:
+        """Returns a chain of `len(_u) + 1` states that begins with `_start_state`"""
+        if self.__lists is None:
+            self.__lists = self.states.tolist(), self.thresholds.tolist(), self.alias.tolist()
+
+        states, thresholds, alias = self.__lists
+
+        row = self.row_of[_start_state]
+        chain = [_start_state]
+
+        for x in self.scale(_u).tolist():
+            col = int(x)
+            row = col if x < thresholds[row][col] else alias[row][col]
+            chain.append(states[row])
+
+        return chain
+
+
+    def sample_chains(self, _history:np.ndarray, _u:np.ndarray) -> np.ndarray:
+        """
+        Continues the chains, `_history` has shape ( steps, chains ) and ends with the current states.
+        `_u` has shape ( steps, chains ), returns the ( steps, chains ) sampled states.
+        """
+        x = self.scale(_u)
+        cols = x.astype(np.intp)
+
+        offset = self.row_of[_history[-1]].astype(np.intp) << self.shift
+
+        offsets = np.empty(_u.shape, dtype=np.intp)
+        idx = np.empty(len(offset), dtype=np.intp)
+        threshold = np.empty(len(offset), dtype=float)
+
+        for t in range(len(_u)):
+            np.add(offset, cols[t], out=idx)
+            self.padded_thresholds.take(idx, out=threshold)
+
+            idx <<= 1
+            idx += x[t] < threshold
+
+            self.offsets.take(idx, out=offset)
+            offsets[t] = offset
+
+        offsets >>= self.shift
+
+        return self.states.take(offsets)
+
+
+# -----------------------------------------------------------------------------
+class ContextSampler:
+    """
+    Sparse order-k model with back-off to lower orders for unseen contexts.
+
+    A context of order j are the last j states, encoded as `s[-j] * n^(j-1) + ... + s[-1]` with `n = nstates`.
+    For every order only the contexts that occur in the sequences are stored, sorted, each with an alias table over
+    the states that followed it. All tables are stored in flat arrays, a row is a context.
+    """
+    def __init__(self, _sequences:list[np.ndarray], _order:int, _nstates:int, _restart_state:int):
+        self.order = _order
+        self.nstates = n = _nstates
+
+        self.contexts:list[np.ndarray] = [np.empty(0, dtype=np.int64)]
+
+        row_counts = []
+        next_states = []
+
+        for j in range(1, _order + 1):
+            codes = []
+
+            for states in _sequences:
+                if len(states) <= j: continue
+
+                states = states.astype(np.int64)
+                m = len(states) - j
+
+                code = np.zeros(m, dtype=np.int64)
+
+                for i in range(j):
+                    code = code * n + states[i:m + i]
+
+                codes.append(code * n + states[j:])
+
+            pairs, counts = np.unique(np.concatenate(codes) if codes else np.empty(0, dtype=np.int64), return_counts=True)
+            contexts, starts = np.unique(pairs // n, return_index=True)
+
+            self.contexts.append(contexts)
+
+            row_counts.extend(np.split(counts, starts[1:]) if len(contexts) else [])
+            next_states.extend(np.split(pairs % n, starts[1:]) if len(contexts) else [])
+
+        # The last row always returns `_restart_state`
+        self.restart_row = len(row_counts)
+        row_counts.append(np.ones(1, dtype=np.int64))
+        next_states.append(np.full(1, _restart_state, dtype=np.int64))
+
+        sizes = np.array([len(c) for c in row_counts], dtype=np.intp)
+
+        self.offsets = np.zeros(len(sizes) + 1, dtype=np.intp)
+        np.cumsum(sizes, out=self.offsets[1:])
+
+        self.next_states = np.concatenate(next_states).astype(np.int16)
+        self.thresholds  = np.empty(len(self.next_states), dtype=float)
+        self.alias       = np.empty(len(self.next_states), dtype=np.intp)
+
+        for r, counts in enumerate(row_counts):
+            a, b = self.offsets[r], self.offsets[r + 1]
+
+            prob, alias = alias_table(counts / counts.sum())
+            self.thresholds[a:b] = prob + np.arange(b - a)
+            self.alias[a:b] = alias
+
+        self.__prepare()
+
+
+    def __prepare(self):
+        self.modulo = [self.nstates ** j for j in range(self.order + 1)]
+
+        # Rows of order j start at `bases[j]`
+        self.bases = np.concatenate(([0], np.cumsum([len(c) for c in self.contexts[:-1]]))).tolist()
+
+        # Scaling by the float just below the row size keeps `int(x) < size` for all `u < 1`
+        self.scales = np.nextafter(np.diff(self.offsets).astype(float), 0)
+
+        # Dicts are faster than `searchsorted` in the sequential loop of `sample_chain`
+        self.__lists = None
+
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        """The tables that `from_arrays` needs, everything else is derived from them"""
+        return {
+            'order'         : np.array(self.order),
+            'nstates'       : np.array(self.nstates),
+            'restart_row'   : np.array(self.restart_row),
+            'contexts'      : np.concatenate(self.contexts),
+            'context_sizes' : np.array([len(c) for c in self.contexts]),
+            'offsets'       : self.offsets,
+            'next_states'   : self.next_states,
+            'thresholds'    : self.thresholds,
+            'alias'         : self.alias,
+        }
+
+
+    @classmethod
+    def from_arrays(cls, _arrays:dict[str, np.ndarray]) -> 'ContextSampler':
+        sampler = cls.__new__(cls)
+
+        sampler.order       = int(_arrays['order'])
+        sampler.nstates     = int(_arrays['nstates'])
+        sampler.restart_row = int(_arrays['restart_row'])
+        sampler.contexts    = np.split(_arrays['contexts'], np.cumsum(_arrays['context_sizes'])[:-1])
+        sampler.offsets     = _arrays['offsets']
+        sampler.next_states = _arrays['next_states']
+        sampler.thresholds  = _arrays['thresholds']
+        sampler.alias       = _arrays['alias']
+
+        sampler.__prepare()
+
+        return sampler
+
+
+    def sample_chain(self, _start_state:int, _u:np.ndarray) -> list[int]:
+        """Returns a chain of `len(_u) + 1` states that begins with `_start_state`"""
+        if self.__lists is None:
+            rows = [dict(zip(c.tolist(), range(b, b + len(c)))) for c, b in zip(self.contexts, self.bases)]
+            self.__lists = rows, self.offsets.tolist(), self.scales.tolist(), self.thresholds.tolist(), self.alias.tolist(), self.next_states.tolist()
+
+        rows, offsets, scales, thresholds, alias, next_states = self.__lists
+        n, order, modulo = self.nstates, self.order, self.modulo
+
+        state = _start_state
+        chain = [state]
+
+        code = state
+        history = 1
+
+        for u in _u.tolist():
+            # Use the highest order with a known context
+            r = self.restart_row
+
+            for j in range(history, 0, -1):
+                if (row := rows[j].get(code % modulo[j])) is not None:
+                    r = row
+                    break
+
+            offset = offsets[r]
+            x = u * scales[r]
+            col = int(x)
+
+            pick = col if x < thresholds[offset + col] else alias[offset + col]
+            state = next_states[offset + pick]
+            chain.append(state)
+
+            code = (code * n + state) % modulo[order]
+            history = min(history + 1, order)
+
+        return chain
+
+
+    def sample_chains(self, _history:np.ndarray, _u:np.ndarray) -> np.ndarray:
+        """
+        Continues the chains, `_history` has shape ( steps, chains ) and ends with the current states.
+        `_u` has shape ( steps, chains ), returns the ( steps, chains ) sampled states.
+        """
+        n, order, modulo = self.nstates, self.order, self.modulo
+
+        history = min(len(_history), order)
+
+        code = np.zeros(_history.shape[1], dtype=np.int64)
+
+        for states in _history[-history:]:
+            code = code * n + states
+
+        sampled = np.empty(_u.shape, dtype=np.int16)
+
+        for t in range(len(_u)):
+            # Use the highest order with a known context
+            rows = np.full(len(code), self.restart_row, dtype=np.intp)
+            found = np.zeros(len(code), dtype=bool)
+
+            for j in range(history, 0, -1):
+                if len(contexts := self.contexts[j]) == 0: continue
+
+                context = code % modulo[j]
+                pos = np.minimum(np.searchsorted(contexts, context), len(contexts) - 1)
+
+                hit = (contexts[pos] == context) & ~found
+                rows[hit] = self.bases[j] + pos[hit]
+                found |= hit
+
+            offset = self.offsets[rows]
+            x = _u[t] * self.scales[rows]
+            col = x.astype(np.intp)
+
+            pick = np.where(x < self.thresholds[offset + col], col, self.alias[offset + col])
+            sampled[t] = self.next_states[offset + pick]
+
+            code = (code * n + sampled[t]) % modulo[order]
+            history = min(history + 1, order)
+
+        return sampled
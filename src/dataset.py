@@ -1,170 +1,75 @@
 import bpy, bmesh, blf
-from   bpy.types           import PropertyGroup, Object, Mesh, MeshVertex, Operator, Context, Panel, SpaceView3D, Scene
-from   bpy.props           import BoolProperty, FloatProperty, FloatVectorProperty, IntProperty, StringProperty, PointerProperty
+from   bpy.types           import PropertyGroup, Object, Mesh, Operator, Context, Panel, SpaceView3D, Scene, OperatorFileListElement
+from   bpy.props           import BoolProperty, FloatProperty, FloatVectorProperty, IntProperty, StringProperty, PointerProperty, CollectionProperty
 from   bpy_extras          import view3d_utils
 from   bpy_extras.io_utils import ImportHelper
-from   bmesh.types         import BMesh, BMLayerAccessVert, BMLayerItem
-from   mathutils           import Vector
+from   bmesh.types         import BMesh, BMLayerItem
 
-import ntpath, json
+import ntpath, os
 import numpy       as np
-from   enum        import Enum
-from   collections import UserList
-from   typing      import Generator
+from   hashlib     import blake2b
+from   time        import perf_counter
 
-from ..        import b3d_utils
-from .gui      import MEdgeToolsPanel, DatasetTab
-from .movement import State, StateEnumProperty
+from ..               import b3d_utils
+from ..prefs          import get_prefs
+from .gui             import MEdgeToolsPanel, DatasetTab
+from .movement        import State, StateEnumProperty
+from .core.dataset    import LayerType, Attribute, Dataset, SequenceRuns, consecutive_connected
+from .core.log_reader import LogCache, load_log, load_logs
+from .core.markov     import TransitionCache, DatasetTransitions
 
 # -----------------------------------------------------------------------------
 # region Dataset
 # -----------------------------------------------------------------------------
 # -----------------------------------------------------------------------------
-class LayerType(str, Enum):
-    NONE         = 'NONE'
-    INT          = 'INT'
-    FLOAT_VECTOR = 'FLOAT_VECTOR'
-
-
-# -----------------------------------------------------------------------------
-# https://stackoverflow.com/questions/43862184/associating-string-representations-with-an-enum-that-uses-integer-values
-class Attribute(int, Enum):
-    def __new__(cls, _value: int, _label: str, _type: str):
-        obj = int.__new__(cls, _value)
-        obj._value_ = _value
-        obj.index = _value
-        obj.label = _label
-        obj.type = _type
-        
-        return obj
-    
-    def __int__(self):
-        return self.value
-    
-    @classmethod
-    def from_string(cls, _s):
-        for att in cls:
-            if att.label == _s:
-                return att
-            
-        raise ValueError(cls.__name__ + ' has no value matching "' + _s + '"')
-
-    # From .json file
-    STATE           = 0, 'state'          , LayerType.INT
-    LOCATION        = 1, 'location'       , LayerType.NONE
-    TIMESTAMP       = 2, 'timestamp'      , LayerType.FLOAT_VECTOR
-    
-    # These will be updated after import
-    # A vertex is a sequence start when it has a different state than the previous vertex or it is disconnected from the previous vertex
-    SEQUENCE_START  = 3, 'sequence_start' , LayerType.INT
-
-
-# -----------------------------------------------------------------------------
-class DatabaseEntry(UserList):
-    def __init__(self) -> None:
-        data = []
-
-        for att in Attribute:
-            match(att.type):
-                case LayerType.NONE:
-                    data.append(None)
-                case LayerType.INT:
-                    data.append(0)
-                case LayerType.FLOAT_VECTOR:
-                    data.append(Vector())
-
-        self.data = np.array(data, dtype=object)
-
-
-    def __getitem__(self, _key:int|str):
-        if isinstance(_key, int):
-            return self.data[_key]
-        
-        if isinstance(_key, str):
-            return self.data[Attribute.from_string(_key).index]
-    
-
-    def __setitem__(self, _key:int|str, _value):
-        if isinstance(_key, int):        
-            self.data[_key] = _value
-
-        if isinstance(_key, str):
-            self.data[Attribute.from_string(_key).index] = _value
-
-
-# -----------------------------------------------------------------------------
-class Dataset:
-    def __init__(self):
-        self.data = np.empty((0, len(Attribute)), dtype=object)
-
-    def __getitem__(self, _key):
-        return self.data[_key]
-    
-    def __setitem__(self, _key, _value):
-        self.data[_key] = _value
-    
-    def __len__(self):
-        return len(self.data)
-    
-   
-    def append(self, _entry:DatabaseEntry):
-        V = np.array([_entry], dtype=object)
-        self.data = np.append(self.data, V, axis=0)
-
-
-    def extend(self, _other):
-        self.data = np.concatenate((self.data, _other.data), axis=0)
+class DatasetIO:
+    def __init__(self, _cache:LogCache=None):
+        self.cache = _cache
 
 
-# -----------------------------------------------------------------------------
-class DatasetIO:
-    def import_from_file(self, _filepath:str) -> None:
-        with open(_filepath, 'r') as f:
-            log = json.load(f)
+    def import_from_file(self, _filepath:str, _stream=True) -> None:
+        log = load_log(_filepath, _stream, self.cache)
 
-        dataset = Dataset()
+        dataset = Dataset.from_arrays(log.states, log.locations, log.timestamps, log.sequence_starts)
 
-        prev_state = None
+        name = ntpath.basename(_filepath)
+        self.create_polyline(dataset, name)
 
-        for item in log:
-            player_state = int(item[Attribute.STATE.label])
+        if self.cache:
+            self.cache.evict()
 
-            ts = str(item[Attribute.TIMESTAMP.label]).split(':')
-            timestamp = Vector(( float(ts[0]), float(ts[1]), float(ts[2]) ))
 
-            x = float(item[Attribute.LOCATION.label]['x'])
-            y = float(item[Attribute.LOCATION.label]['y'])
-            z = float(item[Attribute.LOCATION.label]['z'])
-            location = Vector((y, x, z))
+    def import_from_files(self, _filepaths:list[str], _stream=True, _workers:int=None) -> list[tuple[str, int, float]]:
+        """
+        Parses the files in a process pool, only the meshes are created on the main thread.
+        Returns ( filename, number of samples, seconds ) for each file.
+        """
+        stats = []
 
-            entry = DatabaseEntry()
-            entry[Attribute.STATE.index]          = player_state
-            entry[Attribute.TIMESTAMP.index]      = timestamp
-            entry[Attribute.LOCATION.index]       = location
-            entry[Attribute.SEQUENCE_START.index] = False
+        for log in load_logs(_filepaths, _stream, _workers, self.cache):
+            start = perf_counter()
 
-            if not prev_state or prev_state != player_state:
-                entry[Attribute.SEQUENCE_START.index] = True
+            dataset = Dataset.from_arrays(log.states, log.locations, log.timestamps, log.sequence_starts)
 
-            dataset.append(entry)
+            name = ntpath.basename(log.filepath)
+            self.create_polyline(dataset, name)
 
-            prev_state = player_state
+            stats.append((name, len(dataset), log.seconds + perf_counter() - start))
 
-        name = ntpath.basename(_filepath)
-        self.create_polyline(dataset, name)
+        return stats
 
 
     def create_polyline(self, _dataset:Dataset, _name:str) -> Object:
         # Create polyline
-        verts = _dataset[:, Attribute.LOCATION.index]
-        edges = [(i, i + 1) for i in range(len(verts) - 1)]
+        verts = _dataset.locations
+        edges = b3d_utils.polyline_edges(len(verts))
 
-        mesh = b3d_utils.new_mesh(verts, edges, [], _name)
+        mesh = b3d_utils.new_mesh_from_arrays(verts, edges, _name)
         obj = b3d_utils.new_object(mesh, _name)  
 
         # Add data to vertex attributes
+        # All vertices are connected, so there is no need to `update_attributes`
         to_dataset(obj, _dataset)
-        update_attributes(obj)
 
         return obj
 
@@ -191,29 +96,20 @@ def to_dataset(_obj:Object, _dataset:Dataset=None):
     
     mesh = _obj.data
     
-    n               = len(mesh.vertices)
-    player_states   = [State.Walking.index] * n
-    timestamps      = [0] * n * 3
-    sequence_starts = [False] * n
-
-
-    def unpack(_packed:list, _dest:list):
-        for k in range(n):
-            _dest[k * 3 + 0] = _packed[k].x
-            _dest[k * 3 + 1] = _packed[k].y
-            _dest[k * 3 + 2] = _packed[k].z
-
+    n = len(mesh.vertices)
 
+    # Blender expects int32 and float32 buffers, otherwise `foreach_set` falls back to per item conversion
     if _dataset:
-        player_states = list(_dataset[:, Attribute.STATE.index] )
-
-        packed_ts = list(_dataset[:, Attribute.TIMESTAMP.index])
-        unpack(packed_ts, timestamps)
-
-        sequence_starts = list(_dataset[:, Attribute.SEQUENCE_START.index])
+        player_states   = _dataset.states.astype(np.int32)
+        timestamps      = _dataset.timestamps.ravel()
+        sequence_starts = _dataset.sequence_starts.astype(np.int32)
+    else:
+        player_states   = np.full(n, State.Walking.value, dtype=np.int32)
+        timestamps      = np.zeros(n * 3, dtype=np.float32)
+        sequence_starts = np.zeros(n, dtype=np.int32)
 
 
-    def add_attribute(_att:Attribute, _data:list):
+    def add_attribute(_att:Attribute, _data:np.ndarray):
         if _att.label not in mesh.attributes:
             x = mesh.attributes.new(name=_att.label, type=_att.type, domain='POINT')
             match(_att.type):
@@ -249,75 +145,89 @@ def get_layer(_bm:BMesh, _att:Attribute) -> BMLayerItem | None:
 def update_attributes(_obj:Object):
     if not is_dataset(_obj): return
 
-    bm = b3d_utils.get_bmesh_from_object(_obj)
-    bm.verts.ensure_lookup_table()
+    # Edits are only written to the mesh when leaving edit mode
+    prev_mode = _obj.mode
 
-    layers = bm.verts.layers
-    seq_start = layers.int.get(Attribute.SEQUENCE_START.label)
+    if prev_mode != 'OBJECT':
+        b3d_utils.set_object_mode(_obj, 'OBJECT')
 
-    for v1, v2 in zip(bm.verts, bm.verts[1:]):
-        if v2 in [x for y in [a.verts for a in v1.link_edges] for x in y if x != v1]:
-            continue
+    mesh = _obj.data
+    n = len(mesh.vertices)
+
+    edges = np.empty(len(mesh.edges) * 2, dtype=np.int32)
+    mesh.edges.foreach_get('vertices', edges)
+
+    seq_start = mesh.attributes[Attribute.SEQUENCE_START.label]
+    starts = np.empty(n, dtype=np.int32)
+    seq_start.data.foreach_get('value', starts)
 
-        # If v2 is not connected to v1, then v2 is a sequence start
-        v2[seq_start] = True
+    # If v2 is not connected to v1, then v2 is a sequence start
+    starts[1:] |= ~consecutive_connected(edges.reshape(-1, 2), n)
 
-    b3d_utils.update_mesh_from_bmesh(_obj.data, bm)
+    seq_start.data.foreach_set('value', starts)
+    mesh.update()
+
+    if prev_mode != 'OBJECT':
+        b3d_utils.set_object_mode(_obj, prev_mode)
 
 
 # -----------------------------------------------------------------------------
-def dataset_entries(_obj:Object) -> Generator[DatabaseEntry, None, None]:
-    bm = b3d_utils.get_bmesh_from_object(_obj)
+def dataset_runs(_obj:Object) -> SequenceRuns:
+    if _obj.mode == 'EDIT':
+        _obj.update_from_editmode()
 
+    mesh = _obj.data
+    n = len(mesh.vertices)
 
-    def get_layers() -> Generator[BMLayerAccessVert, None, None]:
-        nonlocal bm
+    states     = np.empty(n, dtype=np.int32)
+    seq_starts = np.empty(n, dtype=np.int32)
+    locations  = np.empty(n * 3, dtype=np.float32)
 
-        for att in Attribute:
-            yield get_layer(bm, att)
+    mesh.attributes[Attribute.STATE.label].data.foreach_get('value', states)
+    mesh.attributes[Attribute.SEQUENCE_START.label].data.foreach_get('value', seq_starts)
+    mesh.vertices.foreach_get('co', locations)
 
+    return SequenceRuns(states, seq_starts, locations.reshape(n, 3))
 
-    def retrieve_entry(_vert:MeshVertex) -> DatabaseEntry:
-        nonlocal bm
-        entry = DatabaseEntry()
-        entry[Attribute.LOCATION.index] = _vert.co
 
-        for layer in get_layers():
-            if not layer: continue
-            entry[layer.name] = _vert[layer]
+# -----------------------------------------------------------------------------
+def dataset_fingerprint(_obj:Object) -> str:
+    """Hash of the data that the runs depend on: states, sequence starts and edges"""
+    if _obj.mode == 'EDIT':
+        _obj.update_from_editmode()
 
-        return entry
+    mesh = _obj.data
+    n = len(mesh.vertices)
 
+    states     = np.empty(n, dtype=np.int32)
+    seq_starts = np.empty(n, dtype=np.int32)
+    edges      = np.empty(len(mesh.edges) * 2, dtype=np.int32)
 
-    bm.verts.ensure_lookup_table()
+    mesh.attributes[Attribute.STATE.label].data.foreach_get('value', states)
+    mesh.attributes[Attribute.SEQUENCE_START.label].data.foreach_get('value', seq_starts)
+    mesh.edges.foreach_get('vertices', edges)
 
-    for v in bm.verts:
-        yield retrieve_entry(v)
-    
+    h = blake2b(digest_size=16)
 
-# -----------------------------------------------------------------------------
-def dataset_sequences(_obj:Object) -> Generator[tuple[int, list[Vector], float, bool], None, None]:
-    """Yields ( state, list of locations )"""
-    entries = dataset_entries(_obj)
-    first_entry = next(entries)
+    for data in (states, seq_starts, edges):
+        h.update(len(data).to_bytes(8, 'little'))
+        h.update(data)
 
-    curr_state = first_entry[Attribute.STATE.index]
-    curr_locs  = [first_entry[Attribute.LOCATION.index]]
+    return h.hexdigest()
 
-    for entry in entries:
-        state = entry[Attribute.STATE.index]
-        loc   = entry[Attribute.LOCATION.index]
-        start = entry[Attribute.SEQUENCE_START.index]
 
-        curr_locs.append(loc)
-        
-        if state != curr_state or start:
-            yield curr_state, curr_locs
+# -----------------------------------------------------------------------------
+def dataset_transitions(_obj:Object, _cache:TransitionCache) -> DatasetTransitions:
+    """Returns the cached transitions of the dataset, they are only recomputed when the dataset has changed"""
+    if (entry := _cache.get(fingerprint := dataset_fingerprint(_obj))):
+        return entry
 
-            curr_state  = state
-            curr_locs   = []
-    
-    yield curr_state, curr_locs
+    update_attributes(_obj)
+
+    # `update_attributes` can add sequence starts, the entry is stored for the data before and after
+    fingerprints = {fingerprint, dataset_fingerprint(_obj)}
+
+    return _cache.add(fingerprints, dataset_runs(_obj).states)
     
 # endregion
 
@@ -378,13 +288,79 @@ class MET_OT_import_dataset(Operator, ImportHelper):
         maxlen=255,
     )
 
+    files: CollectionProperty(
+        type=OperatorFileListElement,
+        options={'HIDDEN', 'SKIP_SAVE'},
+    )
+
+    directory: StringProperty(
+        subtype='DIR_PATH',
+        options={'HIDDEN', 'SKIP_SAVE'},
+    )
+
+    stream: BoolProperty(
+        name='Stream',
+        description='Parse the file in chunks instead of loading it at once. Keeps memory usage low for large logs',
+        default=True,
+    )
+
+    use_directory: BoolProperty(
+        name='Whole Directory',
+        description='Import every .json file in the directory instead of the selected files',
+        default=False,
+    )
+
+    workers: IntProperty(
+        name='Workers',
+        description='Number of processes that parse files in parallel. 0 uses all cores',
+        default=0,
+        min=0,
+    )
+
 
     def execute(self, _context:Context):
-        DatasetIO().import_from_file(self.filepath)
+        filepaths = self.get_filepaths()
+
+        if not filepaths: 
+            self.report({'WARNING'}, 'No files to import')
+            return {'CANCELLED'}
+
+        io = DatasetIO(get_dataset_cache())
+
+        # Starting a process pool is not worth it for a single file
+        if len(filepaths) == 1:
+            io.import_from_file(filepaths[0], self.stream)
+            return {'FINISHED'}
+
+        start = perf_counter()
+        stats = io.import_from_files(filepaths, self.stream, self.workers)
+        total_time = perf_counter() - start
+
+        total_samples = 0
+
+        for name, samples, seconds in stats:
+            print(f'{name}: {samples} samples in {seconds:.2f}s ({samples / max(seconds, 1e-9):.0f} samples/s)')
+            total_samples += samples
+
+        self.report({'INFO'}, f'Imported {len(stats)} files, {total_samples} samples in {total_time:.2f}s')
 
         return {'FINISHED'}
     
 
+    def get_filepaths(self) -> list[str]:
+        directory = self.directory or os.path.dirname(self.filepath)
+
+        if self.use_directory:
+            names = sorted(f for f in os.listdir(directory) if f.lower().endswith('.json'))
+        else:
+            names = [f.name for f in self.files if f.name]
+
+        if not names:
+            return [self.filepath] if os.path.isfile(self.filepath) else []
+
+        return [os.path.join(directory, name) for name in names]
+    
+
 # -----------------------------------------------------------------------------
 # region Visualization
 # -----------------------------------------------------------------------------
@@ -738,19 +714,23 @@ class MET_OT_extract_curves(Operator):
 
         collection = b3d_utils.new_collection('EXTRACTED_CURVES_' + obj.name)
 
-        for state, locations in dataset_sequences(obj):
-            name = State(state).name
+        runs = dataset_runs(obj)
+        n = len(runs.locations)
+
+        for state, start, stop in zip(runs.states, runs.starts, runs.stops):
+            name = State(int(state)).name
+
+            # Include the first location of the next run, so that the curve ends where the next one starts
+            locations = runs.locations[start:min(stop + 1, n)]
 
             curve_data, path = b3d_utils.create_curve('POLY', len(locations))
 
             # To origin
-            offset = locations[0].copy()
-            for p in locations:
-                p -= offset
+            points = np.ones((len(locations), 4), dtype=np.float32)
+            points[:, :3] = locations - locations[0]
 
             # Update curve points
-            for p1, p2 in zip(path.points, locations):
-                p1.co = *p2, 1
+            path.points.foreach_set('co', points.ravel())
 
             b3d_utils.new_object(curve_data, f'{name}_Curve', collection)
 
@@ -868,6 +848,18 @@ def get_datasettings_prop(_context:Context) -> MET_SCENE_PG_datasettings:
     return _context.scene.medge_datasettings
 
 
+# -----------------------------------------------------------------------------
+def get_dataset_cache() -> LogCache | None:
+    prefs = get_prefs()
+
+    if not prefs.use_dataset_cache: 
+        return None
+
+    directory = bpy.path.abspath(prefs.dataset_cache_directory) or None
+
+    return LogCache(directory, prefs.dataset_cache_size_limit * (1 << 20))
+
+
 # -----------------------------------------------------------------------------
 def get_toggle_vis(_context:Context) -> bpy.types.BoolProperty:
     return _context.window_manager.toggle_vis
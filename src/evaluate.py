@@ -60,13 +60,9 @@ class MET_OT_evaluate_computational_performance(Operator):
         # Generate Markov Chains
         active_mc.create_transition_matrix()
 
-        seed = eval_settings.seed_start
-
-        for _ in range(eval_settings.map_amount):
-            active_mc.length = eval_settings.map_length
-            active_mc.seed = seed
-            active_mc.generate_chain()
-            seed += 1
+        active_mc.length = eval_settings.map_length
+        active_mc.seed = eval_settings.seed_start
+        active_mc.generate_chains(eval_settings.map_amount)
 
         # Generate maps
         module_groups = get_curve_module_groups_prop(_context).items
@@ -85,7 +81,7 @@ class MET_OT_evaluate_computational_performance(Operator):
             time = datetime.now().strftime('%Y-%m-%d_%H:%M:%S')
             collection = new_collection(f'{k}_POPULATED_{active_mc.name}_[{gen_settings}]_{time}', _parent=main_collection )
 
-            states = filter_states(gen_chain.split(), gen_settings)
+            states = filter_states(gen_chain.split(), gen_settings, gen_chain.is_constrained)
             print(str(len(states)) + ' states')
 
             map = Map(None, gen_settings)
@@ -13,106 +13,122 @@ from .map        import get_medge_map_gen_settings, MET_SCENE_PG_map_gen_setting
 # Export
 # -----------------------------------------------------------------------------
 # -----------------------------------------------------------------------------
-class MET_OT_prepare_for_export(Operator):
-    bl_idname = 'medge_generate.prepare_for_export'
-    bl_label = 'Prepare For Export'
-    bl_options = {'UNDO'}
+def prepare_for_export(_settings:MET_SCENE_PG_map_gen_settings, _collection:Collection):
+    new_collection = b3d_utils.new_collection('PrepareForExport', _collection)
 
+    # Add player start
+    bpy.ops.medge_map_editor.add_actor(type='PLAYER_START')
+    ps = bpy.context.object
 
-    def execute(self, _context:Context):
-        collection = get_active_collection()
-        settings = get_medge_map_gen_settings(_context)
-        self.prepare_for_export(settings, collection)
+    b3d_utils.link_object_to_scene(ps, new_collection)
 
-        return {'FINISHED'}
-    
+    ps.location = Vector((0, 0, 0))
+
+    # Add directional light
+    bpy.ops.object.light_add(type='SUN', align='WORLD', location=(0, 0, 3), scale=(1, 1, 1))
+    light = bpy.context.object
 
-    def prepare_for_export(self, _settings:MET_SCENE_PG_map_gen_settings, _collection:Collection):
-        new_collection = b3d_utils.new_collection('PrepareForExport', _collection)
+    b3d_utils.link_object_to_scene(light, new_collection)
 
-        # Add player start
-        bpy.ops.medge_map_editor.add_actor(type='PLAYER_START')
-        ps = bpy.context.object
+    # Add killvolume
+    scale = 500
 
-        b3d_utils.link_object_to_scene(ps, new_collection)
-        
-        ps.location = Vector((0, 0, 0))
+    bpy.ops.medge_map_editor.add_actor(type='KILL_VOLUME')
+    kv = bpy.context.object
 
-        # Add directional light
-        bpy.ops.object.light_add(type='SUN', align='WORLD', location=(0, 0, 3), scale=(1, 1, 1))
-        light = bpy.context.object
+    b3d_utils.link_object_to_scene(kv, new_collection)
 
-        b3d_utils.link_object_to_scene(light, new_collection)
+    kv.location = 0, 0, -50
+    kv.scale = scale, scale, 10
 
-        # Add killvolume
-        scale = 500
+    # Add skydome top
+    scale = 7000
+    bpy.ops.medge_map_editor.add_skydome()
+    sd = bpy.context.object
 
-        bpy.ops.medge_map_editor.add_actor(type='KILL_VOLUME')
-        kv = bpy.context.object
+    b3d_utils.link_object_to_scene(sd, new_collection)
 
-        b3d_utils.link_object_to_scene(kv, new_collection)
+    sd.location = 0, 0, 0
+    sd.scale = scale, scale, scale
 
-        kv.location = 0, 0, -50
-        kv.scale = scale, scale, 10
+    if _settings.skydome:
+        sd.medge_actor.static_mesh.use_prefab = True
+        sd.medge_actor.static_mesh.prefab = _settings.skydome
 
-        # Add skydome top
-        scale = 7000
-        bpy.ops.medge_map_editor.add_skydome()
-        sd = bpy.context.object
+    if _settings.only_top: return
 
-        b3d_utils.link_object_to_scene(sd, new_collection)
+    # Add skydome bottom
+    bpy.ops.medge_map_editor.add_skydome()
+    sd = bpy.context.object
+    b3d_utils.link_object_to_scene(sd, new_collection)
 
-        sd.location = 0, 0, 0
-        sd.scale = scale, scale, scale
+    sd.location = (0, 0, 0)
+    sd.scale = (scale, scale, scale)
+    sd.rotation_euler.x = pi
 
-        if _settings.skydome:
-            sd.medge_actor.static_mesh.use_prefab = True
-            sd.medge_actor.static_mesh.prefab = _settings.skydome
+    if _settings.skydome:
+        sd.medge_actor.static_mesh.use_prefab = True
+        sd.medge_actor.static_mesh.prefab = _settings.skydome
 
-        if _settings.only_top: return
 
-        # Add skydome bottom
-        bpy.ops.medge_map_editor.add_skydome()
-        sd = bpy.context.object
-        b3d_utils.link_object_to_scene(sd, new_collection)
+# -----------------------------------------------------------------------------
+def export_t3d(_collection:Collection, _filepath:str=None):
+    """Without `_filepath` the file browser of the T3D exporter is opened"""
+    b3d_utils.deselect_all_objects()
+
+    for obj in _collection.all_objects:
+        if obj.type != 'LIGHT':
+            if obj.medge_actor.type == 'NONE': continue
+
+        b3d_utils.select_object(obj)
+
+    parenting = [(obj, obj.parent, obj.matrix_parent_inverse.copy(), obj.matrix_basis.copy()) for obj in bpy.context.selected_objects]
+
+    bpy.ops.object.parent_clear(type='CLEAR_KEEP_TRANSFORM')
+
+    if _filepath:
+        bpy.ops.medge_map_editor.t3d_export(filepath=_filepath, selected_collection=True)
+    else:
+        bpy.ops.medge_map_editor.t3d_export('INVOKE_DEFAULT', selected_collection=True)
+
+    # There is no undo stack in background mode, the parenting is restored by hand
+    if bpy.ops.ed.undo.poll():
+        bpy.ops.ed.undo()
+        return
 
-        sd.location = (0, 0, 0)
-        sd.scale = (scale, scale, scale)
-        sd.rotation_euler.x = pi
-            
-        if _settings.skydome:
-            sd.medge_actor.static_mesh.use_prefab = True
-            sd.medge_actor.static_mesh.prefab = _settings.skydome
+    for obj, parent, parent_inverse, basis in parenting:
+        obj.parent = parent
+        obj.matrix_parent_inverse = parent_inverse
+        obj.matrix_basis = basis
 
 
 # -----------------------------------------------------------------------------
-class MET_OT_export_t3d(Operator):
-    bl_idname = 'medge_generate.export_t3d'
-    bl_label = 'Export T3D'
+class MET_OT_prepare_for_export(Operator):
+    bl_idname = 'medge_generate.prepare_for_export'
+    bl_label = 'Prepare For Export'
     bl_options = {'UNDO'}
 
 
     def execute(self, _context:Context):
         collection = get_active_collection()
-        self.export(collection)
+        settings = get_medge_map_gen_settings(_context)
+        prepare_for_export(settings, collection)
 
         return {'FINISHED'}
-    
 
-    def export(self, _collection:Collection):
-        b3d_utils.deselect_all_objects()
 
-        for obj in _collection.all_objects:
-            if obj.type != 'LIGHT':
-                if obj.medge_actor.type == 'NONE': continue
-            
-            b3d_utils.select_object(obj)
+# -----------------------------------------------------------------------------
+class MET_OT_export_t3d(Operator):
+    bl_idname = 'medge_generate.export_t3d'
+    bl_label = 'Export T3D'
+    bl_options = {'UNDO'}
+
 
-        bpy.ops.object.parent_clear(type='CLEAR_KEEP_TRANSFORM')
-        
-        bpy.ops.medge_map_editor.t3d_export('INVOKE_DEFAULT', selected_collection=True)
+    def execute(self, _context:Context):
+        collection = get_active_collection()
+        export_t3d(collection)
 
-        bpy.ops.ed.undo()
+        return {'FINISHED'}
 
 
 # -----------------------------------------------------------------------------
@@ -1,19 +1,16 @@
 import bpy
 from bpy.types import Context, Scene, Object, Collection, Operator, PropertyGroup, Panel
-from bpy.props import PointerProperty, BoolProperty, IntProperty
+from bpy.props import PointerProperty, BoolProperty, IntProperty, EnumProperty
 
-import numpy     as     np
-from itertools   import product
-from collections import UserList
 from datetime    import datetime
 from time        import perf_counter
 
 from .gui        import MEdgeToolsPanel, GenerateTab
 from ..          import b3d_utils
 from ..b3d_utils import new_collection
-from .movement   import State
 from .markov     import MET_PG_generated_chain, get_markov_chains_prop
-from .modules    import CurveModule, MET_PG_curve_module_collection, get_curve_module_groups_prop
+from .modules    import CurveModule, MET_PG_curve_module_collection, get_curve_module_groups_prop, module_prototypes
+from .core.map   import PrototypeMap, filter_states as core_filter_states
 
 
 # -----------------------------------------------------------------------------
@@ -34,6 +31,10 @@ class MET_SCENE_PG_map_gen_settings(PropertyGroup):
     align_orientation:    BoolProperty(name='Align Orientation')
     resolve_intersection: BoolProperty(name='Resolve Intersection', default=True)
     max_resolve_attempts: IntProperty(name='Max Resolve Attempts', default=50, min=1)
+    collision_mode:       EnumProperty(name='Collision Mode', default='BOX', items=(
+        ('BOX',  'Box',  'Box shaped collision volumes are tested as oriented boxes, other volumes as meshes'),
+        ('MESH', 'Mesh', 'All collision volumes are tested as meshes'),
+    ))
 
     # Export settings
     skydome:              PointerProperty(type=Object, name='Skydome')
@@ -44,47 +45,26 @@ class MET_SCENE_PG_map_gen_settings(PropertyGroup):
 # Map
 # -----------------------------------------------------------------------------
 # -----------------------------------------------------------------------------
-class Map(UserList):
-    """` list[CurveModule] `"""
+class Map(PrototypeMap):
+    """
+    ` list[CurveModule] `
 
+    The map is laid out with transforms only, objects are only created for the final configuration.
+    """
     def __init__(self, _data=None, _settings:MET_SCENE_PG_map_gen_settings=None):
-        super().__init__(_data)
+        super().__init__({}, _data, _settings)
 
-        self.obj:Object = None
-        self.settings = _settings
-        self.debug = True
 
-        np.random.seed(self.settings.seed)
-
-        # Only contains indices that point to candidates to resolve intersection
-        self.resolve_candidates:list[int] = []
-        # If the CurveModule is a resolve candidate, store the index to resolve_candidates, otherwise it is 0
-        self.is_candidate:list[int] = []
-
-
-    def append(self, _item:CurveModule):
-        super().append(_item)
-        
-        if (_item.state == State.Walking or 
-            _item.state == State.WallRunningLeft or 
-            _item.state == State.WallRunningRight):
-            self.resolve_candidates.append(len(self.data) - 1)
-            self.is_candidate.append(len(self.resolve_candidates) - 1)
-
-        else:
-            self.is_candidate.append(0)
+    def create_module(self, _state:int, _module_names:list[str]) -> CurveModule:
+        return CurveModule(_state, [p for p in self.prototypes[_state] if p.name in _module_names], self.settings.collision_mode)
 
 
     def prepare(self, 
                 _states:list[int],
                 _module_groups:list[MET_PG_curve_module_collection]):
         
-        for state in _states:
-            if not (mn := _module_groups[state].collect_curve_names()): 
-                    continue
-
-            cm = CurveModule(state, mn)
-            self.append(cm)
+        self.prototypes = module_prototypes(_module_groups)
+        super().prepare(_states)
 
 
     def build(self, _collection:Collection):
@@ -93,229 +73,34 @@ class Map(UserList):
         for k, cm in enumerate(self.data):
             cm.prepare(k, _collection)
 
-        # Build modules
-        if self.debug: print('Building map...')
+        total_time, place_times, resolve_times, hits = super().build()
 
+        # Instantiate modules
         start_time = perf_counter()
 
-        place_times = []
-        resolve_times = []
-        hits = []
-
-        for k, cm in enumerate(self.data):
-            if self.debug: print(f'Iteration: {k} / {len(self.data) - 1}')
-            st = perf_counter()
-            cm.next_module()
-
-            # Align
-            self.align_module(k)
-            et = perf_counter()
-
-            place_times.append(et - st)
-            hits.append(0)
-            resolve_times.append(0)
-
-            # Check intersections
-            if self.check_intersection(k) == 0: 
-                continue
-
-            # Resolve intersections
-            if not self.settings.resolve_intersection: 
-                continue
-
-            st = perf_counter()
-            hits[-1] = self.resolve_intersections(k)
-            et = perf_counter()
-
-            resolve_times[-1] = et - st
+        for cm in self.data:
+            cm.instantiate()
 
-        end_time = perf_counter()
-
-        total_time = end_time - start_time
+        total_time += perf_counter() - start_time
 
         return total_time, place_times, resolve_times, hits
 
 
-    def check_intersection(self, _index:int) -> int:
-        cm1 = self.data[_index]
-            
-        total = 0
-
-        for k in range(_index - 1, -1, -1):
-            if _index == k: continue
-
-            cm2 = self.data[k]
-
-            if (hits := cm1.intersect(cm2)):
-                total += len(hits)
-
-        return total
-
-
-    def check_intersections_range(self, _start:int) -> int:
-        total = 0
-        
-        for j in range(_start, -1, -1):
-            total += self.check_intersection(j)
-
-        return total
-
-
-    def resolve_intersections(self, _start:int) -> int:
-        if self.debug: print(f'Resolving intersections...')
-        
-        module_names_indices:list[list[int]] = []
-        current_candidates:list[int] = []
-
-        # Find resolve candidate
-        for k in range(_start, -1, -1):
-            if (start_candidate := self.is_candidate[k]) != 0:
-                break
-
-        end_resolving = False
-        lowest_hits = float('inf')
-        best_candidates = None
-        best_permutation = None
-
-        # Try different candidates
-        curr_iteration = 0
-
-        for k in range(start_candidate, -1, -1):
-
-            i = self.resolve_candidates[k]
-            cm:CurveModule = self.data[i]
-
-            module_names_indices.append(range(len(cm.module_names)))
-            current_candidates.append(i)
-        
-            for permutation in product(*module_names_indices):
-                self.apply_configuration(current_candidates, permutation)
-
-                hits = self.check_intersections_range(_start)
-                if self.debug:  print(f'Hits: {hits}')
-
-                curr_iteration += 1
-
-                if hits < lowest_hits:
-                    lowest_hits = hits
-                    best_candidates = current_candidates
-                    best_permutation = permutation
-
-                if hits == 0 or curr_iteration >= self.settings.max_resolve_attempts:
-                    end_resolving = True
-                    break
-        
-            if end_resolving:
-                break
-
-        if lowest_hits != 0:
-            print('Applying best permutation')
-            self.apply_configuration(best_candidates, best_permutation)
-
-        return lowest_hits
-
-
-    def apply_configuration(self, _indices:list[int], _permutation:tuple[int, ...]) -> int:
-        lowest_idx = len(self.data) - 1
-        names = []
-
-        # Apply permutation
-        for i, p in zip(_indices, _permutation):
-            cm:CurveModule = self.data[i]
-            cm.next_module(p)
-            names.append(cm.curve.name)
-
-            if i < lowest_idx: 
-                lowest_idx = i
-
-        if self.debug: print(f'Applied permutation: {_permutation}, Objects: {names}')
-
-        # Align modules
-        for k in range(lowest_idx, len(self.data), 1):
-            self.align_module(k)
-
-
-    def align_module(self, _index:int):
-        cm:CurveModule = self.data[_index]
-        if not cm.curve: return
-
-        if _index == 0:
-            cm.align(None)
-        else:
-            cm.align(self.data[_index - 1], self.settings.align_orientation)
-
-
 # -----------------------------------------------------------------------------
-def filter_states(_states:list[int], _settings:MET_SCENE_PG_map_gen_settings) -> list[int]:
+def filter_states(_states:list[int], _settings:MET_SCENE_PG_map_gen_settings, _constrained=False) -> list[int]:
+    """
+    Constrained chains already had the rules applied while sampling, other chains are filtered as a whole.
+    Either way the result is only limited to the length, so a map is never shorter than the length because of the rules.
+    """
     if bpy.context.object:
         bpy.ops.object.mode_set(mode='OBJECT')
     
     b3d_utils.deselect_all_objects()
 
-    new_states = []
+    if not _constrained:
+        _states = core_filter_states(_states)
 
-    k = -1
-    while True:
-        k += 1
-        
-        if k >= len(_states):
-            break
-
-        if (length := _settings.length) != -1 and k >= length:
-            break
-
-        state = _states[k]
-
-        # Handle specific cases:
-        # Handle state compared to the next state
-        if (n := k + 1) < len(_states):
-            next_state = _states[n]
-
-            # Case 1: Jump -> WallClimbing
-            # To go into WallClimbing the jump distance should be short, but the some jump modules can be to long. To solve this we just ignore the jump.
-            if state == State.Jump:
-                if next_state == State.WallClimbing:
-                    continue
-            # Case 2: Jump -> WallRunningLeft or WallRunningRight
-            # Similar to Case 1, where the jump distance should be short.
-                if (next_state == State.WallRunningLeft or 
-                    next_state == State.WallRunningRight):
-                    continue
-
-            # Case 3: WallClimbing -> WallClimb180TurnJump
-            # To do a WallClimb180TurnJump the height of the wall can be longer than the player can climb. WallClimbing can be followed by GrabPullUp. Therefore, we ignore WallClimbing and WallClimb180TurnJump should have its own wall.
-            elif state == State.WallClimbing:
-                if next_state == State.WallClimb180TurnJump:
-                    continue
-
-        # Handle state compared to the previous state
-        if (p := k - 1) >= 0:
-            prev_state = _states[p]
-
-            # Case 4: WallClimb180TurnJump -> Falling
-            # A falling curve can go quite low and could end up back where the player came from. In this case, Falling will be ignored.
-            if state == State.Falling:
-                if prev_state == State.WallClimb180TurnJump:
-                    continue
-
-        # Case 5: WallRunning[Left, Right] > WallRunJump > WallClimbing > WallClimbing180Jump
-        # If you want to perform a WallClimbing180Jump after a WallRun, then you cannot be wall running for long and you are always jumping perpendicular after a wall run. These properties are not implicitly adhered to when choosing modules from each state and can result in a non-solvable level segment. To solve this, extra states have been made, namely: `WallRunningLeftWallClimb180TurnJump` and `WallRunningRightWallClimb180TurnJump`.
-        if ((left := state == State.WallRunningLeft) or (right := state == State.WallRunningRight)):
-            if k + 3 < len(_states):
-                if (_states[k + 1] == State.WallRunJump and
-                    _states[k + 2] == State.WallClimbing and
-                    _states[k + 3] == State.WallClimb180TurnJump):
-
-                    if left: 
-                        state = State.WallRunningLeftWallClimb180TurnJump.value
-                    elif right: 
-                        state = State.WallRunningRightWallClimb180TurnJump.value
-
-                    k += 3
-        
-        new_states.append(state)
-
-    return new_states
+    return _states if _settings.length == -1 else _states[:_settings.length]
 
 
 # -----------------------------------------------------------------------------
@@ -333,6 +118,13 @@ class MET_OT_generate_map(Operator):
         active_mc = mc.get_selected()
         gen_chain:MET_PG_generated_chain = active_mc.generated_chains.get_selected()
 
+        try:
+            states = gen_chain.split()
+
+        except ValueError as e:
+            self.report({'ERROR'}, f'Generated chain: {e}')
+            return {'CANCELLED'}
+
         module_groups = get_curve_module_groups_prop(_context).items
 
         settings = get_medge_map_gen_settings(_context)
@@ -340,7 +132,7 @@ class MET_OT_generate_map(Operator):
         time = datetime.now().strftime('%Y-%m-%d_%H:%M:%S')
         collection = new_collection(f'GENERATED_{active_mc.name}_[{settings}]_{time}')
 
-        states = filter_states(gen_chain.split(), settings)
+        states = filter_states(states, settings, gen_chain.is_constrained)
 
         map = Map(None, settings)
         map.prepare(states, module_groups)
@@ -382,6 +174,7 @@ class MET_PT_generate_map(MEdgeToolsPanel, GenerateTab, Panel):
         col.prop(settings, 'seed')
         col.prop(settings, 'length')
         col.prop(settings, 'align_orientation')
+        col.prop(settings, 'collision_mode')
         col.prop(settings, 'resolve_intersection')
 
         if settings.resolve_intersection:
@@ -1,133 +1,146 @@
+import bpy
 from bpy.types import Operator, Context, Object, PropertyGroup, Scene, Collection, Context, Panel
-from bpy.props import StringProperty, PointerProperty, BoolProperty, IntProperty, CollectionProperty
+from bpy.props import StringProperty, PointerProperty, BoolProperty, IntProperty, CollectionProperty, EnumProperty
 
-import numpy as np
-import csv
+import numpy       as np
+import zlib, zipfile
+from   base64      import b64encode, b64decode
+from   collections import OrderedDict
+from   typing      import NamedTuple, Sequence, Callable
 
-from ..b3d_utils import GenericList, draw_generic_list, multiline_text, draw_box
-from ..prefs     import get_prefs
-from .gui        import MEdgeToolsPanel, GenerateTab
-from .dataset    import is_dataset, dataset_sequences, get_datasettings_prop, update_attributes
-from .movement   import State
+from ..            import b3d_utils
+from ..b3d_utils   import GenericList, draw_generic_list, multiline_text, draw_box
+from ..prefs       import get_prefs
+from .gui          import MEdgeToolsPanel, GenerateTab
+from .dataset      import is_dataset, dataset_transitions
+from .movement     import State
+from .core.markov  import MarkovChain, TransitionCache, export_models
 
 
 # -----------------------------------------------------------------------------
-class MarkovChain:
-    def __init__(self) -> None:
-        self.reset()
-
-
-    def reset(self):
-        self.name = ''
-        self.transition_matrix = None
-        self.nstates = 0
-
+# PropertyGroups
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# None for a model that can't be decoded
+markov_chain_models:dict[str, MarkovChain | None] = {}
+transition_cache = TransitionCache()
 
-    # https://stackoverflow.com/questions/46657221/generating-markov-transition-matrix-in-python
-    def create_transition_matrix(self, _objects:list[Object], _name='') -> bool:
-        self.name = _name
 
-        self.nstates = 0
-        transitions:list[list] = []
+# -----------------------------------------------------------------------------
+class ChainData(NamedTuple):
+    states:    np.ndarray     # uint8
+    state_set: frozenset[int]
+    histogram: np.ndarray     # Occurrences per state
+    text:      str
 
-        # Collect all states
-        for obj in _objects:
-            if not is_dataset(obj): continue
 
-            update_attributes(obj)
+# -----------------------------------------------------------------------------
+def pack_chain(_states:Sequence[int]) -> str:
+    """States are stored as compressed uint8 in base64, so they fit in a StringProperty"""
+    return b64encode(zlib.compress(np.asarray(_states, dtype=np.uint8).tobytes())).decode('ascii')
 
-            states = []
 
-            for state, _ in dataset_sequences(obj):
-                self.nstates = max(self.nstates, state)
-                states.append(state)
+# -----------------------------------------------------------------------------
+def chain_data(_states:np.ndarray, _seperator:str) -> ChainData:
+    histogram = np.bincount(_states, minlength=len(State))
 
-            transitions.append(states.copy())
-            
-        if len(transitions) == 0: return False
+    return ChainData(_states, frozenset(np.flatnonzero(histogram).tolist()), histogram, _seperator.join(map(str, _states.tolist())))
 
-        self.nstates += 1
-        self.transition_matrix = np.zeros((self.nstates, self.nstates), dtype=float)
 
-        # Populate transition matrix
-        # Instead of going through each vertex, we group 
-        for sequence in transitions:
-            for s1, s2 in zip(sequence, sequence[1:]):
-                self.transition_matrix[s1][s2] += 1.0
+# -----------------------------------------------------------------------------
+def unpack_chain(_packed:str, _seperator:str) -> ChainData:
+    return chain_data(np.frombuffer(zlib.decompress(b64decode(_packed)), dtype=np.uint8), _seperator)
 
-        # Normalize 
-        for row in self.transition_matrix:
-            if (s := sum(row)) > 0: 
-                factor = 1.0 / s
-                row[:] = [float(v) * factor for v in row]
 
-        return True
+# -----------------------------------------------------------------------------
+def parse_chain(_text:str, _seperator:str) -> ChainData:
+    """Raises ValueError if the text contains something else than states"""
+    states = [int(s) for s in _text.split(_seperator)] if _text else []
 
+    if (invalid := [s for s in states if not 0 <= s < len(State)]):
+        raise ValueError(f'Invalid states: {invalid}')
 
-    def generate_chain(self, _length:int, _seed:int) -> list[int]:
-        # Prepare chain generation
-        np.random.seed(_seed)
+    return chain_data(np.array(states, dtype=np.uint8), _seperator)
 
-        start_state = State.Walking.value
-        prev_state = start_state
 
-        gen_chain = [prev_state]
-        
-        for _ in range(1, _length, 1):
-            # Choose the next state
-            probabilities = self.transition_matrix[prev_state]
-            next_state = np.random.choice(self.nstates, p=probabilities)
+# -----------------------------------------------------------------------------
+class ChainCache:
+    """
+    Decoded chains, keyed by the stored chain and its seperator.
+    Lists of chains are redrawn often, every chain of a list should fit, see `reserve`.
+    The least recently used entries are removed when there are more than `max_entries`.
+    """
+    def __init__(self, _max_entries=1024):
+        self.max_entries = _max_entries
+        self.entries:OrderedDict[tuple[Callable, str, str], ChainData] = OrderedDict()
 
-            gen_chain.append(next_state)
 
-            # Prepare for next iteration
-            prev_state = next_state
+    def reserve(self, _entries:int):
+        self.max_entries = max(self.max_entries, _entries)
 
-        return gen_chain
-    
 
-    def to_csv(self, path, filter_zeros=True) -> str:
-        file = path + f'{self.name}_transition_matrix.csv'
+    def get(self, _decode:Callable[[str, str], ChainData], _chain:str, _seperator:str) -> ChainData:
+        key = _decode, _chain, _seperator
 
-        with open(file, 'w', newline='') as f:
-            csv_writer = csv.writer(f)
-            
-            states = ['']
-            states.extend([State(k).name for k in range(len(State))])
-            csv_writer.writerow(states)
+        if (entry := self.entries.get(key)) is not None:
+            self.entries.move_to_end(key)
+            return entry
 
-            for k, row in enumerate(self.transition_matrix):
-                if filter_zeros:
-                    if all(v == 0 for v in row):
-                        continue
+        entry = self.entries[key] = _decode(_chain, _seperator)
 
-                r = [State(k).name]
-                r.extend(row)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
 
-                csv_writer.writerow(r)
+        return entry
 
-        return file
 
 # -----------------------------------------------------------------------------
-# PropertyGroups
-# -----------------------------------------------------------------------------
-# -----------------------------------------------------------------------------
-markov_chain_models:dict[str, MarkovChain] = {}
+chain_cache = ChainCache()
 
 
 # -----------------------------------------------------------------------------
 class MET_PG_generated_chain(PropertyGroup):
+    def set_states(self, _states:Sequence[int], _constrained=False):
+        self.packed = pack_chain(_states)
+        self.chain = ''
+        self.is_constrained = _constrained
+
+
+    def data(self) -> ChainData:
+        """Raises ValueError if the text chain of an older file contains something else than states"""
+        if self.packed:
+            return chain_cache.get(unpack_chain, self.packed, self.seperator)
+
+        # Older files store the chain as text
+        return chain_cache.get(parse_chain, self.chain, self.seperator)
+
+
+    def valid_data(self) -> ChainData | None:
+        """Same as `data`, but returns None for an invalid chain, so that drawing it does not fail"""
+        try:
+            return self.data()
+        except (ValueError, zlib.error):
+            return None
+
+
     def split(self) -> list[int]:
-        return [int(s) for s in self.chain.split(self.seperator)]
+        return self.data().states.tolist()
 
     def __get_name(self):
-        return self.chain
+        if (data := self.valid_data()) is None:
+            return f'[INVALID]_{self.chain}'
+
+        return data.text
 
 
     name:      StringProperty(name='Name', get=__get_name)
+    packed:    StringProperty(name='PRIVATE')
     chain:     StringProperty(name='Sequence')
     seperator: StringProperty(name='Seperator', default='_')
 
+    # The rules of `filter_states` were applied while sampling
+    is_constrained: BoolProperty(name='PRIVATE')
+
 
 # -----------------------------------------------------------------------------
 class MET_PG_generated_chain_list(PropertyGroup, GenericList):
@@ -141,6 +154,17 @@ class MET_PG_markov_chain(PropertyGroup):
     def data(self) -> MarkovChain:
         if self.name in markov_chain_models:
             return markov_chain_models[self.name]
+
+        # Restore the model that is saved in the .blend, a model that can't be decoded is only tried once
+        if self.model:
+            try:
+                mc = MarkovChain.from_bytes(b64decode(self.model), self.name)
+            except (ValueError, KeyError, EOFError, zipfile.BadZipFile):
+                mc = None
+
+            markov_chain_models[self.name] = mc
+            return mc
+
         return None
 
 
@@ -160,30 +184,59 @@ class MET_PG_markov_chain(PropertyGroup):
         if self.name in markov_chain_models:
             del markov_chain_models[self.name]
 
+        self.model = ''
+
+        # Only datasets that changed since the last time are read again
+        sequences = []
+        counts = 0
+
+        for obj in objects:
+            transitions = dataset_transitions(obj, transition_cache)
+            sequences.append(transitions.states)
+            counts = counts + transitions.counts
+
         mc = MarkovChain()
-        success = mc.create_transition_matrix(objects, self.name)
+        success = mc.create_transition_matrix(sequences, self.name, self.order, counts)
 
         if success: 
             markov_chain_models[self.name] = mc
+            self.model = b64encode(mc.to_bytes()).decode('ascii')
 
 
     def generate_chain(self):
-        global markov_chain_models
-
-        if not self.name in markov_chain_models:
+        if not (mc := self.data()):
             return
-
-        mc = markov_chain_models[self.name]
-        chain = mc.generate_chain(self.length, self.seed)
+        chain = mc.generate_chain(self.length, self.seed, True)
 
         gs:MET_PG_generated_chain = self.generated_chains.add()
-        gs.chain = gs.seperator.join(str(c) for c in chain)
+        gs.set_states(chain, True)
+
+
+    def generate_chains(self, _amount:int):
+        """Generates `_amount` chains at once with the seeds `seed`, `seed + 1`, ..."""
+        if not (mc := self.data()):
+            return
+        chains = mc.generate_chains(self.length, range(self.seed, self.seed + _amount), _constrained=True)
+
+        for chain in chains:
+            gs:MET_PG_generated_chain = self.generated_chains.add()
+            gs.set_states(chain, True)
 
 
     def get_selected_generated_chain(self) -> MET_PG_generated_chain:
         return self.generated_chains.get_selected()
 
 
+    def __on_update_collection(self, _context:Context):
+        self.model = ''
+
+        # The model of the previous collection is dropped unless another item uses it, this item has no model for the new collection yet
+        names = {item.name for item in get_markov_chains_prop(_context).items if item != self}
+
+        for name in [n for n in markov_chain_models if n not in names or n == self.name]:
+            del markov_chain_models[name]
+
+
     def __get_name(self):
         if self.collection:
             return self.collection.name
@@ -191,17 +244,22 @@ class MET_PG_markov_chain(PropertyGroup):
 
     
     def has_transition_matrix(self) -> bool:
-        global markov_chain_models
-        return self.name in markov_chain_models
+        """Whether the model is trained and can be decoded"""
+        return self.data() is not None
     
 
     def add_handmade_chain(self):
+        """Raises ValueError if `handmade_chain` is not a valid chain, nothing is added then"""
+        seperator = MET_PG_generated_chain.bl_rna.properties['seperator'].default
+        states = parse_chain(self.handmade_chain, seperator).states
+
         gs:MET_PG_generated_chain = self.generated_chains.add()
-        gs.chain = self.handmade_chain
+        gs.set_states(states)
 
 
     name:             StringProperty(name='Name', get=__get_name)
-    collection:       PointerProperty(type=Collection, name='Collection')
+    collection:       PointerProperty(type=Collection, name='Collection', update=__on_update_collection)
+    order:            IntProperty(name='Order', default=1, min=1, max=MarkovChain.MAX_ORDER, description='Number of previous states the next state depends on')
 
     length:           IntProperty(name='Length', default=96, min=0)
     seed:             IntProperty(name='Seed', default=2024, min=0)
@@ -212,6 +270,15 @@ class MET_PG_markov_chain(PropertyGroup):
 
     filepath:         StringProperty(name='Filepath', default='C:\\')
     filter_zeros:     BoolProperty(name='Filter Zeros', default=True)
+    export_counts:    BoolProperty(name='Export Counts', description='Also export the raw transition counts')
+    export_formats:   EnumProperty(name='Formats', options={'ENUM_FLAG'}, default={'CSV'}, items=(
+        ('CSV', 'CSV', ''),
+        ('NPY', 'NPY', ''),
+        ('NPZ', 'NPZ', ''),
+    ))
+
+    # Trained model, see `MarkovChain.to_bytes`
+    model:            StringProperty(name='PRIVATE')
 
 # -----------------------------------------------------------------------------
 class MET_SCENE_PG_markov_chain_list(PropertyGroup, GenericList):
@@ -283,7 +350,13 @@ class MET_OT_add_handmade_chain(Operator):
 
     def execute(self, _context:Context):
         mc = get_markov_chains_prop(_context)
-        mc.get_selected().add_handmade_chain()
+
+        try:
+            mc.get_selected().add_handmade_chain()
+
+        except ValueError as e:
+            self.report({'ERROR'}, f'Handmade chain: {e}')
+            return {'CANCELLED'}
         
         return {'FINISHED'}    
 
@@ -294,6 +367,12 @@ class MET_OT_transition_matrix_to_csv(Operator):
     bl_label  = 'Transition Matrix To CSV'
 
 
+    @classmethod
+    def poll(cls, _context:Context):
+        item = get_markov_chains_prop(_context).get_selected()
+        return item and item.has_transition_matrix()
+
+
     def execute(self, _context:Context):
         markov_chains = get_markov_chains_prop(_context)
         item = markov_chains.get_selected()
@@ -303,6 +382,32 @@ class MET_OT_transition_matrix_to_csv(Operator):
 
         return {'FINISHED'} 
 
+
+# -----------------------------------------------------------------------------
+class MET_OT_export_transition_matrices(Operator):
+    bl_idname = 'medge_generate.export_transition_matrices'
+    bl_label  = 'Export All Transition Matrices'
+    bl_description = 'Exports the transition matrices of all Markov data at once, with the settings of the selected one'
+
+
+    @classmethod
+    def poll(cls, _context:Context):
+        return get_markov_chains_prop(_context).get_selected()
+
+
+    def execute(self, _context:Context):
+        markov_chains = get_markov_chains_prop(_context)
+        item = markov_chains.get_selected()
+
+        models = [mc for it in markov_chains.items if (mc := it.data())]
+        formats = [f.lower() for f in item.export_formats]
+
+        files = export_models(models, item.filepath, formats, item.export_counts, item.filter_zeros)
+
+        self.report({'INFO'}, f'{len(files)} files saved to {item.filepath}')
+
+        return {'FINISHED'} 
+
 # -----------------------------------------------------------------------------
 # GUI
 # -----------------------------------------------------------------------------
@@ -328,6 +433,7 @@ class MET_PT_markov_chains_data(MEdgeToolsPanel, GenerateTab, Panel):
 
         col = layout.column(align=True)
         col.prop(mc, 'collection')
+        col.prop(mc, 'order')
 
         col.separator(factor=2)
 
@@ -348,6 +454,11 @@ class MET_PT_markov_chains_data(MEdgeToolsPanel, GenerateTab, Panel):
                 col.separator()
                 col.operator(MET_OT_transition_matrix_to_csv.bl_idname, text='To CSV')
 
+                col.separator()
+                col.prop(mc, 'export_counts')
+                col.row(align=True).prop(mc, 'export_formats')
+                col.operator(MET_OT_export_transition_matrices.bl_idname, text='Export All')
+
 
 # -----------------------------------------------------------------------------
 class MET_PT_markov_chains_generate(MEdgeToolsPanel, GenerateTab, Panel):
@@ -370,6 +481,9 @@ class MET_PT_markov_chains_generate(MEdgeToolsPanel, GenerateTab, Panel):
 
         gen_chains = mc.generated_chains
 
+        # The list decodes every chain when it is drawn
+        chain_cache.reserve(len(gen_chains.items))
+
         draw_generic_list(col, gen_chains, '#generated_chain_list', 3, {'REMOVE', 'MOVE', 'CLEAR'})
 
         col.separator()
@@ -386,7 +500,7 @@ class MET_PT_markov_chains_generate(MEdgeToolsPanel, GenerateTab, Panel):
 
         if mc.show_chain:
             col.separator(factor=2)
-            multiline_text(_context, col, active_chain.chain)
+            multiline_text(_context, col, active_chain.name)
 
 
 # -----------------------------------------------------------------------------
@@ -397,6 +511,13 @@ def get_markov_chains_prop(_context: Context) -> MET_SCENE_PG_markov_chain_list:
     return _context.scene.medge_markov_chains
 
 
+# -----------------------------------------------------------------------------
+@bpy.app.handlers.persistent
+def clear_markov_chain_models(*_args):
+    # Models of the previous file could have the same name, the models of the opened file are restored on first access
+    markov_chain_models.clear()
+
+
 # -----------------------------------------------------------------------------
 # Registration
 # -----------------------------------------------------------------------------
@@ -404,7 +525,11 @@ def get_markov_chains_prop(_context: Context) -> MET_SCENE_PG_markov_chain_list:
 def register():
     Scene.medge_markov_chains = PointerProperty(type=MET_SCENE_PG_markov_chain_list)
 
+    b3d_utils.add_callback(bpy.app.handlers.load_post, clear_markov_chain_models)
+
 
 # -----------------------------------------------------------------------------
 def unregister():
+    b3d_utils.remove_callback(bpy.app.handlers.load_post, clear_markov_chain_models)
+
     if hasattr(Scene, 'medge_markov_chains'): del Scene.medge_markov_chains
\ No newline at end of file
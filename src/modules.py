@@ -1,54 +1,157 @@
 import bpy
-from bpy.types import Operator, Context, Scene, Object, Collection, Spline, Operator, PropertyGroup, UIList, UILayout, Panel
+from bpy.types import Operator, Context, Scene, Object, Mesh, Collection, Spline, Operator, PropertyGroup, UIList, UILayout, Panel
 from bpy.props import StringProperty, PointerProperty, BoolProperty, IntProperty, CollectionProperty
-from mathutils import Vector, Matrix
+from mathutils import Matrix
 
-import numpy as     np
-from math    import radians
+import numpy as np
+from collections import OrderedDict
+from typing      import NamedTuple
 
 from .gui        import MEdgeToolsPanel, ModulesTab
 from ..          import b3d_utils
-from ..b3d_utils import GenericList, rotation_matrix, update_matrices, duplicate_object_with_children, remove_object_with_children, check_objects_intersection
+from ..b3d_utils import GenericList, update_matrices, duplicate_object_with_children
 from .movement   import State
 from .markov     import get_markov_chains_prop
+from .core.modules import ModulePrototype, PrototypeModule
+from .core.geometry import transform_points, mesh_intersections
+
+
+# -----------------------------------------------------------------------------
+# Collision Volumes
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+class VolumeGeometry(NamedTuple):
+    mesh:     str             # Name of the mesh, to invalidate the entry when the mesh is edited
+    vertices: np.ndarray      # ( N, 3 ) in object space, modifiers applied
+    polygons: list[tuple[int, ...]]
+    box:      np.ndarray      # 4x4 matrix that maps the unit cube to the volume in object space, None if it is not a box
+    triangles:np.ndarray      # ( T, 3, 3 ) in object space
+    faces:    np.ndarray      # ( T, ) polygon of every triangle
+
+
+# -----------------------------------------------------------------------------
+class VolumeCache:
+    """
+    Geometry of the collision volumes of the module prototypes, keyed by object name.
+    Placed modules are rigid copies, they are tested with the triangles of their prototype and a relative transform.
+    Least recently used entries are evicted beyond `_max_entries`.
+    """
+    def __init__(self, _max_entries=256):
+        self.max_entries = _max_entries
+        self.entries:OrderedDict[str, VolumeGeometry] = OrderedDict()
+
+
+    def get(self, _volume:Object) -> VolumeGeometry:
+        if (entry := self.entries.get(_volume.name)) is not None:
+            self.entries.move_to_end(_volume.name)
+            return entry
+
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        eval_obj = _volume.evaluated_get(depsgraph)
+        mesh = eval_obj.to_mesh()
+
+        vertices = np.empty(len(mesh.vertices) * 3, dtype=float)
+        mesh.vertices.foreach_get('co', vertices)
+        vertices = vertices.reshape(-1, 3)
+
+        polygons = [tuple(p.vertices) for p in mesh.polygons]
+
+        mesh.calc_loop_triangles()
+
+        corners = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+        mesh.loop_triangles.foreach_get('vertices', corners)
+
+        faces = np.empty(len(mesh.loop_triangles), dtype=np.int32)
+        mesh.loop_triangles.foreach_get('polygon_index', faces)
+
+        eval_obj.to_mesh_clear()
+
+        entry = VolumeGeometry(_volume.data.name, vertices, polygons, box_matrix(vertices, polygons), vertices[corners.reshape(-1, 3)], faces)
+        self.entries[_volume.name] = entry
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+        return entry
+
+
+    def invalidate(self, _name:str):
+        """Removes the entries of the object or mesh with `_name`"""
+        for key in [k for k, e in self.entries.items() if k == _name or e.mesh == _name]:
+            del self.entries[key]
+
+
+    def clear(self):
+        self.entries.clear()
+
+
+# -----------------------------------------------------------------------------
+volume_cache = VolumeCache()
+
+
+# -----------------------------------------------------------------------------
+def box_matrix(_vertices:np.ndarray, _polygons:list[tuple[int, ...]]) -> np.ndarray | None:
+    """Returns the 4x4 matrix that maps the unit cube to the mesh, if the mesh is an axis aligned box like `b3d_utils.create_cube`"""
+    if len(_vertices) != 8 or len(_polygons) != 6 or any(len(p) != 4 for p in _polygons):
+        return None
+
+    bmin, bmax = _vertices.min(axis=0), _vertices.max(axis=0)
+
+    # Every vertex is a different corner
+    corners = np.isclose(_vertices, bmax) 
+
+    if not (corners | np.isclose(_vertices, bmin)).all() or len(np.unique(corners, axis=0)) != 8:
+        return None
+
+    box = np.diag([*(bmax - bmin), 1.0])
+    box[:3, 3] = (bmin + bmax) * .5
+
+    return box
+
+
+# -----------------------------------------------------------------------------
+@bpy.app.handlers.persistent
+def invalidate_volume_cache(_scene, _depsgraph):
+    for update in _depsgraph.updates:
+        if update.is_updated_geometry and isinstance(update.id, (Object, Mesh)):
+            volume_cache.invalidate(update.id.original.name)
+
+
+# -----------------------------------------------------------------------------
+@bpy.app.handlers.persistent
+def clear_volume_cache(*_args):
+    # Objects of the previous file could have the same name
+    volume_cache.clear()
 
 
 # -----------------------------------------------------------------------------
 # Curve Module
 # -----------------------------------------------------------------------------
 # -----------------------------------------------------------------------------
-class CurveModule:
+class CurveModule(PrototypeModule):
     """
-    A curve module is the root of a level segment
+    A curve module is the root of a level segment.
+    While the map is laid out it is only a transform and a `ModulePrototype`, the objects are created once by `instantiate`.
     """
     def __init__(self, 
                  _state:int,
-                 _module_names:list[str]):
+                 _prototypes:list[ModulePrototype],
+                 _collision_mode='BOX'):
         
-        self.state = _state
-        self.module_names = _module_names.copy()
-        np.random.shuffle(self.module_names)
+        super().__init__(_state, _prototypes)
 
         self.curve:Object = None
-        self.current_name_index = np.random.randint(len(self.module_names))
-        self.index = 0
         self.collection = None
+        self.collision_mode = _collision_mode
 
+        # Collision volume of each prototype and its matrix relative to the curve
+        self.volumes:dict[str, tuple[Object, np.ndarray]] = {}
 
-    @property
-    def path(self) -> Spline:
-        return self.curve.data.splines[0]
-    
-    @property
-    def points(self) -> Spline:
-        return self.path.points
-    
-    @property
-    def volume(self) -> Object | None:
-        return get_curve_module_prop(self.curve).collision_volume
+        for p in _prototypes:
+            curve = bpy.data.objects[p.name]
 
-    def __getitem__(self, _key:int):
-        return self.path.points[_key].co
+            if (volume := get_curve_module_prop(curve).collision_volume):
+                self.volumes[p.name] = volume, np.array(curve.matrix_world.inverted() @ volume.matrix_world)
 
 
     def prepare(self, _index:int, _collection:Collection):
@@ -56,67 +159,89 @@ class CurveModule:
         self.collection = _collection
 
 
-    def next_module(self, _index=-1):
-        if self.curve:
-            remove_object_with_children(self.curve)
+    def volume(self) -> tuple[Object, np.ndarray] | None:
+        """Returns the prototype volume and its world matrix"""
+        if (volume := self.volumes.get(self.prototype.name)) is None:
+            return None
+
+        return volume[0], self.matrix @ volume[1]
+
+
+    def intersect(self, _other:'CurveModule') -> list[tuple[int, int]] | None:
+        """
+        Returns the pairs of intersecting polygons of the volumes, like `b3d_utils.check_objects_intersection`.
+        The cached triangles of the other volume are moved into the object space of this volume, no tree is built per placement.
+        """
+        if not (volume1 := self.volume()) or not (volume2 := _other.volume()):
+            return None
+
+        geometry1 = volume_cache.get(volume1[0])
+        geometry2 = volume_cache.get(volume2[0])
+
+        relative = np.linalg.inv(volume1[1]) @ volume2[1]
+        triangles = transform_points(relative, geometry2.triangles.reshape(-1, 3)).reshape(-1, 3, 3)
+
+        pairs = mesh_intersections(geometry1.triangles, triangles)
+
+        # Polygons with more than 3 vertices have several triangles
+        return sorted(set(zip(geometry1.faces[pairs[:, 0]].tolist(), geometry2.faces[pairs[:, 1]].tolist())))
+
+
+    def box(self) -> np.ndarray | None:
+        if self.collision_mode != 'BOX' or not (volume := self.volume()):
+            return None
+
+        if (box := volume_cache.get(volume[0]).box) is None:
+            return None
+
+        return volume[1] @ box
+
+
+    def instantiate(self) -> Object:
+        """Creates the objects of the module at its transform"""
+        module = bpy.data.objects[self.prototype.name]
 
-        if _index >= 0 or _index < len(self.module_names):
-            idx = _index
-        else:
-            idx = self.current_name_index
-            self.current_name_index += 1
-            self.current_name_index %= len(self.module_names)
-        
-        name = self.module_names[idx]
-        module = bpy.data.objects[name]
-        
         self.curve = duplicate_object_with_children(module, False, self.collection, False)
         self.curve.name = f'{self.index}_{module.name}'
+        self.curve.matrix_world = Matrix(self.matrix.tolist())
+        update_matrices(self.curve)
 
+        return self.curve
+        
 
-    def align(self, other:'CurveModule', _align_direction=False, _rotation_offset=0):
-        if not other:
-            self.curve.location.xyz = 0, 0, 0
-            update_matrices(self.curve)
-            return
+# -----------------------------------------------------------------------------
+def to_module_prototype(_curve:Object) -> ModulePrototype:
+    """Collects the curve points, world matrix and collision volume of a curve module, the volume is reduced to its bounding box"""
+    spline = _curve.data.splines[0]
 
-        # My direction
-        my_mw = self.curve.matrix_world.copy()
-        my_dir = my_mw @ self.points[1].co - (start := my_mw @ self.points[0].co)
-        my_dir.normalize()
+    points = np.empty(len(spline.points) * 4, dtype=np.float32)
+    spline.points.foreach_get('co', points)
 
-        # Other direction
-        other_wm = other.curve.matrix_world.copy()
-        other_dir = (end := other_wm @ other.points[-1].co) - other_wm @ other.points[-2].co
-        other_dir.normalize()
-        
-        # Add rotation offset
-        R = Matrix.Rotation(radians(_rotation_offset), 3, 'Z')
+    volume_matrix = None
 
-        if _align_direction:
-            # Get rotation matrix around z-axis from direction vectors
-            a = my_dir.xyz    * Vector((1, 1, 0))
-            b = other_dir.xyz * Vector((1, 1, 0))
+    if (volume := get_curve_module_prop(_curve).collision_volume):
+        co = volume_cache.get(volume).vertices
 
-            if a.length == 0 or b.length == 0:
-                raise Exception(f'Direction vector has 0 length. Perhaps overlapping control points for curve: {self.curve.name}')
+        bmin, bmax = co.min(axis=0), co.max(axis=0)
 
-            A = rotation_matrix(a, b)
-            R = R @ A
+        box = np.diag([*(bmax - bmin), 1.0])
+        box[:3, 3] = (bmin + bmax) * .5
 
-        self.curve.matrix_world = my_mw @ R.to_4x4()
+        volume_matrix = np.array(_curve.matrix_world.inverted() @ volume.matrix_world) @ box
 
-        # Move chain to the end of the other chain
-        self.curve.location = end.xyz
-        update_matrices(self.curve)
+    return ModulePrototype(_curve.name, points.reshape(-1, 4)[:, :3], np.array(_curve.matrix_world), volume_matrix)
 
-    
-    def intersect(self, _other:'CurveModule') -> list[tuple[int, int]] | None:
-        if not (vol1 := self.volume) or not (vol2 := _other.volume):
-            return None
 
-        return check_objects_intersection(vol1, vol2)
-        
+# -----------------------------------------------------------------------------
+def module_prototypes(_module_groups:list['MET_PG_curve_module_collection']) -> dict[int, list[ModulePrototype]]:
+    prototypes = {}
+
+    for mg in _module_groups:
+        if not (names := mg.collect_curve_names()): continue
+        prototypes[mg.state] = [to_module_prototype(bpy.data.objects[name]) for name in names]
+
+    return prototypes
+
 
 # -----------------------------------------------------------------------------
 # Property Groups
@@ -251,11 +376,8 @@ class MET_UL_curve_module_group_draw(UIList):
 
         mc = get_markov_chains_prop(_context).get_selected()
         
-        if mc:
-            gen_chain = mc.get_selected_generated_chain()
-            states = set(gen_chain.split())
-            
-            if str(_item.state) in states:
+        if mc and (gen_chain := mc.get_selected_generated_chain()) and (data := gen_chain.valid_data()):
+            if _item.state in data.state_set:
                 ic = 'RADIOBUT_ON'
 
         _layout.label(text=_item.name, icon=ic)
@@ -275,12 +397,10 @@ class MET_UL_curve_module_group_draw(UIList):
             filtered = [0] * len(items)
             
             mc = get_markov_chains_prop(_context).get_selected()
-            gen_chain = mc.get_selected_generated_chain()
-
-            states = set(gen_chain.split())
 
-            for s in states:
-                filtered[int(s)] = self.bitflag_filter_item
+            if mc and (gen_chain := mc.get_selected_generated_chain()) and (data := gen_chain.valid_data()):
+                for s in data.state_set:
+                    filtered[s] = self.bitflag_filter_item
         
         return filtered, []
 
@@ -461,8 +581,14 @@ def register():
     Object.medge_curve_module       = PointerProperty(type=MET_OBJECT_PG_curve_module)
     Scene.medge_curve_module_groups = PointerProperty(type=MET_SCENE_PG_curve_module_collection_list)
 
+    b3d_utils.add_callback(bpy.app.handlers.depsgraph_update_post, invalidate_volume_cache)
+    b3d_utils.add_callback(bpy.app.handlers.load_post, clear_volume_cache)
+
 
 # -----------------------------------------------------------------------------
 def unregister():
+    b3d_utils.remove_callback(bpy.app.handlers.load_post, clear_volume_cache)
+    b3d_utils.remove_callback(bpy.app.handlers.depsgraph_update_post, invalidate_volume_cache)
+
     if hasattr(Scene, 'medge_curve_module_groups'): del Scene.medge_curve_module_groups
     if hasattr(Object, 'medge_curve_module'):       del Object.medge_curve_module
\ No newline at end of file
@@ -0,0 +1,12 @@
+"""
+Tests of the parts that do not depend on Blender, they run with plain CPython:
+
+    python -m pytest tests
+"""
+import sys
+from   pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
@@ -0,0 +1,97 @@
+import numpy  as np
+import pytest
+
+from src.core.states      import State
+from src.core.constraints import LOOKAHEAD, apply_constraints
+from src.core.map         import filter_states
+
+
+# -----------------------------------------------------------------------------
+def reference_filter_states(_states:list[int], _length=-1) -> list[int]:
+    """The loop that `apply_constraints` replaced"""
+    new_states = []
+
+    k = -1
+    while True:
+        k += 1
+
+        if k >= len(_states) or (_length != -1 and k >= _length):
+            break
+
+        state = _states[k]
+
+        if (n := k + 1) < len(_states):
+            next_state = _states[n]
+
+            if state == State.Jump:
+                if next_state == State.WallClimbing:
+                    continue
+                if next_state == State.WallRunningLeft or next_state == State.WallRunningRight:
+                    continue
+
+            elif state == State.WallClimbing:
+                if next_state == State.WallClimb180TurnJump:
+                    continue
+
+        if (p := k - 1) >= 0:
+            if state == State.Falling and _states[p] == State.WallClimb180TurnJump:
+                continue
+
+        if ((left := state == State.WallRunningLeft) or (right := state == State.WallRunningRight)):
+            if k + 3 < len(_states):
+                if (_states[k + 1] == State.WallRunJump and
+                    _states[k + 2] == State.WallClimbing and
+                    _states[k + 3] == State.WallClimb180TurnJump):
+
+                    if left:
+                        state = State.WallRunningLeftWallClimb180TurnJump.value
+                    elif right:
+                        state = State.WallRunningRightWallClimb180TurnJump.value
+
+                    k += 3
+
+        new_states.append(state)
+
+    return new_states
+
+
+# States of the rules, so that random chains trigger them often
+RULE_STATES = [State.Walking, State.Jump, State.Falling, State.WallClimbing, State.WallClimb180TurnJump,
+               State.WallRunningLeft, State.WallRunningRight, State.WallRunJump]
+
+
+# -----------------------------------------------------------------------------
+def random_chains(_count:int, _max_length:int, _seed=0):
+    rng = np.random.default_rng(_seed)
+    values = np.array([s.value for s in RULE_STATES])
+
+    for _ in range(_count):
+        yield values[rng.integers(len(values), size=rng.integers(0, _max_length + 1))].tolist()
+
+
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize('length', [-1, 0, 1, 5])
+def test_filter_states_matches_reference(length):
+    for states in random_chains(2000, 16):
+        assert filter_states(states, length) == reference_filter_states(states, length)
+
+
+# -----------------------------------------------------------------------------
+def test_merge():
+    states = [State.WallRunningLeft, State.WallRunJump, State.WallClimbing, State.WallClimb180TurnJump, State.Falling]
+
+    assert filter_states([s.value for s in states]) == [State.WallRunningLeftWallClimb180TurnJump.value]
+
+
+# -----------------------------------------------------------------------------
+def test_open_chain_decides_prefix():
+    """An open chain decides every state but the last `LOOKAHEAD`, like the closed chain it is a prefix of"""
+    for states in random_chains(500, 24, 1):
+        if len(states) <= LOOKAHEAD: 
+            continue
+
+        keep, replaced = apply_constraints(np.array(states)[:, None], False)
+        opened = replaced[keep[:, 0], 0].tolist()
+
+        assert len(keep) == len(states) - LOOKAHEAD
+        assert filter_states(states)[:len(opened)] == opened
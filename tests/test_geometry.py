@@ -0,0 +1,176 @@
+import numpy  as np
+import pytest
+
+from src.core.geometry import obb_overlap, obb_overlaps, to_4x4, transform_points, triangles_intersect, mesh_intersections
+
+
+# -----------------------------------------------------------------------------
+def random_boxes(_rng:np.random.Generator, _count:int) -> np.ndarray:
+    """Random rotations, sizes and positions, so that about half of the pairs overlap"""
+    q, r = np.linalg.qr(_rng.normal(size=(_count, 3, 3)))
+    rotations = q * np.sign(np.diagonal(r, axis1=1, axis2=2))[:, None, :]
+
+    boxes = np.zeros((_count, 4, 4))
+    boxes[:, :3, :3] = rotations * _rng.uniform(.2, 2, (_count, 1, 3))
+    boxes[:, :3, 3] = _rng.uniform(-1.2, 1.2, (_count, 3))
+    boxes[:, 3, 3] = 1
+
+    return boxes
+
+
+# -----------------------------------------------------------------------------
+def sampled_overlap(_a:np.ndarray, _b:np.ndarray, _points:np.ndarray) -> bool:
+    """Whether a sample point of one unit cube [-0.5, 0.5]^3 lies in both boxes"""
+    for box, other in ((_a, _b), (_b, _a)):
+        local = transform_points(np.linalg.inv(other), transform_points(box, _points))
+
+        if (np.abs(local) <= .5).all(axis=1).any():
+            return True
+
+    return False
+
+
+# -----------------------------------------------------------------------------
+def test_obb_overlaps_matches_sampling():
+    rng = np.random.default_rng(0)
+    a, b = random_boxes(rng, 400), random_boxes(rng, 400)
+
+    # Corners, edges and faces of the cube are sampled densely, the inside sparser
+    grid = np.linspace(-.5, .5, 9)
+    points = np.stack(np.meshgrid(grid, grid, grid), axis=-1).reshape(-1, 3)
+    points = np.concatenate((points, rng.uniform(-.5, .5, (2000, 3))))
+
+    overlaps = obb_overlaps(a, b)
+    sampled = np.array([sampled_overlap(x, y, points) for x, y in zip(a, b)])
+
+    # A sampled point in both boxes proves the overlap, sampling can miss shallow overlaps
+    assert not (sampled & ~overlaps).any()
+    assert (overlaps & ~sampled).sum() <= .02 * len(a)
+    assert .2 < overlaps.mean() < .8
+
+    assert [obb_overlap(x, y) for x, y in zip(a, b)] == overlaps.tolist()
+
+
+# -----------------------------------------------------------------------------
+def test_obb_overlaps_separated_and_touching():
+    """Modules are placed end to end, boxes that only touch do not overlap"""
+    unit = np.eye(4)
+
+    apart = to_4x4(np.eye(3))
+    apart[:3, 3] = (1.5, 0, 0)
+
+    touching = apart.copy()
+    touching[:3, 3] = (1, 0, 0)
+
+    # Rotated by 45 degrees around z, the corner reaches sqrt(0.5) along x
+    c = np.sqrt(.5)
+    diamond = to_4x4(np.array([[c, -c, 0], [c, c, 0], [0, 0, 1]]))
+    diamond[:3, 3] = (.5 + c - .01, 0, 0)
+
+    assert obb_overlaps(np.array([unit] * 3), np.array([apart, touching, diamond])).tolist() == [False, False, True]
+
+    diamond[:3, 3] = (.5 + c + .01, 0, 0)
+    assert not obb_overlap(unit, diamond)
+
+
+# -----------------------------------------------------------------------------
+def test_obb_overlaps_flat_box():
+    """A box without height has degenerate axes"""
+    flat = np.diag([1.0, 1.0, 0.0, 1.0])
+    unit = np.eye(4)
+
+    assert obb_overlap(flat, unit)
+
+    unit[:3, 3] = (0, 0, .6)
+    assert not obb_overlap(flat, unit)
+
+
+# -----------------------------------------------------------------------------
+CORNERS = np.array([(x, y, z) for x in (-.5, .5) for y in (-.5, .5) for z in (-.5, .5)])
+QUADS   = [(0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1), (2, 3, 7, 6), (0, 2, 6, 4), (1, 5, 7, 3)]
+
+
+def box_triangles(_box:np.ndarray) -> np.ndarray:
+    """( 12, 3, 3 ) triangles of the surface of a box"""
+    corners = transform_points(_box, CORNERS)
+    return corners[[(q[0], q[1], q[2]) for q in QUADS] + [(q[0], q[2], q[3]) for q in QUADS]]
+
+
+def contains(_box:np.ndarray, _other:np.ndarray) -> bool:
+    local = transform_points(np.linalg.inv(_box), transform_points(_other, CORNERS))
+    return (np.abs(local) <= .5).all()
+
+
+# -----------------------------------------------------------------------------
+def test_mesh_intersections_match_obb_overlaps():
+    """Surfaces of boxes intersect if the boxes overlap, unless one box is inside the other"""
+    rng = np.random.default_rng(1)
+    a, b = random_boxes(rng, 400), random_boxes(rng, 400)
+
+    surfaces = np.array([len(mesh_intersections(box_triangles(x), box_triangles(y))) > 0 for x, y in zip(a, b)])
+    inside = np.array([contains(x, y) or contains(y, x) for x, y in zip(a, b)])
+
+    np.testing.assert_array_equal(surfaces, obb_overlaps(a, b) & ~inside)
+
+
+# -----------------------------------------------------------------------------
+def test_triangles_intersect():
+    a = np.array([[(0, 0, 0), (1, 0, 0), (0, 1, 0)]], dtype=float)
+    b = np.array([[(.2, .2, -1), (.2, .2, 1), (1, 1, 1)]], dtype=float)
+
+    assert triangles_intersect(a, b).tolist() == [True]
+
+    # Touching a vertex or lying in the same plane is not an intersection
+    assert triangles_intersect(a, b + (0, 0, 1)).tolist() == [False]
+    assert triangles_intersect(a, a + (.1, .1, 0)).tolist() == [False]
+    assert triangles_intersect(a, b + (0, 0, .99)).tolist() == [True]
+
+
+# -----------------------------------------------------------------------------
+def test_mesh_intersections_touching():
+    """Modules are placed end to end, meshes that only touch do not intersect"""
+    unit = np.eye(4)
+    touching = unit.copy()
+    touching[:3, 3] = (1, 0, 0)
+
+    assert len(mesh_intersections(box_triangles(unit), box_triangles(touching))) == 0
+
+    touching[:3, 3] = (.99, .2, .1)
+    assert len(mesh_intersections(box_triangles(unit), box_triangles(touching))) > 0
+
+    assert len(mesh_intersections(box_triangles(unit), np.empty((0, 3, 3)))) == 0
+
+
+# -----------------------------------------------------------------------------
+def rotation(_axis:np.ndarray, _angle:float) -> np.ndarray:
+    x, y, z = _axis / np.linalg.norm(_axis)
+    k = np.array([[0, -z, y], [z, 0, -x], [-y, x, 0]])
+
+    return np.eye(3) + np.sin(_angle) * k + (1 - np.cos(_angle)) * k @ k
+
+
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize('angle', [0, 1e-12, 1e-9, 1e-7, 1e-5, 1e-3])
+def test_touching_nearly_parallel(angle):
+    """Boxes and meshes use the same convention: touching within epsilon is no overlap, also with almost parallel edges"""
+    rng = np.random.default_rng(3)
+
+    for _ in range(10):
+        box = to_4x4(rotation(rng.normal(size=3), rng.uniform(0, np.pi)) * (2, 1, .5))
+        box[:3, 3] = rng.normal(0, 10, 3)
+
+        # Smaller and turned around the normal of the face that it touches
+        other = box.copy()
+        other[:3, :3] = rotation(box[:3, 0], angle) @ box[:3, :3] @ np.diag([1, .8, .8])
+
+        for gap, expected in ((0, False), (1e-3, False), (-1e-3, True), (-.5, True)):
+            other[:3, 3] = box[:3, 3] + box[:3, 0] * (1 + gap / 2)
+
+            assert obb_overlap(box, other) == expected
+            assert (len(mesh_intersections(box_triangles(box), box_triangles(other))) > 0) == expected
+
+        # Overlapping boxes with almost parallel edges
+        other[:3, :3] = rotation(rng.normal(size=3), angle) @ box[:3, :3]
+        other[:3, 3] = transform_points(box, rng.uniform(-.5, .5, (1, 3)))[0]
+
+        assert obb_overlap(box, other)
@@ -0,0 +1,158 @@
+import json, sys
+import numpy  as np
+import pytest
+
+from src.core            import log_reader
+from src.core.log_reader import decode_items, read_log, read_log_chunks, find_sequence_starts, load_logs, LogCache
+
+
+# -----------------------------------------------------------------------------
+def write_log(_filepath, _samples:int, _seed=0, _indent=None) -> list[dict]:
+    rng = np.random.default_rng(_seed)
+
+    items = [{
+        'state'     : int(rng.integers(0, 94)),
+        'timestamp' : f'{t // 3600}:{t // 60 % 60}:{t % 60 + rng.random():.3f}',
+        'location'  : dict(zip('xyz', rng.normal(0, 1000, 3).round(3).tolist())),
+    } for t in range(_samples)]
+
+    with open(_filepath, 'w') as f:
+        json.dump(items, f, indent=_indent)
+
+    return items
+
+
+# -----------------------------------------------------------------------------
+def reference(_items:list[dict]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    states = np.array([item['state'] for item in _items], dtype=np.int16)
+    locations = np.array([(item['location']['y'], item['location']['x'], item['location']['z']) for item in _items], dtype=np.float32)
+    timestamps = np.array([[float(v) for v in item['timestamp'].split(':')] for item in _items], dtype=np.float32)
+
+    return states, locations.reshape(-1, 3), timestamps.reshape(-1, 3)
+
+
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize('samples', [0, 1, 999, 5000])
+@pytest.mark.parametrize('chunk_size', [1, 64, 4096])
+def test_read_log_matches_json_load(tmp_path, samples, chunk_size):
+    filepath = tmp_path / 'log.json'
+    write_log(filepath, samples, _indent=2 if chunk_size == 64 else None)
+
+    with open(filepath) as f:
+        expected = reference(json.load(f))
+
+    for stream in (True, False):
+        columns = read_log(str(filepath), stream, chunk_size)
+
+        for column, e in zip(columns, expected):
+            assert column.dtype == e.dtype
+            np.testing.assert_array_equal(column, e)
+
+
+# -----------------------------------------------------------------------------
+def test_chunks_split_items_across_blocks(tmp_path):
+    """Blocks that are smaller than an item still decode every item"""
+    filepath = tmp_path / 'log.json'
+    items = write_log(filepath, 300, 1)
+
+    chunks = list(read_log_chunks(str(filepath), 128, _block_size=16))
+
+    assert [len(c[0]) for c in chunks] == [128, 128, 44]
+    np.testing.assert_array_equal(np.concatenate([c[0] for c in chunks]), decode_items(items)[0])
+
+
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize('text', ['[{"state": 1', '[{"state": 1, "timestamp": "0:0:1", "location": {"x": 0, "y": 0, "z": 0}}', '{}', '[{"state": ]'])
+def test_read_log_malformed(tmp_path, text):
+    filepath = tmp_path / 'log.json'
+    filepath.write_text(text)
+
+    with pytest.raises(ValueError):
+        read_log(str(filepath))
+
+
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize('timestamps', [['0:1'], ['0:0:1:2'], [''], ['0:0:x'], ['0:1', '0:0:1:2'], ['0::1', '0:0 5:1'], ['0:0:1', '0:1:']])
+def test_decode_items_malformed_timestamps(timestamps):
+    """Every item needs 3 fields, an extra field of one item does not make up for a missing field of another"""
+    items = [{'state': 1, 'timestamp': t, 'location': {'x': 0, 'y': 0, 'z': 0}} for t in timestamps]
+
+    with pytest.raises(ValueError):
+        decode_items(items)
+
+
+# -----------------------------------------------------------------------------
+def test_malformed_item_fails_early(tmp_path, monkeypatch):
+    """The rest of the log is not read to find out that an item can not be completed"""
+    filepath = tmp_path / 'log.json'
+    items = json.dumps([{'state': 1}] * 100_000)
+    filepath.write_text(items[:50] + '"state": }' + items[50:])
+
+    blocks = []
+
+    class CountingFile:
+        def __init__(self, *args):
+            self.file = open(*args)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            self.file.close()
+
+        def read(self, _size):
+            blocks.append(_size)
+            return self.file.read(_size)
+
+    monkeypatch.setattr(log_reader, 'open', CountingFile, raising=False)
+
+    with pytest.raises(ValueError):
+        list(log_reader.iter_log_items(str(filepath), 1024))
+
+    assert len(blocks) <= 2
+
+
+# -----------------------------------------------------------------------------
+def test_load_logs(tmp_path):
+    paths = [tmp_path / f'{k}.json' for k in range(3)]
+    expected = {str(path): write_log(path, 100 * k, k) for k, path in enumerate(paths)}
+
+    path = list(sys.path)
+    cache = LogCache(str(tmp_path / 'cache'))
+
+    for _ in range(2):
+        logs = list(load_logs([str(p) for p in paths], True, 2, cache))
+
+        assert sorted(log.filepath for log in logs) == sorted(expected)
+
+        for log in logs:
+            np.testing.assert_array_equal(log.states, reference(expected[log.filepath])[0])
+
+    # Workers import the module by its directory, this process does not
+    assert sys.path == path
+
+
+# -----------------------------------------------------------------------------
+def test_load_logs_evicts_when_closed(tmp_path):
+    paths = [tmp_path / f'{k}.json' for k in range(2)]
+
+    for k, path in enumerate(paths):
+        write_log(path, 100, k)
+
+    cache = LogCache(str(tmp_path / 'cache'))
+    list(load_logs([str(p) for p in paths], True, 1, cache))
+
+    # Everything is cached, the generator is closed after the first log
+    cache.max_bytes = 1
+    logs = load_logs([str(p) for p in paths], True, 1, cache)
+    next(logs)
+    logs.close()
+
+    assert not any((tmp_path / 'cache').iterdir())
+
+
+# -----------------------------------------------------------------------------
+def test_sequence_starts():
+    states = np.array([0, 0, 3, 3, 3, 5, 0, 5, 5], dtype=np.int16)
+
+    assert find_sequence_starts(states).tolist() == [True, True, True, False, False, True, True, True, False]
@@ -0,0 +1,197 @@
+import numpy  as np
+import pytest
+
+from src.core.states     import State
+from src.core.broadphase import SpatialHashGrid, overlap
+from src.core.geometry   import obb_overlap, rotation_z
+from src.core.modules    import ModulePrototype, PrototypeModule
+from src.core.map        import MapSettings, PrototypeMap
+
+
+# -----------------------------------------------------------------------------
+def random_aabbs(_rng:np.random.Generator, _count:int) -> tuple[np.ndarray, np.ndarray]:
+    lo = _rng.uniform(-20, 20, (_count, 3))
+    # Mostly small boxes and a few large ones
+    size = _rng.choice([.1, 1, 4, 15], p=[.3, .4, .25, .05], size=(_count, 1)) * _rng.uniform(0, 1, (_count, 3))
+
+    return lo, lo + size
+
+
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize('cell_size', [None, .05, 1, 4])
+def test_grid_query_matches_brute_force(cell_size):
+    rng = np.random.default_rng(0)
+    lo, hi = random_aabbs(rng, 300)
+
+    grid = SpatialHashGrid(cell_size)
+    boxes = {}
+
+    for step in range(900):
+        key = int(rng.integers(len(lo)))
+
+        if rng.random() < .2:
+            grid.remove(key)
+            boxes.pop(key, None)
+        else:
+            # Move the box
+            offset = rng.normal(0, 2, 3)
+            grid.update(key, lo[key] + offset, hi[key] + offset)
+            boxes[key] = (lo[key] + offset).tolist(), (hi[key] + offset).tolist()
+
+        if step % 50 == 0:
+            assert len(grid) == len(boxes)
+
+            for q in range(len(lo)):
+                expected = {k for k, box in boxes.items() if overlap(lo[q].tolist(), hi[q].tolist(), *box)}
+                assert grid.query(lo[q], hi[q]) == expected
+
+
+# -----------------------------------------------------------------------------
+def test_grid_large_boxes_after_a_degenerate_box():
+    """The first box sets the cell size, a flat box would make every later box cover millions of cells"""
+    grid = SpatialHashGrid()
+    grid.update('flat', np.zeros(3), np.array([1.0, 1.0, 0.0]))
+    grid.update('large', np.full(3, -50.0), np.full(3, 50.0))
+    grid.update('small', np.full(3, 2.0), np.full(3, 2.0005))
+
+    assert grid.cell_size == 1
+    assert grid.large == {'large'}
+    assert grid.query(np.full(3, 1.9), np.full(3, 2.1)) == {'large', 'small'}
+    assert grid.query(np.full(3, -100.0), np.full(3, 100.0)) == {'flat', 'large', 'small'}
+
+    grid = SpatialHashGrid()
+    grid.update('point', np.zeros(3), np.zeros(3))
+    grid.update('large', np.full(3, -50.0), np.full(3, 50.0))
+
+    assert grid.cell_size == 1e-3
+    assert sum(len(keys) for keys in grid.cells.values()) == 1
+
+    grid.remove('large')
+    assert not grid.large and grid.query(np.full(3, -1.0), np.ones(3)) == {'point'}
+
+
+# -----------------------------------------------------------------------------
+def module_library(_seed=0) -> dict[int, list[ModulePrototype]]:
+    """Curves that turn sharply with boxes around them, so that maps run into themselves"""
+    rng = np.random.default_rng(_seed)
+    library = {}
+
+    for state in (State.Walking, State.WallRunningLeft, State.Jump, State.Falling):
+        prototypes = []
+
+        for k in range(3):
+            length = rng.uniform(2, 6)
+            angle = rng.uniform(-150, 150)
+            points = np.array([(0, 0, 0), (length, 0, 0), (length, 0, 0) + rotation_z(angle) @ (length, 0, 0)])
+
+            volume = np.diag([length * 1.2, rng.uniform(.5, 2), 1, 1])
+            volume[:3, 3] = (length * .5, 0, .5)
+
+            prototypes.append(ModulePrototype(f'{state.name}_{k}', points, None, volume))
+
+        library[state.value] = prototypes
+
+    return library
+
+
+# -----------------------------------------------------------------------------
+def brute_force_hits(_map:PrototypeMap, _last:int) -> dict[tuple[int, int], int]:
+    hits = {}
+
+    for k in range(_last + 1):
+        for j in range(k):
+            if obb_overlap(_map[k].volume_matrix(), _map[j].volume_matrix()):
+                hits[k, j] = 1
+
+    return hits
+
+
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize('seed', range(4))
+def test_incremental_hits_match_brute_force(seed):
+    library = module_library(seed)
+    rng = np.random.default_rng(seed)
+    states = rng.choice(list(library), size=40).tolist()
+
+    map = PrototypeMap(library, None, MapSettings(seed, -1, seed % 2 == 1, True, 20))
+    map.debug = False
+    map.prepare(states)
+
+    # Place the modules one by one, like `build`
+    for k, cm in enumerate(map):
+        cm.next_module()
+        map.align_module(k)
+        map.update_hits()
+
+        assert {(a, b): n for a, row in map.hits.items() for b, n in row.items()} == brute_force_hits(map, k)
+
+    assert sum(brute_force_hits(map, len(map) - 1).values()) > 0
+
+    # Swapping modules moves every module after them
+    for _ in range(20):
+        indices = sorted(rng.choice(len(map), size=2, replace=False).tolist())
+        map.apply_configuration(indices, rng.integers(3, size=2).tolist())
+
+        end = int(rng.integers(len(map)))
+        expected = brute_force_hits(map, end)
+
+        assert map.check_intersections_range(end) == len(expected)
+        assert map.check_intersection(end) == sum(1 for k, _ in expected if k == end)
+
+
+# -----------------------------------------------------------------------------
+def test_build_resolves_intersections():
+    library = module_library(1)
+    states = np.random.default_rng(1).choice(list(library), size=60).tolist()
+
+    map = PrototypeMap(library, None, MapSettings(1, -1, False, True, 20))
+    map.debug = False
+    map.prepare(states)
+
+    _, _, _, hits = map.build()
+
+    assert map.check_intersections_range(len(map) - 1) == len(brute_force_hits(map, len(map) - 1))
+    assert len(hits) == len(map)
+
+
+# -----------------------------------------------------------------------------
+class MeshModule(PrototypeModule):
+    """Tested with `intersect` like a mesh volume, an intersection has several face pairs"""
+    def box(self):
+        return None
+
+    def intersect(self, _other):
+        return [(0, 0), (1, 2), (3, 1)] if super().intersect(_other) else []
+
+
+class MeshMap(PrototypeMap):
+    def create_module(self, _state, _module_names):
+        return MeshModule(_state, [p for p in self.prototypes[_state] if p.name in _module_names])
+
+
+# -----------------------------------------------------------------------------
+def test_mesh_hits_count_face_pairs():
+    """A pair of boxes is one hit, a pair of meshes has a hit for every pair of intersecting faces"""
+    library = module_library(2)
+    states = np.random.default_rng(2).choice(list(library), size=40).tolist()
+
+    maps = []
+
+    for cls in (PrototypeMap, MeshMap):
+        map = cls(library, None, MapSettings(2, -1, False, True, 20))
+        map.debug = False
+        map.prepare(states)
+
+        for k, cm in enumerate(map):
+            cm.next_module()
+            map.align_module(k)
+
+        maps.append(map)
+
+    assert [cm.module_name for cm in maps[0]] == [cm.module_name for cm in maps[1]]
+
+    box_hits, mesh_hits = (m.check_intersections_range(len(m) - 1) for m in maps)
+
+    assert box_hits > 0
+    assert mesh_hits == 3 * box_hits
+    assert maps[1].hits == {k: {j: 3 * n for j, n in row.items()} for k, row in maps[0].hits.items()}
@@ -0,0 +1,76 @@
+import numpy  as np
+import pytest
+
+from src.core.states      import State
+from src.core.markov      import MarkovChain
+from src.core.constraints import apply_constraints
+
+from test_constraints import RULE_STATES
+
+
+# -----------------------------------------------------------------------------
+@pytest.fixture(params=[1, 2, 3], ids=lambda order: f'order {order}')
+def chain(request) -> MarkovChain:
+    rng = np.random.default_rng(0)
+    values = np.array([s.value for s in RULE_STATES])
+
+    # The pattern of every rule occurs, so that constrained chains drop and merge states
+    rules = [State.Jump, State.WallClimbing, State.WallClimb180TurnJump, State.Falling, 
+             State.WallRunningLeft, State.WallRunJump, State.WallClimbing, State.WallClimb180TurnJump]
+    sequences = [values[rng.integers(len(values), size=300)] for _ in range(4)]
+    sequences.append(np.array([s.value for s in rules] * 30))
+
+    mc = MarkovChain()
+    assert mc.create_transition_matrix(sequences, _order=request.param)
+
+    return mc
+
+
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize('length', [1, 2, 17, 600])
+def test_generate_chains_matches_generate_chain(chain, length):
+    seeds = list(range(20))
+    chains = chain.generate_chains(length, seeds, _block_size=64)
+
+    assert chains.shape == (len(seeds), length)
+
+    for seed, row in zip(seeds, chains):
+        assert row.tolist() == chain.generate_chain(length, seed)
+
+
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize('length', [1, 4, 17, 300])
+def test_constrained_chains(chain, length):
+    """A constrained chain is the start of the filtered unconstrained chain with the same seed"""
+    seeds = list(range(20))
+    chains = chain.generate_chains(length, seeds, _block_size=64, _constrained=True)
+
+    assert chains.shape == (len(seeds), length)
+
+    for seed, row in zip(seeds, chains):
+        assert row.tolist() == chain.generate_chain(length, seed, _constrained=True)
+
+        # Enough states to decide `length` states, even if a lot of them are dropped
+        states = np.array(chain.generate_chain(4 * length + 16, seed))
+        keep, replaced = apply_constraints(states, False)
+
+        assert row.tolist() == replaced[keep][:length].tolist()
+
+
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize('order', [0, MarkovChain.MAX_ORDER + 1, 9])
+def test_order_out_of_range(order):
+    with pytest.raises(ValueError):
+        MarkovChain().create_transition_matrix([np.array([1, 2, 3])], _order=order)
+
+
+# -----------------------------------------------------------------------------
+def test_max_order_with_every_state():
+    rng = np.random.default_rng(1)
+    sequences = [rng.integers(len(State), size=2000)]
+
+    mc = MarkovChain()
+    assert mc.create_transition_matrix(sequences, _order=MarkovChain.MAX_ORDER)
+
+    chain = mc.generate_chain(200, 0)
+    assert len(chain) == 200 and all(0 <= s < len(State) for s in chain)
@@ -0,0 +1,19 @@
+import numpy as np
+
+from src.core.modules import ModulePrototype, PrototypeModule
+
+
+# -----------------------------------------------------------------------------
+def test_next_name_cycles_through_the_names():
+    np.random.seed(0)
+    module = PrototypeModule(0, [ModulePrototype(name, np.zeros((2, 3))) for name in 'abcd'])
+
+    names = [module.next_name() for _ in range(8)]
+
+    assert sorted(names[:4]) == list('abcd')
+    assert names[4:] == names[:4]
+
+    # An index in range picks that name and does not advance the cycle
+    assert module.next_name(2) == module.module_names[2]
+    assert module.next_name(-1) == names[0]
+    assert module.next_name(4) == names[1]